@@ -0,0 +1,147 @@
+import atexit
+import json
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.utils.functional import LazyObject, empty
+
+from .routing import PrefixMatcher
+
+
+DEFAULTS = {
+    'path': 'requests.log',
+    'format': 'text',       # or 'json' for one JSON object per line
+    'max_queue': 10000,     # records waiting to be written
+    'batch_size': 100,      # write as soon as this many records are waiting
+    'flush_interval': 1.0,  # or at the latest after this many seconds
+    # Path prefixes to log or not, the longest matching prefix wins; with an
+    # allow list, paths that match neither list are not logged
+    'allow': [],
+    'deny': [],
+}
+
+
+def load_config():
+    """
+    settings.REQUEST_LOG merged over DEFAULTS.
+    """
+    return {**DEFAULTS, **getattr(settings, 'REQUEST_LOG', {})}
+
+
+class AccessLogWriter:
+    """
+    Non-blocking access log.
+
+    Request threads only put a line on a bounded queue; a daemon thread
+    writes the lines to the file in batches. When the queue is full the line
+    is dropped and counted instead of blocking the request, and the number of
+    dropped lines is written to the log with the next batch.
+    """
+
+    _stop = object()
+
+    def __init__(self, path, max_queue=10000, batch_size=100, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._reported_dropped = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='access-log-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def write(self, line):
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            # Unsynchronized on purpose: an approximate count is good enough
+            self.dropped += 1
+
+    def close(self, timeout=5):
+        """
+        Write everything still queued and stop the writer thread.
+        """
+        if self._thread is None:
+            return
+        self.queue.put(self._stop)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                line = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                line = None
+
+            if line is self._stop:
+                self._write(batch)
+                return
+            if line is not None:
+                batch.append(line)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._write(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write(self, batch):
+        dropped = self.dropped - self._reported_dropped
+        if dropped:
+            batch.append(f"access log queue full: dropped {dropped} records")
+            self._reported_dropped += dropped
+        if not batch:
+            return
+        with open(self.path, 'a', encoding='utf-8') as log_file:
+            log_file.write('\n'.join(batch) + '\n')
+
+
+def path_filter(allow, deny):
+    """
+    PrefixMatcher telling whether a path is logged (True) or not (False);
+    None means the path matches neither list.
+    """
+    return PrefixMatcher({
+        **{prefix: True for prefix in allow},
+        **{prefix: False for prefix in deny},
+    })
+
+
+def loaded_user(request):
+    """
+    The user of the request if something already loaded it, else None.
+
+    AuthenticationMiddleware sets request.user to a lazy object and request
+    .auser() caches its result; neither is resolved here, so requests whose
+    view never looked at the user do not pay for the session and user
+    lookups just to be logged.
+    """
+    user = request.__dict__.get('user')
+    if isinstance(user, LazyObject):
+        user = None if user._wrapped is empty else user._wrapped
+    if user is None:
+        user = request.__dict__.get('_acached_user')
+    return user
+
+
+def format_text(timestamp, user, path, **extra):
+    # Same line as the original synchronous logger wrote
+    return f"{timestamp} - User: {user} - Path: {path}"
+
+
+def format_json(timestamp, user, path, **extra):
+    return json.dumps(
+        {'time': timestamp.isoformat(), 'user': str(user), 'path': path, **extra},
+        separators=(',', ':')
+    )
+
+
+FORMATTERS = {'text': format_text, 'json': format_json}
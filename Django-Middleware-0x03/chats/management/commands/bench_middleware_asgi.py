@@ -0,0 +1,187 @@
+import asyncio
+import os
+import statistics
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import override_settings
+from django.urls import path
+
+
+from chats.middleware import (
+    HybridMiddleware,
+    OffensiveLanguageMiddleware,
+    RequestLoggingMiddleware,
+    RestrictAccessByTimeMiddleware,
+    RolePermissionMiddleware,
+)
+
+
+async def ping(request):
+    return HttpResponse("pong")
+
+
+urlpatterns = [path('chat/ping/', ping)]
+
+
+class OpenAllDayMiddleware(RestrictAccessByTimeMiddleware):
+    # The benchmark must not depend on the time it is run at
+    opening_hour = 0
+    closing_hour = 23
+
+
+# The same middleware as Django saw them before they were async-capable:
+# under ASGI each one is wrapped in sync_to_async and run on the sync thread
+class SyncRequestLoggingMiddleware(RequestLoggingMiddleware):
+    async_capable = False
+
+
+class SyncOpenAllDayMiddleware(OpenAllDayMiddleware):
+    async_capable = False
+
+
+class SyncOffensiveLanguageMiddleware(OffensiveLanguageMiddleware):
+    async_capable = False
+
+
+class SyncRolePermissionMiddleware(RolePermissionMiddleware):
+    async_capable = False
+
+
+class AnonymousUserMiddleware(HybridMiddleware):
+    # Stand-in for AuthenticationMiddleware, which is sync-only as of
+    # Django 5.1 and would add its own thread switches to both stacks
+    def call(self, request):
+        request.user = AnonymousUser()
+        return self.get_response(request)
+
+    async def acall(self, request):
+        request.user = AnonymousUser()
+
+        async def auser():
+            return request.user
+
+        request.auser = auser
+        return await self.get_response(request)
+
+
+AUTH_MIDDLEWARE = [f'{__name__}.AnonymousUserMiddleware']
+
+DJANGO_AUTH_MIDDLEWARE = [
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+]
+
+STACKS = {
+    'sync-only': [
+        f'{__name__}.SyncRequestLoggingMiddleware',
+        f'{__name__}.SyncOpenAllDayMiddleware',
+        f'{__name__}.SyncOffensiveLanguageMiddleware',
+        f'{__name__}.SyncRolePermissionMiddleware',
+    ],
+    'async': [
+        f'{__name__}.RequestLoggingMiddleware',
+        f'{__name__}.OpenAllDayMiddleware',
+        f'{__name__}.OffensiveLanguageMiddleware',
+        f'{__name__}.RolePermissionMiddleware',
+    ],
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare throughput and latency of an async view behind the chats "
+        "middleware under ASGI, with sync-only and with async-capable "
+        "middleware. Requests are fed straight to Django's ASGIHandler, so "
+        "no server is needed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=2000,
+            help="Requests per stack."
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=50,
+            help="Requests in flight at the same time."
+        )
+        parser.add_argument(
+            '--django-auth', action='store_true',
+            help="Run Django's session and authentication middleware in front "
+                 "of both stacks instead of an async anonymous user stand-in."
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'stack':>10} {'req/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+        auth = DJANGO_AUTH_MIDDLEWARE if options['django_auth'] else AUTH_MIDDLEWARE
+        for name, stack in STACKS.items():
+            with override_settings(
+                MIDDLEWARE=auth + stack,
+                ROOT_URLCONF=__name__,
+                REQUEST_LOG={'path': os.devnull},
+                CHAT_RATE_LIMITS={'backend': 'memory'},
+            ):
+                handler = ASGIHandler()
+                elapsed, latencies = asyncio.run(
+                    self.run_stack(handler, options['requests'], options['concurrency'])
+                )
+            quantiles = statistics.quantiles(latencies, n=100)
+            self.stdout.write(
+                f"{name:>10} {len(latencies) / elapsed:>10.0f} {quantiles[49] * 1000:>10.2f} "
+                f"{quantiles[94] * 1000:>10.2f} {quantiles[98] * 1000:>10.2f}"
+            )
+
+    async def run_stack(self, handler, total, concurrency):
+        latencies = []
+        slots = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with slots:
+                started = time.perf_counter()
+                status = await self.request(handler, '/chat/ping/')
+                latencies.append(time.perf_counter() - started)
+                if status != 200:
+                    raise RuntimeError(f"GET /chat/ping/ returned {status}")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        return time.perf_counter() - started, latencies
+
+    async def request(self, handler, request_path):
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': request_path,
+            'raw_path': request_path.encode(),
+            'query_string': b'',
+            'root_path': '',
+            'headers': [(b'host', b'testserver')],
+            'client': ('127.0.0.1', 50000),
+            'server': ('testserver', 80),
+        }
+        body_sent = False
+        disconnected = asyncio.Event()
+        response = {}
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # Django listens for a disconnect while the view runs
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+
+        await handler(scope, receive, send)
+        disconnected.set()
+        return response.get('status')
@@ -0,0 +1,52 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from chats.routing import PrefixMatcher
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare a per-request any(startswith) scan of the role rules with "
+        "the compiled PrefixMatcher used by RolePermissionMiddleware."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rules', type=int, default=500,
+            help="Number of configured path prefixes."
+        )
+        parser.add_argument(
+            '--number', type=int, default=20000,
+            help="Lookups per timed run; the best of 5 runs is reported."
+        )
+
+    def handle(self, *args, **options):
+        # Realistic shape: many rules sharing a few leading segments
+        prefixes = [
+            f'/chat/{section}/{index}/'
+            for index in range(options['rules'] // 4 + 1)
+            for section in ('manage', 'delete', 'reports', 'rooms')
+        ][:options['rules']]
+        matcher = PrefixMatcher({prefix: frozenset({'admin'}) for prefix in prefixes})
+
+        def scan(path):
+            # What the middleware did before: rebuild the list, then scan it
+            restricted_paths = list(prefixes)
+            return any(path.startswith(prefix) for prefix in restricted_paths)
+
+        paths = {
+            'no match': '/api/conversations/42/messages/',
+            'first rule': prefixes[0] + 'item/',
+            'last rule': prefixes[-1] + 'item/',
+        }
+        self.stdout.write(f"{len(prefixes)} rules")
+        self.stdout.write(f"{'path':>12} {'scan us':>10} {'matcher us':>12}")
+        for name, path in paths.items():
+            assert scan(path) == (matcher.match(path) is not None)
+            results = [
+                min(timeit.repeat(lambda: lookup(path), number=options['number'], repeat=5))
+                / options['number'] * 1e6
+                for lookup in (scan, matcher.match)
+            ]
+            self.stdout.write(f"{name:>12} {results[0]:>10.2f} {results[1]:>12.2f}")
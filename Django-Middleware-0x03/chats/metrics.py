@@ -0,0 +1,181 @@
+import bisect
+import contextvars
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponseForbidden, JsonResponse
+
+
+DEFAULTS = {
+    'sample_rate': 0.0,     # share of requests to instrument, 0 turns it off
+    'server_timing': True,  # add a Server-Timing header to sampled responses
+    # Histogram bucket upper bounds, in milliseconds
+    'buckets': [1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000],
+}
+
+
+def load_config():
+    """
+    settings.CHAT_METRICS merged over DEFAULTS.
+    """
+    return {**DEFAULTS, **getattr(settings, 'CHAT_METRICS', {})}
+
+
+class RequestTimings:
+    """
+    What one sampled request spent, in seconds.
+    """
+    __slots__ = ('queries', 'db', 'serializer', 'serializing', 'db_measured')
+
+    def __init__(self, db_measured=True):
+        # Queries of async requests run on other threads, out of reach of
+        # the execute_wrapper() installed by the middleware
+        self.db_measured = db_measured
+        self.queries = 0
+        self.db = 0.0
+        self.serializer = 0.0
+        self.serializing = False
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper() hook
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+
+
+# Timings of the request being handled, None when it is not sampled
+current_timings = contextvars.ContextVar('chats_request_timings', default=None)
+
+
+class TimedSerializerMixin:
+    """
+    Count the time spent in to_representation() as serializer time of the
+    sampled request. Nested serializers are only counted once, by the
+    outermost one.
+    """
+
+    def to_representation(self, instance):
+        timings = current_timings.get()
+        if timings is None or timings.serializing:
+            return super().to_representation(instance)
+        timings.serializing = True
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            timings.serializer += time.perf_counter() - started
+            timings.serializing = False
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One more count for the values above the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+    def as_dict(self):
+        bounds = [*self.buckets, '+Inf']
+        return {
+            'buckets': {str(bound): count for bound, count in zip(bounds, self.counts)},
+            'sum': round(self.total, 3),
+        }
+
+
+class RouteStats:
+    def __init__(self, buckets):
+        self.count = 0
+        self.queries = 0
+        self.wall = Histogram(buckets)
+        self.db = Histogram(buckets)
+        self.serializer = Histogram(buckets)
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'queries': self.queries,
+            'wall_ms': self.wall.as_dict(),
+            'db_ms': self.db.as_dict(),
+            'serializer_ms': self.serializer.as_dict(),
+        }
+
+
+class MetricsRegistry:
+    """
+    Per-route histograms of wall, database and serializer time, in ms,
+    kept in memory for this process.
+    """
+
+    def __init__(self, buckets=None):
+        self.buckets = sorted(buckets or DEFAULTS['buckets'])
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def set_buckets(self, buckets):
+        buckets = sorted(buckets)
+        with self.lock:
+            if buckets != self.buckets:
+                self.buckets = buckets
+                self.routes.clear()
+
+    def record(self, route, wall, timings):
+        with self.lock:
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = RouteStats(self.buckets)
+            stats.count += 1
+            stats.wall.observe(wall * 1000)
+            stats.serializer.observe(timings.serializer * 1000)
+            if timings.db_measured:
+                stats.queries += timings.queries
+                stats.db.observe(timings.db * 1000)
+
+    def snapshot(self):
+        with self.lock:
+            return {route: stats.as_dict() for route, stats in sorted(self.routes.items())}
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+
+
+# Shared by the instrumentation middleware and metrics_view of this process
+registry = MetricsRegistry()
+
+
+def route_of(request):
+    """
+    The URL pattern that handled the request, so that /chat/1/ and /chat/2/
+    end up in the same histogram.
+    """
+    match = getattr(request, 'resolver_match', None)
+    route = match.route if match is not None else '<unmatched>'
+    return f'{request.method} {route}'
+
+
+def server_timing(wall, timings):
+    entries = [f'total;dur={wall * 1000:.3f}']
+    if timings.db_measured:
+        entries.append(f'db;dur={timings.db * 1000:.3f};desc="{timings.queries} queries"')
+    entries.append(f'serializer;dur={timings.serializer * 1000:.3f}')
+    return ', '.join(entries)
+
+
+def metrics_view(request):
+    """
+    JSON dump of the per-route histograms, for admins and staff only.
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated or not (
+        user.is_staff or getattr(user, 'role', None) == 'admin'
+    ):
+        return HttpResponseForbidden("Access denied: Insufficient permissions.")
+    return JsonResponse({'routes': registry.snapshot()})
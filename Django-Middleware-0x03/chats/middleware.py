@@ -1,99 +1,261 @@
-import logging
-from datetime import datetime, timedelta
+import random
+import time
+from contextlib import ExitStack
+from datetime import datetime
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
 from django.http import HttpResponseForbidden
+from . import accesslog, metrics
+from .ratelimit import RateLimiter
+from .routing import PrefixMatcher
 
 
-class RequestLoggingMiddleware:
+class HybridMiddleware:
+    """
+    Base for middleware that runs natively in both sync (WSGI) and async
+    (ASGI) stacks, so Django never has to switch threads around it.
+
+    Subclasses implement call(request) and the coroutine acall(request);
+    the async path must not do blocking I/O.
+    """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
-        # Configure logging
-        logging.basicConfig(
-            filename='requests.log',
-            level=logging.INFO,
-            format='%(message)s',
-        )
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
-        user = request.user if request.user.is_authenticated else "Anonymous"
-        log_message = f"{datetime.now()} - User: {user} - Path: {request.path}"
-        logging.info(log_message)
+        if self.async_mode:
+            return self.acall(request)
+        return self.call(request)
+
+
+class RequestLoggingMiddleware(HybridMiddleware):
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        # Lines are queued here and written in batches by a background
+        # thread, see settings.REQUEST_LOG and chats.accesslog
+        config = accesslog.load_config()
+        self.paths = accesslog.path_filter(config['allow'], config['deny'])
+        self.log_unmatched = not config['allow']
+        self.format_record = accesslog.FORMATTERS[config['format']]
+        self.writer = accesslog.AccessLogWriter(
+            config['path'],
+            max_queue=config['max_queue'],
+            batch_size=config['batch_size'],
+            flush_interval=config['flush_interval'],
+        )
+        self.writer.start()
+
+    def call(self, request):
+        if not self.logged(request.path):
+            return self.get_response(request)
+        timestamp = datetime.now()
+        started = time.perf_counter()
         response = self.get_response(request)
+        self.log(request, timestamp, started, response)
         return response
 
+    async def acall(self, request):
+        if not self.logged(request.path):
+            return await self.get_response(request)
+        timestamp = datetime.now()
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.log(request, timestamp, started, response)
+        return response
 
-class RestrictAccessByTimeMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
+    def logged(self, path):
+        logged = self.paths.match(path)
+        return self.log_unmatched if logged is None else logged
 
-    def __call__(self, request):
+    def log(self, request, timestamp, started, response):
+        # The user is only named if the view loaded it, "-" otherwise
+        user = accesslog.loaded_user(request)
+        if user is None:
+            user = "-"
+        elif not user.is_authenticated:
+            user = "Anonymous"
+        # Only queues the line, never blocks on the file
+        self.writer.write(self.format_record(
+            timestamp, user, request.path,
+            method=request.method,
+            status=response.status_code,
+            duration_ms=round((time.perf_counter() - started) * 1000, 3),
+        ))
+
+
+class RestrictAccessByTimeMiddleware(HybridMiddleware):
+    # Chat is open from opening_hour:00 to closing_hour:59
+    opening_hour = 9
+    closing_hour = 18
+
+    def call(self, request):
+        return self.check_time() or self.get_response(request)
+
+    async def acall(self, request):
+        return self.check_time() or await self.get_response(request)
+
+    def check_time(self):
         # Get the current server time
         current_hour = datetime.now().hour
 
         # Define restricted hours (outise 9AM - 6AM)
-        if current_hour < 9 or current_hour > 18:
+        if current_hour < self.opening_hour or current_hour > self.closing_hour:
             return HttpResponseForbidden("Access to the chat is restricted outside of 9AM to 6PM.")
 
         # Proceed with the request if within allowed hours
-        return self.get_response(request)
+        return None
 
 
-class OffensiveLanguageMiddleware:
+class OffensiveLanguageMiddleware(HybridMiddleware):
     def __init__(self, get_response):
-        self.get_response = get_response
-        # Dictionary to track requests from IP addresses
-        self.request_logs = {}
+        super().__init__(get_response)
+        # Rules and counters backend from settings.CHAT_RATE_LIMITS
+        # (5 POSTs per minute and per IP on /chat/ by default)
+        self.rate_limiter = RateLimiter.from_settings()
 
-    def __call__(self, request):
-        # Only apply the middleware to POST requests to the chat endpoint
-        if request.method == "POST" and request.path.startswith("/chat/"):
-            ip = self.get_client_ip(request)
-            current_time = datetime.now()
-
-            # Initialize or update the log for this IP address
-            if ip not in self.request_logs:
-                self.request_logs[ip] = []
-
-            # Remove requests older than 1 minute from the log
-            self.request_logs[ip] = [
-                timestamp for timestamp in self.request_logs[ip]
-                if timestamp > current_time - timedelta(minutes=1)
-            ]
+    def call(self, request):
+        if not self.rate_limiter.allow(request, self.get_client_ip):
+            return HttpResponseForbidden("Message limit exceeded. Try again later.")
 
-            # Check if the limit of 5 messages per minute is exceeded
-            if len(self.request_logs[ip]) >= 5:
-                return HttpResponseForbidden("Message limit exceeded. Try again later.")
+        return self.get_response(request)
 
-            # Log the current request
-            self.request_logs[ip].append(current_time)
+    async def acall(self, request):
+        if not await self.rate_limiter.aallow(request, self.get_client_ip):
+            return HttpResponseForbidden("Message limit exceeded. Try again later.")
 
-        return self.get_response(request)
+        return await self.get_response(request)
 
     def get_client_ip(self, request):
         """Get the IP address of the client."""
         x_forwarded_for = request.META.get("HTTP_X_FORWARDED_FOR")
         if x_forwarded_for:
-            return x_forwarded_for.split(",")[0]
+            return x_forwarded_for.split(",")[0].strip()
         return request.META.get("REMOTE_ADDR")
 
 
-class RolePermissionMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
+class RolePermissionMiddleware(HybridMiddleware):
+    """
+    Restrict paths to user roles.
 
-    def __call__(self, request):
-        # Define restricted paths (e.g., admin-only actions)
-        restricted_paths = ["/chat/manage/", "/chat/delete/"]
+    Configured with settings.CHAT_ROLE_RULES, a list of path prefixes and
+    the roles allowed on them; the longest matching prefix applies:
 
-        # Check if the path requires a role check
-        if any(request.path.startswith(path) for path in restricted_paths):
-            # Ensure the user is authenticated
-            if not request.user.is_authenticated:
-                return HttpResponseForbidden("Access denied: Login required.")
+        CHAT_ROLE_RULES = [
+            {'path': '/chat/manage/', 'roles': ['admin', 'moderator']},
+            {'path': '/chat/manage/reports/', 'roles': ['admin']},
+        ]
+
+    The rules are compiled once at startup, and the user is only loaded for
+    requests that match one.
+    """
+    # Used when settings.CHAT_ROLE_RULES is not set (admin-only actions)
+    default_rules = [
+        {'path': '/chat/manage/', 'roles': ['admin', 'moderator']},
+        {'path': '/chat/delete/', 'roles': ['admin', 'moderator']},
+    ]
 
-            # Check the user's role
-            user_role = getattr(request.user, "role", None)  # Assume 'role' is a field on the User model
-            if user_role not in ["admin", "moderator"]:
-                return HttpResponseForbidden("Access denied: Insufficient permissions.")
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        rules = getattr(settings, 'CHAT_ROLE_RULES', self.default_rules)
+        self.rules = PrefixMatcher({rule['path']: frozenset(rule['roles']) for rule in rules})
+
+    def call(self, request):
+        # Check if the path requires a role check
+        roles = self.rules.match(request.path)
+        if roles is not None:
+            denied = self.check_role(request.user, roles)
+            if denied:
+                return denied
 
         # Proceed with the request if no restrictions apply
         return self.get_response(request)
+
+    async def acall(self, request):
+        roles = self.rules.match(request.path)
+        if roles is not None:
+            denied = self.check_role(await request.auser(), roles)
+            if denied:
+                return denied
+
+        return await self.get_response(request)
+
+    def check_role(self, user, roles):
+        # Ensure the user is authenticated
+        if not user.is_authenticated:
+            return HttpResponseForbidden("Access denied: Login required.")
+
+        # Check the user's role
+        user_role = getattr(user, "role", None)  # Assume 'role' is a field on the User model
+        if user_role not in roles:
+            return HttpResponseForbidden("Access denied: Insufficient permissions.")
+
+        return None
+
+
+class InstrumentationMiddleware(HybridMiddleware):
+    """
+    Measure wall time, database queries and time, and serializer time of a
+    sample of the requests.
+
+    Configured with settings.CHAT_METRICS (see chats.metrics.DEFAULTS).
+    Sampled responses get a Server-Timing header and are added to per-route
+    histograms, served as JSON by chats.metrics.metrics_view. Serializer
+    time is only seen for serializers using metrics.TimedSerializerMixin.
+
+    With a sample rate of 0 the middleware removes itself from the stack.
+    """
+
+    def __init__(self, get_response):
+        config = metrics.load_config()
+        if not config['sample_rate']:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.sample_rate = config['sample_rate']
+        self.server_timing = config['server_timing']
+        self.registry = metrics.registry
+        self.registry.set_buckets(config['buckets'])
+
+    def call(self, request):
+        if not self.sampled():
+            return self.get_response(request)
+
+        timings = metrics.RequestTimings()
+        token = metrics.current_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings))
+                response = self.get_response(request)
+        finally:
+            metrics.current_timings.reset(token)
+        return self.record(request, response, time.perf_counter() - started, timings)
+
+    async def acall(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+
+        timings = metrics.RequestTimings(db_measured=False)
+        token = metrics.current_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current_timings.reset(token)
+        return self.record(request, response, time.perf_counter() - started, timings)
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def record(self, request, response, wall, timings):
+        self.registry.record(metrics.route_of(request), wall, timings)
+        if self.server_timing:
+            response['Server-Timing'] = metrics.server_timing(wall, timings)
+        return response
@@ -0,0 +1,257 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+# Used when settings.CHAT_RATE_LIMITS does not define any rule:
+# 5 chat messages per minute and per IP address, as before
+DEFAULT_RULES = [
+    {'path': '/chat/', 'methods': ['POST'], 'limit': 5, 'window': 60, 'per': 'ip'},
+]
+
+
+def sliding_window_count(previous, current, window, now):
+    """
+    Estimate the number of hits in the last `window` seconds from the
+    counters of the previous and the current fixed window.
+    """
+    elapsed = (now % window) / window
+    return previous * (1 - elapsed) + current
+
+
+class MemoryRateLimitBackend:
+    """
+    Sliding-window counters kept in this process.
+
+    Every hit is O(1), and the least recently seen keys are evicted once
+    more than `max_keys` are tracked, so memory stays bounded. Limits are
+    per process: with N workers a client may get up to N times the limit.
+    """
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self.counters = OrderedDict()
+        self.lock = threading.Lock()
+
+    def hit(self, key, limit, window, now=None):
+        """
+        Count a hit for `key`; return False if it exceeds the limit.
+        """
+        now = time.time() if now is None else now
+        index = math.floor(now / window)
+        with self.lock:
+            counter = self.counters.get(key)
+            if counter is None:
+                counter = self.counters[key] = [index, 0, 0]
+                if len(self.counters) > self.max_keys:
+                    self.counters.popitem(last=False)
+            else:
+                self.counters.move_to_end(key)
+                if counter[0] != index:
+                    # Roll over: the current window becomes the previous one,
+                    # or both are empty if more than a window went by
+                    counter[2] = counter[1] if counter[0] == index - 1 else 0
+                    counter[1] = 0
+                    counter[0] = index
+
+            if sliding_window_count(counter[2], counter[1], window, now) >= limit:
+                return False
+            counter[1] += 1
+            return True
+
+    async def ahit(self, key, limit, window, now=None):
+        # Pure memory work under a short lock, safe to run on the event loop
+        return self.hit(key, limit, window, now)
+
+
+class CacheRateLimitBackend:
+    """
+    Sliding-window counters in a Django cache, shared by every worker that
+    uses the same cache (Redis, Memcached, database...).
+
+    Counters are updated with the cache's atomic incr(); a refused hit is
+    given back so that it does not extend the block.
+    """
+
+    def __init__(self, alias='default', prefix='chats:ratelimit'):
+        self.alias = alias
+        self.prefix = prefix
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def hit(self, key, limit, window, now=None):
+        now = time.time() if now is None else now
+        current_key, previous_key = self.keys(key, window, now)
+
+        # Both fixed windows must outlive the sliding window that reads them
+        self.cache.add(current_key, 0, timeout=window * 2)
+        try:
+            current = self.cache.incr(current_key)
+        except ValueError:
+            # Evicted between add() and incr()
+            self.cache.add(current_key, 1, timeout=window * 2)
+            current = 1
+        previous = self.cache.get(previous_key, 0)
+
+        # `current` includes this hit, the limit check must not
+        if sliding_window_count(previous, current - 1, window, now) >= limit:
+            try:
+                self.cache.decr(current_key)
+            except ValueError:
+                pass
+            return False
+        return True
+
+    async def ahit(self, key, limit, window, now=None):
+        """
+        Same as hit() with the cache's async API.
+        """
+        now = time.time() if now is None else now
+        current_key, previous_key = self.keys(key, window, now)
+
+        await self.cache.aadd(current_key, 0, timeout=window * 2)
+        try:
+            current = await self.cache.aincr(current_key)
+        except ValueError:
+            await self.cache.aadd(current_key, 1, timeout=window * 2)
+            current = 1
+        previous = await self.cache.aget(previous_key, 0)
+
+        if sliding_window_count(previous, current - 1, window, now) >= limit:
+            try:
+                await self.cache.adecr(current_key)
+            except ValueError:
+                pass
+            return False
+        return True
+
+    def keys(self, key, window, now):
+        index = math.floor(now / window)
+        return f'{self.prefix}:{key}:{index}', f'{self.prefix}:{key}:{index - 1}'
+
+
+class RateLimitRule:
+    """
+    One limit: `limit` requests per `window` seconds on paths starting with
+    `path`, counted per client IP or per authenticated user.
+
+    `user_limits` overrides the limit for given user IDs or roles; a value
+    of None means unlimited.
+    """
+
+    def __init__(self, path, limit, window=60, methods=None, per='ip', user_limits=None):
+        if per not in ('ip', 'user'):
+            raise ValueError(f"Unknown rate limit scope: {per!r}")
+        self.path = path
+        self.limit = limit
+        self.window = window
+        self.methods = {method.upper() for method in methods} if methods else None
+        self.per = per
+        self.user_limits = {str(key): value for key, value in (user_limits or {}).items()}
+        # Part of every counter key: rules on the same path must not share
+        # their counters
+        self.name = '{}:{}:{}/{}s'.format(
+            path, ','.join(sorted(self.methods or ['*'])), limit, window
+        )
+
+    @property
+    def needs_user(self):
+        return self.per == 'user' or bool(self.user_limits)
+
+    def matches(self, request):
+        if self.methods is not None and request.method not in self.methods:
+            return False
+        return request.path.startswith(self.path)
+
+    def limit_for(self, user):
+        if not self.user_limits or user is None or not user.is_authenticated:
+            return self.limit
+        for key in (str(user.pk), getattr(user, 'role', None)):
+            if key in self.user_limits:
+                return self.user_limits[key]
+        return self.limit
+
+    def key_for(self, request, user, get_client_ip):
+        if self.per == 'user' and user is not None and user.is_authenticated:
+            return f'{self.name}:user:{user.pk}'
+        return f'{self.name}:ip:{get_client_ip(request)}'
+
+
+class RateLimiter:
+    """
+    Applies the configured rules to requests.
+
+    Configured with settings.CHAT_RATE_LIMITS, for example:
+
+        CHAT_RATE_LIMITS = {
+            'backend': 'cache',      # or 'memory'
+            'cache_alias': 'default',
+            'max_keys': 10000,       # memory backend only
+            'rules': [
+                {'path': '/chat/', 'methods': ['POST'], 'limit': 5,
+                 'window': 60, 'per': 'user',
+                 'user_limits': {'admin': None, 'host': 20}},
+            ],
+        }
+    """
+
+    def __init__(self, rules, backend):
+        self.rules = rules
+        self.backend = backend
+
+    @classmethod
+    def from_settings(cls):
+        config = getattr(settings, 'CHAT_RATE_LIMITS', {})
+        if config.get('backend', 'memory') == 'cache':
+            backend = CacheRateLimitBackend(alias=config.get('cache_alias', 'default'))
+        else:
+            backend = MemoryRateLimitBackend(max_keys=config.get('max_keys', 10000))
+        rules = [RateLimitRule(**rule) for rule in config.get('rules', DEFAULT_RULES)]
+        return cls(rules, backend)
+
+    def allow(self, request, get_client_ip):
+        """
+        Count the request against every matching rule; False if any refuses it.
+
+        `get_client_ip(request)` is only called when a rule keys on the IP,
+        and request.user is only read when a matching rule needs it.
+        """
+        rules = [rule for rule in self.rules if rule.matches(request)]
+        if not rules:
+            return True
+        user = None
+        if any(rule.needs_user for rule in rules):
+            user = getattr(request, 'user', None)
+
+        for rule in rules:
+            limit = rule.limit_for(user)
+            if limit is None:
+                continue
+            if not self.backend.hit(rule.key_for(request, user, get_client_ip), limit, rule.window):
+                return False
+        return True
+
+    async def aallow(self, request, get_client_ip):
+        """
+        Same as allow() for async middleware.
+        """
+        rules = [rule for rule in self.rules if rule.matches(request)]
+        if not rules:
+            return True
+        user = None
+        if any(rule.needs_user for rule in rules) and hasattr(request, 'auser'):
+            user = await request.auser()
+
+        for rule in rules:
+            limit = rule.limit_for(user)
+            if limit is None:
+                continue
+            if not await self.backend.ahit(rule.key_for(request, user, get_client_ip), limit, rule.window):
+                return False
+        return True
@@ -0,0 +1,55 @@
+import re
+
+
+class PrefixMatcher:
+    """
+    Maps path prefixes to values, compiled once into a single regex.
+
+    The prefixes are folded into a trie first and the regex is generated
+    from it, so shared prefixes are only matched once and a lookup costs
+    about one pass over the path in the regex engine, however many prefixes
+    are configured. When several prefixes match, the longest one wins.
+    """
+
+    def __init__(self, prefixes):
+        # {prefix: value}; an empty mapping never matches
+        self.values = dict(prefixes)
+        trie = {}
+        for prefix in self.values:
+            node = trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node[None] = True
+        self.regex = re.compile(self._pattern(trie)) if self.values else None
+
+    def match(self, path):
+        """
+        Value of the longest prefix of `path`, or None.
+        """
+        if self.regex is None:
+            return None
+        found = self.regex.match(path)
+        if found is None:
+            return None
+        return self.values[found.group()]
+
+    def __len__(self):
+        return len(self.values)
+
+    @classmethod
+    def _pattern(cls, node):
+        alternatives = [
+            re.escape(char) + cls._pattern(child)
+            for char, child in sorted(node.items(), key=lambda item: item[0] or '')
+            if char is not None
+        ]
+        if not alternatives:
+            return ''
+        if len(alternatives) == 1:
+            pattern = alternatives[0]
+        else:
+            pattern = '(?:' + '|'.join(alternatives) + ')'
+        if None in node:
+            # A prefix ends here: the longer ones are optional, and tried first
+            pattern = f'(?:{pattern})?'
+        return pattern
@@ -1,8 +1,9 @@
 from rest_framework import serializers
+from .metrics import TimedSerializerMixin
 from .models import User, Message, Conversation
 
 
-class UserSerializers(serializers.ModelSerializer):
+class UserSerializers(TimedSerializerMixin, serializers.ModelSerializer):
     # Explicity use CharField for the username
     username = serializers.CharField(read_only=True)
 
@@ -12,7 +13,7 @@ class UserSerializers(serializers.ModelSerializer):
         fields = ['user_id', 'username', 'email', 'first_name', 'last_name', 'phone_number', 'role', 'created_at']
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     # Use serializerMethodField for sender details
     sender = serializers.SerializerMethodField()
 
@@ -28,7 +29,7 @@ class MessageSerializer(serializers.ModelSerializer):
         return f"{obj.sender.first_name} {obj.sender.last_name}"
 
 
-class ConversationSerializer(serializers.ModelSerializer):
+class ConversationSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     participants = UserSerializers(many=True, read_only=True)
     messages = MessageSerializer(many=True, read_only=True)
     # Field to calculate participant count
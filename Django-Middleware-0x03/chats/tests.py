@@ -1,3 +1,453 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import time
 
-# Create your tests here.
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import path
+from django.utils.functional import SimpleLazyObject
+
+from .accesslog import AccessLogWriter
+from .metrics import metrics_view, registry
+from .middleware import (
+    InstrumentationMiddleware,
+    OffensiveLanguageMiddleware,
+    RequestLoggingMiddleware,
+    RolePermissionMiddleware,
+)
+from .models import User
+from .serializers import UserSerializers
+from .ratelimit import CacheRateLimitBackend, MemoryRateLimitBackend, RateLimitRule, RateLimiter
+from .routing import PrefixMatcher
+
+
+def ok_view(request):
+    return HttpResponse("ok")
+
+
+async def async_ok_view(request):
+    return HttpResponse("ok")
+
+
+def users_view(request, pk):
+    users = User.objects.all()
+    data = UserSerializers(users, many=True).data
+    return HttpResponse(f"{len(data)} users, {User.objects.count()} total")
+
+
+def whoami_view(request):
+    return HttpResponse(str(request.user))
+
+
+urlpatterns = [path('chat/rooms/<int:pk>/users/', users_view)]
+
+
+class FakeUser:
+    is_authenticated = True
+
+    def __init__(self, pk, role='guest'):
+        self.pk = pk
+        self.role = role
+
+
+class SlidingWindowBackendTests(SimpleTestCase):
+    backend_class = MemoryRateLimitBackend
+
+    def make_backend(self):
+        return self.backend_class()
+
+    def test_allows_up_to_the_limit_in_a_window(self):
+        backend = self.make_backend()
+
+        results = [backend.hit('ip', 5, 60, now=600 + i) for i in range(6)]
+
+        self.assertEqual(results, [True] * 5 + [False])
+
+    def test_previous_window_weight_decays(self):
+        backend = self.make_backend()
+        for i in range(5):
+            backend.hit('ip', 5, 60, now=600 + i)
+
+        # A quarter into the next window, 75% of the previous 5 hits still count
+        results = [backend.hit('ip', 5, 60, now=675) for _ in range(3)]
+        self.assertEqual(results, [True, True, False])
+        # Two windows later everything has expired
+        self.assertTrue(backend.hit('ip', 5, 60, now=780))
+
+    def test_refused_hits_do_not_extend_the_block(self):
+        backend = self.make_backend()
+        for i in range(5):
+            backend.hit('ip', 5, 60, now=600)
+        for i in range(20):
+            backend.hit('ip', 5, 60, now=610)
+
+        self.assertTrue(backend.hit('ip', 5, 60, now=720))
+
+
+class CacheBackendTests(SlidingWindowBackendTests):
+    backend_class = CacheRateLimitBackend
+
+    def setUp(self):
+        cache.clear()
+
+    def test_workers_share_one_limit(self):
+        workers = [CacheRateLimitBackend(), CacheRateLimitBackend()]
+
+        results = [workers[i % 2].hit('ip', 4, 60, now=600) for i in range(6)]
+
+        self.assertEqual(results, [True] * 4 + [False] * 2)
+
+    async def test_async_hits_share_the_sync_counters(self):
+        backend = CacheRateLimitBackend()
+        for i in range(3):
+            backend.hit('ip', 5, 60, now=600)
+
+        results = [await backend.ahit('ip', 5, 60, now=600) for _ in range(3)]
+
+        self.assertEqual(results, [True, True, False])
+
+
+class MemoryBackendEvictionTests(SimpleTestCase):
+    def test_least_recently_seen_keys_are_evicted(self):
+        backend = MemoryRateLimitBackend(max_keys=3)
+        for key in ('a', 'b', 'c'):
+            backend.hit(key, 5, 60, now=600)
+        backend.hit('a', 5, 60, now=601)
+
+        backend.hit('d', 5, 60, now=602)
+
+        self.assertEqual(list(backend.counters), ['c', 'a', 'd'])
+
+
+class OffensiveLanguageMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def post(self, middleware, path='/chat/messages/', ip='10.0.0.1', user=None):
+        request = self.factory.post(path, REMOTE_ADDR=ip)
+        request.user = user or AnonymousUser()
+        return middleware(request).status_code
+
+    def test_default_limit_is_five_posts_per_minute_per_ip(self):
+        middleware = OffensiveLanguageMiddleware(ok_view)
+
+        statuses = [self.post(middleware) for _ in range(6)]
+
+        self.assertEqual(statuses, [200] * 5 + [403])
+        self.assertEqual(self.post(middleware, ip='10.0.0.2'), 200)
+        self.assertEqual(self.post(middleware, path='/api/other/'), 200)
+
+    @override_settings(CHAT_RATE_LIMITS={'rules': [
+        {'path': '/chat/', 'methods': ['POST'], 'limit': 2, 'per': 'user',
+         'user_limits': {'admin': None, 'vip': 4}},
+    ]})
+    def test_limits_per_user_and_overrides(self):
+        middleware = OffensiveLanguageMiddleware(ok_view)
+        guest, admin, vip = FakeUser(1), FakeUser(2, role='admin'), FakeUser('vip')
+
+        # Same IP, different users: counted separately
+        self.assertEqual([self.post(middleware, user=guest) for _ in range(3)], [200, 200, 403])
+        self.assertEqual([self.post(middleware, user=admin) for _ in range(10)], [200] * 10)
+        self.assertEqual([self.post(middleware, user=vip) for _ in range(5)], [200] * 4 + [403])
+
+
+class AsyncMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+
+    def make_request(self, method, path, user=None):
+        request = getattr(self.factory, method)(path, REMOTE_ADDR='10.0.0.1')
+        user = user or AnonymousUser()
+
+        async def auser():
+            return user
+
+        # Only the async user accessor, as AuthenticationMiddleware would
+        # provide it; request.user must not be touched on the async path
+        request.auser = auser
+        return request
+
+    def test_async_stack_gets_coroutine_middleware(self):
+        self.assertTrue(iscoroutinefunction(OffensiveLanguageMiddleware(async_ok_view)))
+        self.assertFalse(iscoroutinefunction(OffensiveLanguageMiddleware(ok_view)))
+
+    @override_settings(CHAT_RATE_LIMITS={'rules': [
+        {'path': '/chat/', 'methods': ['POST'], 'limit': 2, 'per': 'user'},
+    ]})
+    async def test_rate_limit_per_user(self):
+        middleware = OffensiveLanguageMiddleware(async_ok_view)
+        user = FakeUser(1)
+
+        statuses = [
+            (await middleware(self.make_request('post', '/chat/', user))).status_code
+            for _ in range(3)
+        ]
+
+        self.assertEqual(statuses, [200, 200, 403])
+        response = await middleware(self.make_request('post', '/chat/', FakeUser(2)))
+        self.assertEqual(response.status_code, 200)
+
+    async def test_role_permission(self):
+        middleware = RolePermissionMiddleware(async_ok_view)
+
+        denied = await middleware(self.make_request('get', '/chat/manage/', FakeUser(1)))
+        allowed = await middleware(self.make_request('get', '/chat/manage/', FakeUser(2, role='admin')))
+        public = await middleware(self.make_request('get', '/chat/'))
+
+        self.assertEqual([denied.status_code, allowed.status_code, public.status_code], [403, 200, 200])
+
+
+class PrefixMatcherTests(SimpleTestCase):
+    def test_longest_prefix_wins(self):
+        matcher = PrefixMatcher({'/chat/': 'chat', '/chat/manage/': 'manage', '/chat/man': 'man'})
+
+        self.assertEqual(matcher.match('/chat/manage/users/'), 'manage')
+        self.assertEqual(matcher.match('/chat/mana'), 'man')
+        self.assertEqual(matcher.match('/chat/'), 'chat')
+        self.assertIsNone(matcher.match('/chat'))
+        self.assertIsNone(PrefixMatcher({}).match('/chat/'))
+
+    def test_agrees_with_startswith_on_many_rules(self):
+        prefixes = [f'/chat/{section}/{i}/' for i in range(125) for section in ('a', 'b', 'c', 'd')]
+        matcher = PrefixMatcher({prefix: prefix for prefix in prefixes})
+
+        for path in ('/chat/a/7/x', '/chat/d/124/', '/chat/b/1', '/chat/e/1/', '/chat/c/12/3'):
+            expected = max((p for p in prefixes if path.startswith(p)), key=len, default=None)
+            self.assertEqual(matcher.match(path), expected)
+
+    def test_special_characters_are_literal(self):
+        matcher = PrefixMatcher({'/chat/a.b/': 1, '/chat/(x)/': 2})
+
+        self.assertEqual(matcher.match('/chat/a.b/c'), 1)
+        self.assertIsNone(matcher.match('/chat/aXb/c'))
+        self.assertEqual(matcher.match('/chat/(x)/'), 2)
+
+
+class RolePermissionMiddlewareTests(SimpleTestCase):
+    def request(self, path, user):
+        request = RequestFactory().get(path)
+        request.user = user
+        return request
+
+    @override_settings(CHAT_ROLE_RULES=[
+        {'path': '/chat/manage/', 'roles': ['admin', 'moderator']},
+        {'path': '/chat/manage/reports/', 'roles': ['admin']},
+    ])
+    def test_rules_from_settings(self):
+        middleware = RolePermissionMiddleware(ok_view)
+        moderator = FakeUser(1, role='moderator')
+
+        self.assertEqual(middleware(self.request('/chat/manage/rooms/', moderator)).status_code, 200)
+        self.assertEqual(middleware(self.request('/chat/manage/reports/', moderator)).status_code, 403)
+        self.assertEqual(middleware(self.request('/chat/delete/', AnonymousUser())).status_code, 200)
+
+    def test_unmatched_paths_do_not_load_the_user(self):
+        middleware = RolePermissionMiddleware(ok_view)
+        # Like AuthenticationMiddleware: the user is loaded on first use
+        request = self.request('/api/conversations/', SimpleLazyObject(
+            lambda: self.fail("request.user was loaded")
+        ))
+
+        self.assertEqual(middleware(request).status_code, 200)
+
+
+class RateLimitRuleTests(SimpleTestCase):
+    def test_rejects_unknown_scope(self):
+        with self.assertRaises(ValueError):
+            RateLimitRule('/chat/', 5, per='session')
+
+    def test_rules_without_a_match_skip_the_backend(self):
+        limiter = RateLimiter([RateLimitRule('/chat/', 0)], MemoryRateLimitBackend())
+        request = RequestFactory().get('/health/')
+
+        self.assertTrue(limiter.allow(request, lambda request: self.fail("IP was read")))
+        self.assertEqual(len(limiter.backend.counters), 0)
+
+    def test_rules_on_the_same_path_count_separately(self):
+        limiter = RateLimiter([
+            RateLimitRule('/chat/', 5, methods=['GET']),
+            RateLimitRule('/chat/', 5, methods=['POST']),
+        ], MemoryRateLimitBackend())
+        factory = RequestFactory()
+        client_ip = lambda request: '10.0.0.1'
+
+        for _ in range(5):
+            self.assertTrue(limiter.allow(factory.get('/chat/'), client_ip))
+
+        self.assertFalse(limiter.allow(factory.get('/chat/'), client_ip))
+        self.assertTrue(limiter.allow(factory.post('/chat/'), client_ip))
+
+
+class AccessLogWriterTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'requests.log')
+
+    def read_lines(self):
+        with open(self.path, encoding='utf-8') as log_file:
+            return log_file.read().splitlines()
+
+    def test_lines_are_written_in_batches_on_close(self):
+        writer = AccessLogWriter(self.path, batch_size=10, flush_interval=60)
+        writer.start()
+
+        for i in range(25):
+            writer.write(f"line {i}")
+        writer.close()
+
+        self.assertEqual(self.read_lines(), [f"line {i}" for i in range(25)])
+
+    def test_flushes_after_the_interval(self):
+        writer = AccessLogWriter(self.path, batch_size=1000, flush_interval=0.05)
+        writer.start()
+        self.addCleanup(writer.close)
+
+        writer.write("line")
+        deadline = time.monotonic() + 2
+        while not os.path.exists(self.path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertEqual(self.read_lines(), ["line"])
+
+    def test_full_queue_drops_and_counts(self):
+        # Not started: nothing drains the queue
+        writer = AccessLogWriter(self.path, max_queue=2)
+
+        for i in range(5):
+            writer.write(f"line {i}")
+        writer.start()
+        writer.close()
+
+        self.assertEqual(writer.dropped, 3)
+        self.assertEqual(
+            self.read_lines(),
+            ["line 0", "line 1", "access log queue full: dropped 3 records"]
+        )
+
+
+class RequestLoggingMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'requests.log')
+
+    def test_json_lines_include_status_and_duration(self):
+        with self.settings(REQUEST_LOG={'path': self.path, 'format': 'json'}):
+            middleware = RequestLoggingMiddleware(ok_view)
+        request = RequestFactory().get('/api/conversations/')
+        request.user = AnonymousUser()
+
+        middleware(request)
+        middleware.writer.close()
+
+        with open(self.path, encoding='utf-8') as log_file:
+            record = json.loads(log_file.readline())
+        self.assertEqual(record['user'], 'Anonymous')
+        self.assertEqual(record['path'], '/api/conversations/')
+        self.assertEqual(record['status'], 200)
+        self.assertGreaterEqual(record['duration_ms'], 0)
+
+
+
+@override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+class RequestLoggingUserTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'requests.log')
+        self.user = User.objects.create(username='ada', email='ada@example.com')
+        # A logged in session, as a browser would send it
+        self.client.force_login(self.user)
+        self.cookie = self.client.cookies.output(header='', sep=';').strip()
+
+    def run_requests(self, view, paths, **config):
+        with self.settings(REQUEST_LOG={'path': self.path, 'format': 'json', **config}):
+            logger = RequestLoggingMiddleware(view)
+        stack = SessionMiddleware(AuthenticationMiddleware(logger))
+        for path in paths:
+            stack(RequestFactory().get(path, HTTP_COOKIE=self.cookie))
+        logger.writer.close()
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, encoding='utf-8') as log_file:
+            return [json.loads(line) for line in log_file]
+
+    def test_health_checks_do_not_load_the_user(self):
+        with self.assertNumQueries(0):
+            records = self.run_requests(ok_view, ['/health/'])
+
+        self.assertEqual(records[0]['user'], '-')
+
+    def test_user_loaded_by_the_view_is_logged(self):
+        with self.assertNumQueries(1):
+            records = self.run_requests(whoami_view, ['/chat/'])
+
+        self.assertEqual(records[0]['user'], 'ada@example.com')
+
+    def test_allow_and_deny_lists(self):
+        records = self.run_requests(
+            ok_view, ['/health/', '/static/app.js', '/api/metrics/', '/api/messages/', '/chat/'],
+            allow=['/api/', '/chat/'], deny=['/api/metrics/'],
+        )
+
+        self.assertEqual([record['path'] for record in records], ['/api/messages/', '/chat/'])
+
+@override_settings(
+    ROOT_URLCONF=__name__,
+    MIDDLEWARE=['chats.middleware.InstrumentationMiddleware'],
+    CHAT_METRICS={'sample_rate': 1},
+)
+class InstrumentationMiddlewareTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        User.objects.create(username='a', email='a@example.com')
+        User.objects.create(username='b', email='b@example.com')
+
+    def test_server_timing_and_route_histograms(self):
+        for pk in (1, 2):
+            response = self.client.get(f'/chat/rooms/{pk}/users/')
+
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="2 queries", serializer;dur=[\d.]+$')
+        stats = registry.snapshot()['GET chat/rooms/<int:pk>/users/']
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['queries'], 4)
+        self.assertEqual(sum(stats['wall_ms']['buckets'].values()), 2)
+        self.assertGreater(stats['serializer_ms']['sum'], 0)
+
+    @override_settings(CHAT_METRICS={'sample_rate': 0})
+    def test_removed_from_the_stack_when_sampling_is_off(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            InstrumentationMiddleware(ok_view)
+
+        response = self.client.get('/chat/rooms/1/users/')
+
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(registry.snapshot(), {})
+
+    async def test_async_requests_leave_out_db_time(self):
+        middleware = InstrumentationMiddleware(async_ok_view)
+
+        response = await middleware(AsyncRequestFactory().get('/chat/'))
+
+        self.assertNotIn('db;', response['Server-Timing'])
+        self.assertEqual(registry.snapshot()['GET <unmatched>']['queries'], 0)
+
+    def test_metrics_view_is_for_admins(self):
+        request = RequestFactory().get('/api/metrics/')
+        request.user = AnonymousUser()
+        self.assertEqual(metrics_view(request).status_code, 403)
+
+        self.client.get('/chat/rooms/1/users/')
+        request.user = User(username='admin', role='admin')
+        body = json.loads(metrics_view(request).content)
+
+        self.assertEqual(list(body['routes']), ['GET chat/rooms/<int:pk>/users/'])
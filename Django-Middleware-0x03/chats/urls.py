@@ -4,6 +4,7 @@ from .views import ConversationViewSet, MessageViewSet
 from rest_framework import routers
 from rest_framework_nested import routers as nested_routers
 from . import views
+from .metrics import metrics_view
 
 
 # Initialize the router
@@ -20,4 +21,5 @@ conversation_router.register(r'messages', views.MessageViewSet, basename='conver
 urlpatterns = [
     path('api/', include(router.urls)),
     path('api/', include(conversation_router.urls)),
+    path('api/metrics/', metrics_view, name='chat-metrics'),
 ]
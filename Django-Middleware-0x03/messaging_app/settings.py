@@ -59,6 +59,12 @@ REST_FRAMEWORK = {
 
 }
 
+# Request instrumentation, see chats.metrics; off unless sample_rate > 0
+CHAT_METRICS = {
+    'sample_rate': 0.0,
+    'server_timing': True,
+}
+
 # Configure SimpleJWT
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=30),
@@ -69,6 +75,8 @@ SIMPLE_JWT = {
 
 
 MIDDLEWARE = [
+    # First, so that its wall time covers the whole stack
+    'chats.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
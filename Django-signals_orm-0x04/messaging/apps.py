@@ -2,6 +2,9 @@ from django.apps import AppConfig
 
 
 class MessagingConfig(AppConfig):
+    # There are two configs in this module, Django only picks this one
+    # (and connects the signals) when it is marked as the default
+    default = True
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'messaging'
 
@@ -0,0 +1,164 @@
+import threading
+from datetime import timedelta
+from functools import partial
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.timezone import now
+from .conversation_cache import bump_conversation_versions
+from .inbox import invalidate_unread_counts
+from .models import Message, MessageHistory, Notification, PendingUserCleanup
+
+
+CHUNK_SIZE = 1000
+# A cleanup whose last chunk is older than this is taken for dead
+STALLED_AFTER = timedelta(minutes=10)
+
+
+def delete_user_data(user_id, chunk_size=CHUNK_SIZE, progress=None):
+    '''
+    Deletes a user with their messages (and the replies to them), message
+    histories and notifications, in chunks of `chunk_size` rows.
+
+    Rows are deleted with raw DELETEs, without Django's cascade collector,
+    so only one chunk of IDs is in memory at a time. Messages go leaves
+    first, each chunk with its histories and notifications in one
+    transaction, so foreign keys hold after every commit.
+
+    `progress(counts)` is called after every chunk with the number of rows
+    deleted so far. Returns the final counts.
+
+    The PendingUserCleanup of the user, if any, is kept alive after every
+    chunk and deleted together with the user.
+    '''
+    counts = {"notifications": 0, "histories": 0, "messages": 0}
+    heartbeat = partial(_heartbeat, user_id)
+
+    def report():
+        if progress is not None:
+            progress(dict(counts))
+
+    # Edits made by the user stay, without their author
+    Message.objects.filter(edited_by_id=user_id).update(edited_by=None)
+
+    notifications = Notification.objects.filter(user_id=user_id).values_list("pk", flat=True)
+    while ids := list(notifications[:chunk_size]):
+        counts["notifications"] += _raw_delete(Notification.objects.filter(pk__in=ids))
+        heartbeat()
+        report()
+
+    own = Message.objects.filter(Q(sender_id=user_id) | Q(receiver_id=user_id))
+    while True:
+        rows = list(own.filter(replies__isnull=True).values_list("pk", "receiver_id")[:chunk_size])
+        if not rows:
+            # What is left of the user's messages has replies from others:
+            # delete those threads from the bottom up
+            root = own.values_list("pk", flat=True).first()
+            if root is None:
+                break
+            rows = list(
+                Message.objects.replies_to(root).filter(replies__isnull=True)
+                .values_list("pk", "receiver_id")[:chunk_size]
+            )
+        ids = [pk for pk, _ in rows]
+        with transaction.atomic():
+            bump_conversation_versions(Message.objects.thread_roots(ids).values_list("pk", flat=True))
+            counts["notifications"] += _raw_delete(Notification.objects.filter(message_id__in=ids))
+            counts["histories"] += _raw_delete(MessageHistory.objects.filter(message_id__in=ids))
+            counts["messages"] += _raw_delete(Message.objects.filter(pk__in=ids))
+            invalidate_unread_counts({receiver_id for _, receiver_id in rows})
+            heartbeat()
+        report()
+
+    with transaction.atomic():
+        # Nothing big is left for the collector to load
+        User.objects.filter(pk=user_id).delete()
+        PendingUserCleanup.objects.filter(user_id=user_id).delete()
+    return counts
+
+
+def _heartbeat(user_id):
+    PendingUserCleanup.objects.filter(user_id=user_id).update(heartbeat=now())
+
+
+def _raw_delete(queryset):
+    # QuerySet.delete() would load every row into Django's collector to
+    # send signals and cascade, which is what chunking is meant to avoid.
+    # _raw_delete() is the single DELETE Django itself uses for "fast
+    # deletes". It is private, so these are the assumptions that make it
+    # safe here:
+    # - nothing cascades: histories and notifications of a chunk go before
+    #   its messages, and messages leaves first;
+    # - no receiver misses a row: the only ones on these models (unread
+    #   counts and conversation versions) are updated by the caller.
+    return queryset._raw_delete(queryset.db)
+
+
+def progress_key(user_id):
+    return f"messaging:user-cleanup:{user_id}"
+
+
+def request_user_cleanup(user_id):
+    '''
+    Records that the user's data must be deleted. Call it in the transaction
+    that closes the account, then start_user_cleanup once it commits.
+    '''
+    PendingUserCleanup.objects.update_or_create(user_id=user_id)
+
+
+def stalled_cleanups(stalled_after=STALLED_AFTER):
+    '''
+    IDs of the users whose cleanup was requested but made no progress for
+    `stalled_after`, most likely because the process running it stopped.
+    '''
+    return list(
+        PendingUserCleanup.objects.filter(heartbeat__lt=now() - stalled_after)
+        .order_by("requested_at").values_list("user_id", flat=True)
+    )
+
+
+def cleanup_progress(user_id):
+    '''
+    Progress of the background cleanup of a user, or None if there is none:
+    {"state": "pending" | "running" | "stalled" | "done" | "failed", "deleted": {...}}.
+
+    "stalled" is a pending cleanup that made no progress for STALLED_AFTER:
+    the thread running it is gone, resume_user_cleanups will finish it.
+    '''
+    progress = cache.get(progress_key(user_id))
+    pending = PendingUserCleanup.objects.filter(user_id=user_id).first()
+    if pending is None or (progress is not None and progress["state"] in ("done", "failed")):
+        return progress
+    deleted = progress["deleted"] if progress is not None else {}
+    if pending.heartbeat < now() - STALLED_AFTER:
+        return {"state": "stalled", "deleted": deleted}
+    return progress or {"state": "pending", "deleted": deleted}
+
+
+def start_user_cleanup(user_id, chunk_size=CHUNK_SIZE):
+    '''
+    Runs delete_user_data in a background thread, so the request that asked
+    for it does not wait for it. Progress is kept in the cache.
+
+    The thread dies with the process. The work is idempotent and recorded
+    with request_user_cleanup, so if the process stops halfway the
+    resume_user_cleanups command picks up where it was left.
+    '''
+    def run():
+        def progress(counts, state="running"):
+            cache.set(progress_key(user_id), {"state": state, "deleted": counts}, timeout=24 * 3600)
+
+        progress({})
+        try:
+            progress(delete_user_data(user_id, chunk_size, progress), state="done")
+        except Exception:
+            progress(cache.get(progress_key(user_id), {}).get("deleted", {}), state="failed")
+            raise
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=run, name=f"user-cleanup-{user_id}", daemon=True)
+    thread.start()
+    return thread
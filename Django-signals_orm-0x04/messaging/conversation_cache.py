@@ -0,0 +1,121 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+# Entries are never stale: a new message bumps the version of its
+# conversation and the old entries are just not read any more
+CONVERSATION_CACHE_TIMEOUT = 60 * 60
+
+
+class CacheStats:
+    '''
+    Hits and misses of the conversation cache in this process.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else None,
+            }
+
+    def reset(self):
+        with self.lock:
+            self.hits = self.misses = 0
+
+
+stats = CacheStats()
+
+
+def version_key(conversation_id):
+    return f"messaging:conversation:{conversation_id}:version"
+
+
+def conversation_version(conversation_id):
+    key = version_key(conversation_id)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock, not 1, so that a counter evicted from the
+        # cache cannot come back to a version that was already used
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_conversation_versions(conversation_ids):
+    '''
+    Invalidate the cached conversations once the transaction commits.
+    '''
+    conversation_ids = set(conversation_ids)
+
+    def bump():
+        for conversation_id in conversation_ids:
+            try:
+                cache.incr(version_key(conversation_id))
+            except ValueError:
+                # Not cached: the next read starts a new version anyway
+                pass
+
+    if conversation_ids:
+        transaction.on_commit(bump)
+
+
+def get_conversation(conversation_id):
+    '''
+    The messages of a conversation (a thread: a root message and all the
+    replies under it) and its participants, from the cache when possible:
+
+        {"participants": {user IDs}, "messages": [{...}, ...]}
+
+    None if there is no such conversation.
+    '''
+    key = f"messaging:conversation:{conversation_id}:{conversation_version(conversation_id)}"
+    conversation = cache.get(key)
+    stats.record(hit=conversation is not None)
+    if conversation is None:
+        conversation = load_conversation(conversation_id)
+        # Missing conversations are cached too, as {}
+        cache.set(key, conversation or {}, CONVERSATION_CACHE_TIMEOUT)
+    return conversation or None
+
+
+def load_conversation(conversation_id):
+    from .models import Message
+
+    root = Message.objects.select_related("sender", "receiver").filter(
+        pk=conversation_id, parent_message=None
+    ).first()
+    if root is None:
+        return None
+    messages = [root, *root.get_all_replies()]
+    return {
+        "participants": {user_id for m in messages for user_id in (m.sender_id, m.receiver_id)},
+        "messages": [
+            {
+                "id": m.pk,
+                "parent_id": m.parent_message_id,
+                "sender": m.sender.username,
+                "receiver": m.receiver.username,
+                "content": m.content,
+                "timestamp": m.timestamp,
+                "edited": m.edited,
+            }
+            for m in messages
+        ],
+    }
@@ -0,0 +1,49 @@
+from django.core.cache import cache
+from django.db import transaction
+
+
+# Cached counts are exact as long as every change goes through the ORM
+# paths below; the timeout bounds the drift of anything that does not
+UNREAD_COUNT_TIMEOUT = 60 * 60
+
+
+def unread_count_key(user_id):
+    return f"messaging:unread:{user_id}"
+
+
+def unread_count(user_id):
+    '''
+    Number of unread messages of a user, from the cache when it is there.
+    '''
+    from .models import Message
+
+    key = unread_count_key(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = Message.objects.filter(receiver_id=user_id, read=False).count()
+        cache.add(key, count, UNREAD_COUNT_TIMEOUT)
+    return count
+
+
+def adjust_unread_count(user_id, delta):
+    '''
+    Add `delta` to the cached count of a user once the transaction commits.
+    Counts that are not cached are left alone, they are counted on read.
+    '''
+    def adjust():
+        key = unread_count_key(user_id)
+        try:
+            count = cache.incr(key, delta) if delta > 0 else cache.decr(key, -delta)
+        except ValueError:
+            return
+        if count < 0:
+            cache.delete(key)
+
+    if delta:
+        transaction.on_commit(adjust)
+
+
+def invalidate_unread_counts(user_ids):
+    keys = [unread_count_key(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,70 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from messaging.models import Message
+
+
+def recursive_replies(message):
+    # The previous get_all_replies(): two queries per message of the tree
+    replies = list(message.replies.all())
+    for reply in message.replies.all():
+        replies.extend(recursive_replies(reply))
+    return replies
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the per-level recursive reply lookup with the recursive CTE "
+        "behind Message.get_all_replies() and get_thread(), on deep (one "
+        "chain) and wide (all replies to the root) threads. Everything runs "
+        "in a rolled back transaction, so the database is left untouched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[10, 100, 1000],
+            help="Numbers of replies per thread."
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'replies':>8} {'shape':>6} {'path':>10} {'queries':>8} {'ms':>10}")
+        for size in options['sizes']:
+            for shape in ('deep', 'wide'):
+                with transaction.atomic():
+                    root = self.create_thread(size, shape)
+                    paths = (
+                        ('recursive', recursive_replies),
+                        ('cte', Message.get_all_replies),
+                        ('tree', Message.get_thread),
+                    )
+                    for name, path in paths:
+                        with CaptureQueriesContext(connection) as queries:
+                            start = time.perf_counter()
+                            try:
+                                path(root)
+                            except RecursionError:
+                                # Python's stack runs out before the thread does
+                                self.stdout.write(f"{size:>8} {shape:>6} {name:>10} {'RecursionError':>19}")
+                                continue
+                            elapsed = (time.perf_counter() - start) * 1000
+                        self.stdout.write(
+                            f"{size:>8} {shape:>6} {name:>10} {len(queries):>8} {elapsed:>10.2f}"
+                        )
+                    transaction.set_rollback(True)
+
+    def create_thread(self, size, shape):
+        sender = User.objects.create(username='bench-sender')
+        receiver = User.objects.create(username='bench-receiver')
+        root = Message.objects.create(sender=sender, receiver=receiver, content="Root")
+        parent = root
+        for index in range(size):
+            reply = Message.objects.create(
+                sender=sender, receiver=receiver, content=f"Reply {index}", parent_message=parent
+            )
+            if shape == 'deep':
+                parent = reply
+        return root
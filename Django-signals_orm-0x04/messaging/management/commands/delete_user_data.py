@@ -0,0 +1,32 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from messaging.cleanup import CHUNK_SIZE, delete_user_data
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete a user with their messages, replies, message histories and "
+        "notifications in chunks, printing progress. Safe to run again on a "
+        "cleanup that was interrupted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_id', type=int, help="ID of the user to delete.")
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help="Rows deleted per statement."
+        )
+
+    def handle(self, *args, **options):
+        user_id = options['user_id']
+        if not User.objects.filter(pk=user_id).exists():
+            raise CommandError(f"No user with ID {user_id}.")
+
+        def progress(counts):
+            self.stdout.write(", ".join(f"{name} {count}" for name, count in counts.items()))
+
+        counts = delete_user_data(user_id, options['chunk_size'], progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted user {user_id}: " + ", ".join(f"{count} {name}" for name, count in counts.items())
+        ))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from messaging.cleanup import CHUNK_SIZE, delete_user_data, stalled_cleanups
+from messaging.models import PendingUserCleanup
+
+
+class Command(BaseCommand):
+    help = (
+        "Finish the user cleanups whose background thread stopped before the "
+        "end, e.g. because the worker was restarted. Meant to run periodically."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help="Resume every pending cleanup, not only the stalled ones."
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=CHUNK_SIZE,
+            help="Rows deleted per statement."
+        )
+
+    def handle(self, *args, **options):
+        if options['all']:
+            user_ids = list(
+                PendingUserCleanup.objects.order_by('requested_at').values_list('user_id', flat=True)
+            )
+        else:
+            user_ids = stalled_cleanups()
+
+        for user_id in user_ids:
+            # Idempotent: starts over from whatever is left of the user
+            counts = delete_user_data(user_id, options['chunk_size'])
+            self.stdout.write(
+                f"Deleted user {user_id}: " + ", ".join(f"{count} {name}" for name, count in counts.items())
+            )
+        self.stdout.write(self.style.SUCCESS(f"Resumed {len(user_ids)} cleanups."))
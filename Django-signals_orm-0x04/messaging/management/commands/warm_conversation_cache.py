@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from messaging import conversation_cache
+from messaging.models import Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Load the most active conversations (threads) into the conversation "
+        "cache, e.g. after a deploy or a cache flush."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit', type=int, default=100,
+            help="Number of conversations to warm."
+        )
+        parser.add_argument(
+            '--days', type=int, default=7,
+            help="Activity is counted over this many past days."
+        )
+
+    def handle(self, *args, **options):
+        since = now() - timedelta(days=options['days'])
+        threads = Message.objects.most_active_threads(since, options['limit'])
+        conversation_cache.stats.reset()
+        for root_id, count in threads:
+            conversation_cache.get_conversation(root_id)
+            if options['verbosity'] > 1:
+                self.stdout.write(f"conversation {root_id}: {count} recent messages")
+        stats = conversation_cache.stats.as_dict()
+        self.stdout.write(self.style.SUCCESS(
+            f"Warmed {stats['misses']} conversations, {stats['hits']} were already cached."
+        ))
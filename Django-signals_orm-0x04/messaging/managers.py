@@ -1,4 +1,9 @@
-from django.db import models
+from collections import Counter
+
+from django.db import connections, models, transaction
+from django.db.models.expressions import RawSQL
+from .conversation_cache import bump_conversation_versions
+from .inbox import adjust_unread_count, unread_count
 
 
 class UnreadMessagesManager(models.Manager):
@@ -7,6 +12,134 @@ class UnreadMessagesManager(models.Manager):
     '''
     def for_user(self, user):
         '''
-        Returns unread messages for the given user.
+        Returns unread messages for the given user, newest first.
+        '''
+        return self.filter(receiver=user, read=False).only(
+            "id", "content", "timestamp", "sender"
+        ).order_by("-timestamp")
+
+    def count_for(self, user):
+        '''
+        Number of unread messages for the given user, cached.
+        '''
+        return unread_count(user.pk)
+
+    def mark_read(self, user, ids):
+        '''
+        Marks the given messages of the user as read with one UPDATE and
+        adjusts the cached count. Returns the number of messages marked.
+        '''
+        updated = self.filter(receiver=user, read=False, pk__in=ids).update(read=True)
+        adjust_unread_count(user.pk, -updated)
+        return updated
+
+
+class MessageQuerySet(models.QuerySet):
+    def bulk_send(self, messages, batch_size=None):
+        '''
+        Create many messages and their receivers' notifications with
+        bulk_create, in one transaction. post_save is not sent.
+        '''
+        from .models import Notification
+        from .notifications import queue_notifications
+
+        with transaction.atomic(using=self.db):
+            messages = self.bulk_create(messages, batch_size=batch_size)
+            unread = Counter(message.receiver_id for message in messages if not message.read)
+            for receiver_id, count in unread.items():
+                adjust_unread_count(receiver_id, count)
+            roots = {message.pk for message in messages if message.parent_message_id is None}
+            replied_to = {message.parent_message_id for message in messages} - {None}
+            roots.update(self.thread_roots(replied_to).values_list("pk", flat=True))
+            bump_conversation_versions(roots)
+            queue_notifications(
+                (Notification(user_id=message.receiver_id, message=message) for message in messages),
+                using=self.db,
+            )
+        return messages
+
+    def replies_to(self, message_id):
+        '''
+        All replies to a message, at any depth, selected with one recursive
+        CTE instead of one query per level.
+        '''
+        quote = connections[self.db].ops.quote_name
+        table = quote(self.model._meta.db_table)
+        pk = quote(self.model._meta.pk.column)
+        parent = quote(self.model._meta.get_field("parent_message").column)
+        thread = RawSQL(
+            f"WITH RECURSIVE thread(id) AS ("
+            f"SELECT {pk} FROM {table} WHERE {parent} = %s "
+            f"UNION ALL "
+            f"SELECT m.{pk} FROM {table} m JOIN thread ON m.{parent} = thread.id"
+            f") SELECT id FROM thread",
+            [message_id],
+        )
+        return self.filter(id__in=thread)
+
+    def thread_roots(self, message_ids):
+        '''
+        The first messages of the threads the given messages belong to,
+        walking up the parents with one recursive CTE.
+        '''
+        message_ids = list(message_ids)
+        if not message_ids:
+            return self.none()
+        quote = connections[self.db].ops.quote_name
+        table = quote(self.model._meta.db_table)
+        pk = quote(self.model._meta.pk.column)
+        parent = quote(self.model._meta.get_field("parent_message").column)
+        placeholders = ", ".join(["%s"] * len(message_ids))
+        roots = RawSQL(
+            f"WITH RECURSIVE up(id, parent) AS ("
+            f"SELECT {pk}, {parent} FROM {table} WHERE {pk} IN ({placeholders}) "
+            f"UNION ALL "
+            f"SELECT m.{pk}, m.{parent} FROM {table} m JOIN up ON m.{pk} = up.parent"
+            f") SELECT id FROM up WHERE parent IS NULL",
+            message_ids,
+        )
+        return self.filter(id__in=roots)
+
+    def most_active_threads(self, since, limit):
         '''
-        return self.filter(receiver=user, read=False).only("id", "content", "timestamp", "sender")
+        [(root ID, messages since `since`)] of the busiest threads.
+        '''
+        quote = connections[self.db].ops.quote_name
+        table = quote(self.model._meta.db_table)
+        pk = quote(self.model._meta.pk.column)
+        parent = quote(self.model._meta.get_field("parent_message").column)
+        timestamp = quote(self.model._meta.get_field("timestamp").column)
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f"WITH RECURSIVE thread(root, id) AS ("
+                f"SELECT {pk}, {pk} FROM {table} WHERE {parent} IS NULL "
+                f"UNION ALL "
+                f"SELECT thread.root, m.{pk} FROM {table} m JOIN thread ON m.{parent} = thread.id"
+                f") SELECT thread.root, COUNT(*) FROM thread "
+                f"JOIN {table} message ON message.{pk} = thread.id "
+                f"WHERE message.{timestamp} >= %s "
+                f"GROUP BY thread.root ORDER BY COUNT(*) DESC, thread.root LIMIT %s",
+                [since, limit],
+            )
+            return cursor.fetchall()
+
+
+def build_thread(root, replies):
+    '''
+    Attach the replies to their parents in memory, in O(n).
+
+    Every message of the thread gets a `thread_replies` list, in the order
+    of `replies`, and its parent_message is cached so following it up the
+    tree does not query again. Returns the root.
+    '''
+    parent_field = root._meta.get_field("parent_message")
+    nodes = {root.pk: root}
+    root.thread_replies = []
+    for reply in replies:
+        reply.thread_replies = []
+        nodes[reply.pk] = reply
+    for reply in replies:
+        parent = nodes[reply.parent_message_id]
+        parent.thread_replies.append(reply)
+        parent_field.set_cached_value(reply, parent)
+    return root
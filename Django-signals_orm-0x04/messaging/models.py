@@ -1,15 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
-from .managers import UnreadMessagesManager
-
-
-class UnreadMessagesManager(models.Manager):
-    '''
-    Custom manager to filter unread messages for a specific user.
-    '''
-    def for_user(self, user):
-        return self.filter(receiver=user, read=False).only("id", "content", "timestamp", "sender")
-
+from .managers import MessageQuerySet, UnreadMessagesManager, build_thread
 
 
 class Message(models.Model):
@@ -23,17 +14,88 @@ class Message(models.Model):
     read = models.BooleanField(default=False) # New field for read status
     parent_message = models.ForeignKey("self", null=True, blank=True, related_name="replies", on_delete=models.CASCADE)
 
-    objects = models.Manager() # Default Manager
-    unread = UnreadMessageManager() # Custom manager for unread messages
+    objects = MessageQuerySet.as_manager() # Default Manager
+    unread = UnreadMessagesManager() # Custom manager for unread messages
+
+    # Fields (attnames) whose value as loaded from the database is kept in
+    # loaded_values, so the signal handlers can tell if they changed
+    tracked_fields = ("content", "read", "parent_message_id")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_values = {
+            name: value for name, value in zip(field_names, values) if name in cls.tracked_fields
+        }
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "content" in update_fields:
+            # log_message_edit may flag the message as edited
+            kwargs["update_fields"] = {*update_fields, "edited", "edited_at"}
+        super().save(*args, **kwargs)
+
+        # What was just written is what the database holds now
+        self.snapshot(update_fields)
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        # The reloaded values are the new baseline, or the next save would
+        # be compared with what was loaded before the refresh
+        self.snapshot(fields)
+
+    def snapshot(self, fields=None):
+        '''
+        Records the current value of the tracked fields among `fields` (all
+        of them by default) as the value held by the database.
+        '''
+        if fields is None:
+            names = self.tracked_fields
+        else:
+            # update_fields and refresh_from_db() take names or attnames
+            names = set(self.tracked_fields) & {self._meta.get_field(name).attname for name in fields}
+        loaded_values = self.__dict__.setdefault("loaded_values", {})
+        for name in names:
+            if name in self.__dict__:
+                loaded_values[name] = self.__dict__[name]
+
+    def mark_read(self):
+        '''
+        Marks the message as read with a single UPDATE of that column.
+        '''
+        self.read = True
+        self.save(update_fields=["read"])
+
+    class Meta:
+        indexes = [
+            # The unread inbox: only unread rows are indexed, so the index
+            # stays small however many messages have been read
+            models.Index(
+                fields=["receiver", "read", "-timestamp"],
+                condition=models.Q(read=False),
+                name="messaging_unread_inbox_idx",
+            ),
+        ]
 
     def get_all_replies(self):
         '''
-        Recursively fetches all replies to this message.
+        Fetches all replies to this message, at any depth, in one query.
+        '''
+        return list(
+            Message.objects.replies_to(self.pk)
+            .select_related("sender", "receiver")
+            .order_by("timestamp", "pk")
+        )
+
+    def get_thread(self):
+        '''
+        Loads the whole reply tree under this message in one query.
+
+        Returns this message; every message of the tree has its direct
+        replies, oldest first, in `thread_replies`.
         '''
-        replies = list(self.replies.all())
-        for reply in self.replies.all():
-            replies.extend(reply.get_all_replies())
-        return replies
+        return build_thread(self, self.get_all_replies())
 
     def __str__(self):
         return f"Message from {self.sender} to {self.receiver} - {self.content[:20]}"
@@ -56,3 +118,21 @@ class Notification(models.Model):
 
     def __str__(self):
         return f"Notification for {self.user} - Read: {self.read}"
+
+
+class PendingUserCleanup(models.Model):
+    '''
+    A user whose data deletion was requested and is not finished yet.
+
+    Kept in the database, not only in the cache, so that a cleanup cut
+    short by a worker restart is not forgotten: resume_user_cleanups picks
+    it up again.
+    '''
+    # Not a foreign key: the row must outlive the user until the very end
+    user_id = models.IntegerField(primary_key=True)
+    requested_at = models.DateTimeField(auto_now_add=True)
+    # Touched after every chunk, to tell a running cleanup from a dead one
+    heartbeat = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Pending cleanup of user {self.user_id}"
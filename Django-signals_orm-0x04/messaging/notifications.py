@@ -0,0 +1,93 @@
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+
+class PendingNotifications:
+    '''
+    Notifications waiting for the commit of the transaction they were
+    queued in, written with one bulk_create when it commits.
+
+    The notifications of each savepoint are kept apart, with a marker
+    registered as that savepoint's on_commit callback: Django discards the
+    marker if the savepoint rolls back, and only the notifications whose
+    marker ran are written.
+    '''
+    def __init__(self, connection, using):
+        self.using = using
+        self.savepoints = {}
+        # The transaction (or savepoint) the buffer was started in: when it
+        # rolls back, Django drops the flushes registered below with it
+        self.scope = set(connection.savepoint_ids)
+        self.flushes = 0
+        self.hooks = connection.run_on_commit
+
+    def add(self, connection, notifications):
+        key = tuple(sid for sid in connection.savepoint_ids if sid is not None)
+        savepoint = self.savepoints.get(key)
+        if savepoint is None:
+            savepoint = self.savepoints[key] = SavepointNotifications()
+            transaction.on_commit(savepoint, using=self.using)
+            # The flush must run after the markers: register it again after
+            # every new one, only the last of the flushes does the work.
+            # Not through on_commit(), which would tie it to the current
+            # savepoint rather than to the scope of the buffer
+            connection.run_on_commit.append((self.scope, self, False))
+            self.flushes += 1
+        savepoint.notifications.extend(notifications)
+
+    def __call__(self):
+        from .models import Notification
+
+        self.flushes -= 1
+        if self.flushes:
+            return
+        connection = connections[self.using]
+        if connection.__dict__.get("pending_notifications") is self:
+            del connection.__dict__["pending_notifications"]
+        notifications = [
+            notification
+            for savepoint in self.savepoints.values() if savepoint.committed
+            for notification in savepoint.notifications
+        ]
+        self.savepoints = {}
+        if notifications:
+            Notification.objects.using(self.using).bulk_create(notifications)
+
+
+class SavepointNotifications:
+    def __init__(self):
+        self.notifications = []
+        self.committed = False
+
+    def __call__(self):
+        self.committed = True
+
+
+def queue_notifications(notifications, using=DEFAULT_DB_ALIAS):
+    '''
+    Save the notifications with one bulk_create per transaction, once it
+    commits. Outside of a transaction they are saved right away.
+    '''
+    from .models import Notification
+
+    connection = connections[using]
+    if not connection.in_atomic_block:
+        # Whatever is left was queued in a transaction that rolled back
+        connection.__dict__.pop("pending_notifications", None)
+        Notification.objects.using(using).bulk_create(list(notifications))
+        return
+
+    pending = connection.__dict__.get("pending_notifications")
+    if pending is not None and pending.hooks is not connection.run_on_commit:
+        # Django replaces the list of callbacks when a savepoint or the
+        # transaction rolls back, which is rare enough to look it up then
+        if any(callback is pending for _, callback, _ in connection.run_on_commit):
+            pending.hooks = connection.run_on_commit
+        else:
+            pending = None
+    if pending is None:
+        pending = connection.__dict__["pending_notifications"] = PendingNotifications(connection, using)
+    pending.add(connection, notifications)
+
+
+def queue_notification(notification, using=DEFAULT_DB_ALIAS):
+    queue_notifications([notification], using=using)
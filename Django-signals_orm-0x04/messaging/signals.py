@@ -1,36 +1,126 @@
-from django.db.models.signals import post_save, pre_save, post_delete
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.utils.timezone import now
+from .conversation_cache import bump_conversation_versions
+from .inbox import adjust_unread_count, invalidate_unread_counts
 from .models import Message, Notification, MessageHistory
+from .notifications import queue_notification
+
+
+MISSING = object()
 
 
 @receiver(post_save, sender=Message)
-def create_notification(sender, instance, created, **kwargs):
-    if created:
-        Notification.objects.create(user=instance.receiver, message=instance)
+def create_notification(sender, instance, created, raw=False, using=None, **kwargs):
+    '''
+    Queue a notification for the receiver; the notifications of a transaction
+    are written together when it commits.
+    '''
+    if created and not raw:
+        queue_notification(Notification(user_id=instance.receiver_id, message=instance), using=using)
 
 
 @receiver(pre_save, sender=Message)
-def log_message_edit(sender, instance, **kwargs):
-    if instance.pk: # Check if the message already exists
-        old_message = Message.objects.filter(pk=instance.pk).first()
-        if old_message and old_message.content != instance.content:
-            # Log the old content in MessageHistory
-            MessageHistory.objects.create(message=instance, old_content=old_message.content)
-            # Update edit-related fields
-            instance.edited = true
-            instance.edited_at = now() # Set the edit timestamp
-            # Ensure edited_by is set in the view where edits are handled
+def log_message_edit(sender, instance, raw=False, update_fields=None, **kwargs):
+    '''
+    Logs the previous content in MessageHistory when the content changes.
+
+    It is compared against the content loaded with the message, so saves
+    that leave it alone (like marking as read) cost no extra query.
+    '''
+    if raw or instance.pk is None: # New message, nothing to compare with
+        return
+    if update_fields is not None and "content" not in update_fields:
+        return
+    if "content" not in instance.__dict__:
+        return # Deferred and never set, so not saved either
+
+    old_content = getattr(instance, "loaded_values", {}).get("content", MISSING)
+    if old_content is MISSING:
+        # Not loaded from the database (or loaded with content deferred)
+        old_content = Message.objects.filter(pk=instance.pk).values_list("content", flat=True).first()
+        if old_content is None:
+            return
 
+    if old_content != instance.content:
+        # Log the old content in MessageHistory
+        MessageHistory.objects.create(message=instance, old_content=old_content)
+        # Update edit-related fields
+        instance.edited = True
+        instance.edited_at = now() # Set the edit timestamp
+        # Ensure edited_by is set in the view where edits are handled
 
-@receiver(post_delete, sender=User)
-def delete_user_related_data(sender, instance, **kwargs):
+
+@receiver(post_save, sender=Message)
+def update_unread_count(sender, instance, created, raw=False, update_fields=None, **kwargs):
     '''
-    Deletes all messages, notifications, and message histories related to the user when their account is deleted.
+    Keeps the cached unread count of the receiver in step with the message.
     '''
-    # Delete all messages where the user is the sender or receiver
-    Message.objects.filter(sender=instance).delete()
-    Message.objects.filter(receiver=instance).delete()
+    if raw:
+        return
+    if created:
+        if not instance.read:
+            adjust_unread_count(instance.receiver_id, 1)
+        return
+    if update_fields is not None and "read" not in update_fields:
+        return
+    was_read = getattr(instance, "loaded_values", {}).get("read", MISSING)
+    if was_read is MISSING:
+        # Not loaded from the database, whether it changed is unknown
+        invalidate_unread_counts([instance.receiver_id])
+    elif was_read != instance.read:
+        adjust_unread_count(instance.receiver_id, -1 if instance.read else 1)
+
+
+@receiver(post_delete, sender=Message)
+def forget_unread_message(sender, instance, **kwargs):
+    if not instance.read:
+        adjust_unread_count(instance.receiver_id, -1)
+
+
+@receiver(post_save, sender=Message)
+def invalidate_conversation_on_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    '''
+    New and edited messages show up in the cached conversation right away.
+
+    Other saves, like marking as read, leave the cached conversation alone
+    and cost no query: what changed is told by the values loaded with the
+    message.
+    '''
+    if raw:
+        return
+    if created:
+        bump_conversation_versions(thread_root_ids(instance))
+        return
+    if update_fields is not None and not {"content", "parent_message", "parent_message_id"} & set(update_fields):
+        return
+
+    loaded_values = getattr(instance, "loaded_values", {})
+    changed = {
+        name for name in ("content", "parent_message_id")
+        # Deferred and never set fields are not saved
+        if name in instance.__dict__ and loaded_values.get(name, MISSING) != instance.__dict__[name]
+    }
+    if not changed:
+        return
+    roots = set(thread_root_ids(instance))
+    old_parent_id = loaded_values.get("parent_message_id", MISSING)
+    if "parent_message_id" in changed and old_parent_id is not MISSING:
+        # Moved out of the conversation it was in, too
+        roots.update(_thread_root_ids(instance.pk, old_parent_id))
+    bump_conversation_versions(roots)
+
+
+@receiver(post_delete, sender=Message)
+def invalidate_conversation_on_delete(sender, instance, **kwargs):
+    bump_conversation_versions(thread_root_ids(instance))
+
+
+def thread_root_ids(message):
+    return _thread_root_ids(message.pk, message.parent_message_id)
+
 
-    # Delete all notifications associated with the user
-    Notifiication.objects.filter(user=instance).delete()
+def _thread_root_ids(message_id, parent_id):
+    if parent_id is None:
+        return [message_id]
+    return Message.objects.thread_roots([parent_id]).values_list("pk", flat=True)
@@ -1,6 +1,16 @@
+import math
+from io import StringIO
+
 from django.test import TestCase
 from django.contrib.auth.models import User
-from .models import Message, Notification, MessageHistory
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.urls import reverse
+from django.test.utils import CaptureQueriesContext
+from . import conversation_cache
+from .cleanup import cleanup_progress, delete_user_data, request_user_cleanup, STALLED_AFTER
+from .models import Message, Notification, MessageHistory, PendingUserCleanup
 from django.utils.timezone import now
 
 
@@ -44,6 +54,66 @@ class MessageEditTestCase(TestCase):
         self.assertEqual(self.message.edited_by, self.user1)
 
 
+class MessageEditTrackingTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="password1")
+        self.user2 = User.objects.create_user(username="user2", password="password2")
+        Message.objects.create(sender=self.user1, receiver=self.user2, content="Initial content")
+        self.message = Message.objects.get()
+
+    def test_saves_without_content_change_cost_no_extra_query(self):
+        self.message.read = True
+        with self.assertNumQueries(1):
+            self.message.save()
+
+        with self.assertNumQueries(1):
+            self.message.mark_read()
+        deferred = Message.objects.only("read", "receiver").get()
+        with self.assertNumQueries(1):
+            deferred.mark_read()
+
+        self.assertFalse(MessageHistory.objects.exists())
+
+    def test_content_change_is_logged_once(self):
+        self.message.content = "Edited content"
+        # History INSERT and message UPDATE, no SELECT
+        with self.assertNumQueries(2):
+            self.message.save()
+        # Same content again: the snapshot was updated by the save
+        self.message.save()
+
+        self.assertEqual(
+            list(MessageHistory.objects.values_list("old_content", flat=True)), ["Initial content"]
+        )
+
+    def test_update_fields_with_content_saves_the_edit_flags(self):
+        self.message.content = "Edited content"
+        self.message.save(update_fields=["content"])
+
+        message = Message.objects.get()
+        self.assertTrue(message.edited)
+        self.assertIsNotNone(message.edited_at)
+        self.assertEqual(message.history.get().old_content, "Initial content")
+
+    def test_refresh_from_db_resets_the_snapshot(self):
+        Message.objects.update(content="Changed elsewhere")
+        self.message.refresh_from_db()
+
+        self.message.save()
+
+        self.assertFalse(MessageHistory.objects.exists())
+        self.assertFalse(Message.objects.get().edited)
+
+    def test_messages_not_loaded_from_the_database_are_compared_with_it(self):
+        message = Message(
+            pk=self.message.pk, sender=self.user1, receiver=self.user2, content="Rewritten",
+            timestamp=self.message.timestamp,
+        )
+        message.save()
+
+        self.assertEqual(message.history.get().old_content, "Initial content")
+
+
 class DeleteUserTestCase(TestCase):
     def setUp(self):
         self.user1 = User.objects.create_user(username="user1", password="password1")
@@ -62,6 +132,92 @@ class DeleteUserTestCase(TestCase):
         self.assertEqual(Notification.objects.count(), 0)
 
 
+class ChunkedUserCleanupTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="password1")
+        self.user2 = User.objects.create_user(username="user2", password="password2")
+        self.user3 = User.objects.create_user(username="user3", password="password3")
+
+    def send(self, sender, receiver, content, parent=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(
+                sender=sender, receiver=receiver, content=content, parent_message=parent
+            )
+
+    def test_deletes_messages_replies_histories_and_notifications(self):
+        root = self.send(self.user1, self.user2, "Root")
+        reply = self.send(self.user2, self.user3, "Reply from someone else", root)
+        self.send(self.user3, self.user2, "Nested reply", reply)
+        for i in range(5):
+            self.send(self.user2, self.user1, f"To user1 {i}")
+        edited = self.send(self.user2, self.user3, "Kept")
+        edited.content = "Kept, edited by user1"
+        edited.edited_by = self.user1
+        edited.save()
+        root.content = "Root, edited"
+        root.save()
+        progress = []
+
+        counts = delete_user_data(self.user1.pk, chunk_size=2, progress=progress.append)
+
+        self.assertEqual(list(Message.objects.values_list("content", flat=True)), ["Kept, edited by user1"])
+        self.assertIsNone(Message.objects.get().edited_by)
+        self.assertEqual(MessageHistory.objects.filter(message=edited).count(), 1)
+        self.assertEqual(Notification.objects.get().message, edited)
+        self.assertFalse(User.objects.filter(pk=self.user1.pk).exists())
+        self.assertEqual(counts, {"notifications": 8, "histories": 1, "messages": 8})
+        self.assertEqual(progress[-1], counts)
+        self.assertGreater(len(progress), 4)
+
+    def test_memory_is_bounded_by_the_chunk_size(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.bulk_send([
+                Message(sender=self.user1, receiver=self.user2, content=f"Message {i}")
+                for i in range(50)
+            ])
+
+        with CaptureQueriesContext(connection) as queries:
+            delete_user_data(self.user1.pk, chunk_size=10)
+
+        # Never more than a chunk of IDs in one statement
+        deletes = [query["sql"] for query in queries if query["sql"].startswith("DELETE")]
+        self.assertTrue(all(sql.count(",") < 10 for sql in deletes if "IN (" in sql))
+        self.assertFalse(Message.objects.exists())
+
+    def test_requested_cleanup_is_pending_until_started(self):
+        # The cleanup thread is not started: as if the worker stopped first
+        request_user_cleanup(self.user1.pk)
+
+        self.assertEqual(cleanup_progress(self.user1.pk)["state"], "pending")
+        self.assertIsNone(cleanup_progress(self.user2.pk))
+
+    def test_marker_is_removed_with_the_user(self):
+        request_user_cleanup(self.user1.pk)
+
+        delete_user_data(self.user1.pk)
+
+        self.assertFalse(PendingUserCleanup.objects.exists())
+
+    def test_stalled_cleanup_is_resumed(self):
+        for i in range(5):
+            self.send(self.user1, self.user2, f"Message {i}")
+        request_user_cleanup(self.user1.pk)
+        request_user_cleanup(self.user2.pk)
+        PendingUserCleanup.objects.filter(user_id=self.user1.pk).update(
+            heartbeat=now() - STALLED_AFTER * 2
+        )
+        self.assertEqual(cleanup_progress(self.user1.pk)["state"], "stalled")
+
+        call_command("resume_user_cleanups", stdout=StringIO())
+
+        self.assertFalse(User.objects.filter(pk=self.user1.pk).exists())
+        self.assertFalse(Message.objects.exists())
+        # Still running somewhere, as far as anyone can tell
+        self.assertEqual(
+            list(PendingUserCleanup.objects.values_list("user_id", flat=True)), [self.user2.pk]
+        )
+
+
 class ThreadedConversationTestCase(TestCase):
     def setUp(self):
         self.user1 = User.objects.create_user(username="user1", password="password1")
@@ -96,6 +252,138 @@ class ThreadedConversationTestCase(TestCase):
             list(messages)  # Trigger evaluation
 
 
+class ReplyTreeTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="password1")
+        self.user2 = User.objects.create_user(username="user2", password="password2")
+        self.root = Message.objects.create(sender=self.user1, receiver=self.user2, content="Root")
+
+    def reply(self, parent, content):
+        return Message.objects.create(
+            sender=self.user2, receiver=self.user1, content=content, parent_message=parent
+        )
+
+    def test_deep_thread_in_one_query(self):
+        parent = self.root
+        for depth in range(50):
+            parent = self.reply(parent, f"Depth {depth}")
+        Message.objects.create(sender=self.user1, receiver=self.user2, content="Other thread")
+
+        with self.assertNumQueries(1):
+            replies = self.root.get_all_replies()
+            senders = {reply.sender.username for reply in replies}
+
+        self.assertEqual(len(replies), 50)
+        self.assertEqual(senders, {"user2"})
+
+    def test_thread_is_nested_in_order(self):
+        first = self.reply(self.root, "First")
+        second = self.reply(self.root, "Second")
+        nested = self.reply(first, "Nested")
+        unrelated = Message.objects.create(sender=self.user1, receiver=self.user2, content="Other")
+        self.reply(unrelated, "Other reply")
+
+        with self.assertNumQueries(1):
+            root = self.root.get_thread()
+            tree = [
+                (reply.content, [sub.content for sub in reply.thread_replies], reply.parent_message.content)
+                for reply in root.thread_replies
+            ]
+
+        self.assertEqual(tree, [("First", ["Nested"], "Root"), ("Second", [], "Root")])
+        self.assertEqual(nested.get_thread().thread_replies, [])
+
+
+class NotificationBatchTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="password1")
+        self.user2 = User.objects.create_user(username="user2", password="password2")
+
+    def new_messages(self, count):
+        return [
+            Message(sender=self.user1, receiver=self.user2, content=f"Message {i}")
+            for i in range(count)
+        ]
+
+    def test_notifications_are_written_once_per_transaction(self):
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    for i in range(20):
+                        Message.objects.create(sender=self.user1, receiver=self.user2, content=f"Hi {i}")
+                self.assertEqual(Notification.objects.count(), 0)
+
+        inserts = [query for query in queries if query["sql"].startswith('INSERT INTO "messaging_notification"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(Notification.objects.filter(user=self.user2).count(), 20)
+
+    def test_rolled_back_savepoint_drops_its_notifications(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(sender=self.user1, receiver=self.user2, content="Kept")
+            try:
+                with transaction.atomic():
+                    Message.objects.create(sender=self.user1, receiver=self.user2, content="Dropped")
+                    raise ValueError
+            except ValueError:
+                pass
+            Message.objects.create(sender=self.user1, receiver=self.user2, content="Also kept")
+
+        self.assertEqual(
+            sorted(Notification.objects.values_list("message__content", flat=True)),
+            ["Also kept", "Kept"],
+        )
+
+    def test_buffer_is_released_by_commit_and_by_rollback(self):
+        try:
+            with transaction.atomic():
+                Message.objects.create(sender=self.user1, receiver=self.user2, content="Rolled back")
+                raise ValueError
+        except ValueError:
+            pass
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(300):
+                try:
+                    with transaction.atomic():
+                        Message.objects.create(sender=self.user1, receiver=self.user2, content=f"Hi {i}")
+                        if i % 3 == 0:
+                            raise ValueError
+                except ValueError:
+                    pass
+
+        self.assertNotIn("pending_notifications", connections[DEFAULT_DB_ALIAS].__dict__)
+        self.assertEqual(Notification.objects.count(), 200)
+        self.assertFalse(Notification.objects.filter(message__content="Rolled back").exists())
+
+    def test_bulk_send_of_1000_messages(self):
+        batch_size = connection.ops.bulk_batch_size(
+            [field for field in Message._meta.concrete_fields if not field.primary_key], []
+        )
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                messages = Message.objects.bulk_send(self.new_messages(1000))
+
+        # Savepoint, message INSERTs, release, notification INSERTs; against
+        # 2000 single INSERTs when every message goes through save()
+        self.assertLess(len(queries), 2 + 2 * math.ceil(1000 / batch_size) + 1)
+        self.assertEqual(len(messages), 1000)
+        self.assertEqual(
+            Notification.objects.filter(message__in=[m.pk for m in messages[:500]]).count(), 500
+        )
+        self.assertEqual(Notification.objects.count(), 1000)
+
+    def test_one_by_one_creation_batches_the_notifications(self):
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    for message in self.new_messages(1000):
+                        message.save()
+
+        inserts = [query for query in queries if "messaging_notification" in query["sql"]]
+        self.assertLessEqual(len(inserts), math.ceil(1000 / 200))
+        self.assertEqual(Notification.objects.count(), 1000)
+
+
 class UnreadMessagesManagerTestCase(TestCase):
     def setUp(self):
         self.user1 = User.objects.create_user(username="user1", password="password1")
@@ -112,20 +400,112 @@ class UnreadMessagesManagerTestCase(TestCase):
         self.assertTrue(all(message.read is False for message in unread_messages))
 
 
-from django.test import TestCase
-from django.contrib.auth.models import User
-from django.urls import reverse
-from .models import Message
+class UnreadInboxTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user1 = User.objects.create_user(username="user1", password="password1")
+        self.user2 = User.objects.create_user(username="user2", password="password2")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.messages = Message.objects.bulk_send([
+                Message(sender=self.user2, receiver=self.user1, content=f"Unread {i}") for i in range(3)
+            ] + [Message(sender=self.user1, receiver=self.user2, content="To user2")])
+
+    def send(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(sender=self.user2, receiver=self.user1, content="New", **kwargs)
+
+    def test_count_is_cached_and_follows_new_messages(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(Message.unread.count_for(self.user1), 3)
+        self.send()
+        self.send(read=True)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Message.unread.count_for(self.user1), 4)
+
+    def test_bulk_mark_read_is_one_update(self):
+        Message.unread.count_for(self.user1)
+        ids = [message.pk for message in self.messages]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(1):
+                marked = Message.unread.mark_read(self.user1, ids)
+
+        # The message to user2 is not user1's to mark
+        self.assertEqual(marked, 3)
+        self.assertFalse(Message.objects.get(receiver=self.user2).read)
+        with self.assertNumQueries(0):
+            self.assertEqual(Message.unread.count_for(self.user1), 0)
+        self.assertEqual(Message.unread.count_for(self.user2), 1)
+
+    def test_single_saves_and_deletes_adjust_the_count(self):
+        Message.unread.count_for(self.user1)
+        first, second, third = Message.objects.filter(receiver=self.user1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.mark_read()
+            second.delete()
+            third.read = False
+            third.save()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Message.unread.count_for(self.user1), 1)
+
+    def test_save_after_refresh_from_db_keeps_the_count(self):
+        Message.unread.count_for(self.user1)
+        message = Message.objects.filter(receiver=self.user1).first()
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.unread.mark_read(self.user1, [message.pk])
+
+        message.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            message.save()
+
+        # Already counted by mark_read: the save must not decrement again
+        self.assertEqual(Message.unread.count_for(self.user1), 2)
+
+    def test_inbox_uses_the_partial_index(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Message._meta.db_table)
+        self.assertEqual(
+            constraints["messaging_unread_inbox_idx"]["columns"], ["receiver_id", "read", "timestamp"]
+        )
+        self.assertEqual(
+            [message.content for message in Message.unread.for_user(self.user1)],
+            ["Unread 2", "Unread 1", "Unread 0"],
+        )
+
+    def test_badge_count_view_does_not_query_messages(self):
+        self.client.force_login(self.user1)
+        Message.unread.count_for(self.user1)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("unread_count"))
+
+        self.assertEqual(response.json(), {"unread": 3})
+        self.assertFalse([query for query in queries if "messaging_message" in query["sql"]])
+
+    def test_mark_read_view(self):
+        self.client.force_login(self.user1)
+
+        response = self.client.post(reverse("mark_read"), {"ids": [self.messages[0].pk, "x"]})
+
+        self.assertEqual(response.json(), {"marked": 1, "unread": 2})
+
 
 class ConversationCacheTestCase(TestCase):
     def setUp(self):
+        cache.clear()
+        conversation_cache.stats.reset()
         self.user = User.objects.create_user(username="user", password="password")
+        self.other = User.objects.create_user(username="other", password="password")
         self.client.login(username="user", password="password")
-        self.conversation_id = 1
 
         # Create messages
-        Message.objects.create(sender=self.user, receiver=self.user, content="Message 1", conversation_id=self.conversation_id)
-        Message.objects.create(sender=self.user, receiver=self.user, content="Message 2", conversation_id=self.conversation_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.root = Message.objects.create(sender=self.user, receiver=self.other, content="Message 1")
+            Message.objects.create(sender=self.other, receiver=self.user, content="Message 2", parent_message=self.root)
+        self.conversation_id = self.root.pk
 
     def test_cache_view(self):
         url = reverse("conversation_view", args=[self.conversation_id])
@@ -134,10 +514,69 @@ class ConversationCacheTestCase(TestCase):
         response1 = self.client.get(url)
         self.assertEqual(response1.status_code, 200)
 
-        # Modify database (should not affect cached response)
-        Message.objects.create(sender=self.user, receiver=self.user, content="Message 3", conversation_id=self.conversation_id)
+        # Second request (cached): no message query
+        with CaptureQueriesContext(connection) as queries:
+            response2 = self.client.get(url)
+        self.assertEqual(response1.content, response2.content)
+        self.assertFalse([query for query in queries if "messaging_message" in query["sql"]])
+
+        # A new message shows up right away
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(sender=self.user, receiver=self.other, content="Message 3", parent_message=self.root)
+        response3 = self.client.get(url)
+        self.assertContains(response3, "Message 3")
+        self.assertEqual(conversation_cache.stats.as_dict(), {"hits": 1, "misses": 2, "hit_rate": 0.333})
+
+    def test_read_status_does_not_invalidate(self):
+        conversation_cache.get_conversation(self.conversation_id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.get(content="Message 2").mark_read()
+
+        with self.assertNumQueries(0):
+            conversation_cache.get_conversation(self.conversation_id)
+
+    def test_read_only_save_of_a_reply_is_one_update(self):
+        reply = Message.objects.get(content="Message 2")
+        conversation_cache.get_conversation(self.conversation_id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reply.read = True
+            with self.assertNumQueries(1):
+                reply.save()
+
+        with self.assertNumQueries(0):
+            conversation_cache.get_conversation(self.conversation_id)
+
+    def test_moved_reply_leaves_both_conversations_fresh(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            other_root = Message.objects.create(sender=self.user, receiver=self.other, content="Other")
+        conversation_cache.get_conversation(self.conversation_id)
+        conversation_cache.get_conversation(other_root.pk)
+        reply = Message.objects.get(content="Message 2")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reply.parent_message = other_root
+            reply.save()
+
+        self.assertEqual(len(conversation_cache.get_conversation(self.conversation_id)["messages"]), 1)
+        self.assertEqual(len(conversation_cache.get_conversation(other_root.pk)["messages"]), 2)
+
+    def test_only_participants_see_the_conversation(self):
+        outsider = User.objects.create_user(username="outsider", password="password")
+        self.client.force_login(outsider)
+
+        response = self.client.get(reverse("conversation_view", args=[self.conversation_id]))
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_warmup_loads_the_most_active_conversations(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            quiet = Message.objects.create(sender=self.user, receiver=self.other, content="Quiet")
+
+        call_command("warm_conversation_cache", limit=1, stdout=StringIO())
 
-        # Second request (cached)
-        response2 = self.client.get(url)
-        self.assertEqual(response2.status_code, 200)
-        self.assertEqual(response1.content, response2.content)  # Response should match due to cache
+        with self.assertNumQueries(0):
+            self.assertEqual(len(conversation_cache.get_conversation(self.conversation_id)["messages"]), 2)
+        with self.assertNumQueries(2):
+            conversation_cache.get_conversation(quiet.pk)
@@ -3,5 +3,10 @@ from . import views
 
 urlpatterns = [
     path("delete_user/", views.delete_user, name="delete_user"),
-    path("unread_messages/", views.unread_messages_view, name="unread_messages")
+    path("delete_user/<int:user_id>/status/", views.user_cleanup_status, name="user_cleanup_status"),
+    path("unread_messages/", views.unread_messages_view, name="unread_messages"),
+    path("unread_messages/count/", views.unread_count_view, name="unread_count"),
+    path("unread_messages/mark_read/", views.mark_read_view, name="mark_read"),
+    path("conversations/<int:conversation_id>/", views.conversation_view, name="conversation_view"),
+    path("conversations/cache_stats/", views.conversation_cache_stats, name="conversation_cache_stats"),
 ]
@@ -1,8 +1,18 @@
-from django.shortcuts import get_object_or_404, redirect
+from functools import partial
+
+from django.shortcuts import get_object_or_404, redirect, render
 from django.utils.timezone import now
+from . import conversation_cache
+from .cleanup import cleanup_progress, request_user_cleanup, start_user_cleanup
+from .conversation_cache import get_conversation
 from .models import Message
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth import logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.http import Http404, JsonResponse
+from django.views.decorators.http import require_POST
 
 
 def edit_message(request, message_id):
@@ -24,12 +34,33 @@ def edit_message(request, message_id):
 def delete_user(request):
     '''
     Deletes the currently logged-in user's account and cleans up related data.
+
+    The account is closed right away and its data deleted by a background
+    thread of this worker. If the worker stops first, the cleanup stays
+    recorded as pending and is finished by the resume_user_cleanups
+    command, which should run periodically (e.g. from cron).
     '''
     user = request.user
-    user.delete() # Triggers the post_delete signal
+    with transaction.atomic():
+        user.is_active = False
+        user.save(update_fields=["is_active"])
+        request_user_cleanup(user.pk)
+        transaction.on_commit(partial(start_user_cleanup, user.pk))
+    logout(request)
     return redirect("home") # Redirect to the homepage after deletion
 
 
+@staff_member_required
+def user_cleanup_status(request, user_id):
+    '''
+    Progress of the background deletion of a user's data.
+    '''
+    progress = cleanup_progress(user_id)
+    if progress is None:
+        raise Http404("No cleanup for this user.")
+    return JsonResponse(progress)
+
+
 def conversation_view(request):
     '''
     Display messages in a threaded conversation format.
@@ -63,18 +94,49 @@ def unread_messages_view(request):
     '''
     Displays unread messages for the logged-in user.
     '''
-    unread_messages = Message.unread.unread_for_user(request.user) # Use cutom manager
-    # Use the custom manager to filter unread messages and explicitly apply .only()
-    unread_messages = Message.unread.filter(receiver=request.user, read=False).only("id", "content", "timestamp", "sender")
+    # Use the custom manager to filter unread messages, with .only() applied
+    unread_messages = Message.unread.for_user(request.user)
 
     return render(request, "unread_messages.html", {"unread_messages": unread_messages})
 
 
 @login_required
-@cache_page(60) # Cache the view for 60 seconds
+def unread_count_view(request):
+    '''
+    Unread badge count of the logged-in user, from the cached counter.
+    '''
+    return JsonResponse({"unread": Message.unread.count_for(request.user)})
+
+
+@login_required
+@require_POST
+def mark_read_view(request):
+    '''
+    Marks the messages whose IDs are posted as `ids` as read.
+    '''
+    ids = [int(pk) for pk in request.POST.getlist("ids") if pk.isdigit()]
+    marked = Message.unread.mark_read(request.user, ids)
+    return JsonResponse({"marked": marked, "unread": Message.unread.count_for(request.user)})
+
+
+@login_required
 def conversation_view(request, conversation_id):
     '''
-    Displays a list of messages in a conversatioin
+    Displays a list of messages in a conversation.
+
+    The conversation is a thread, its ID the ID of the first message. It is
+    read from the conversation cache, which new messages invalidate, and
+    only shown to the users taking part in it.
+    '''
+    conversation = get_conversation(conversation_id)
+    if conversation is None or request.user.pk not in conversation["participants"]:
+        raise Http404("No such conversation.")
+    return render(request, "conversation.html", {"messages": conversation["messages"]})
+
+
+@staff_member_required
+def conversation_cache_stats(request):
+    '''
+    Hit and miss counts of the conversation cache in this process.
     '''
-    messages = Message.objects.filter(conversation_id=conversation_id).order_by("timestamp")
-    return render(request, "conversation.html", {"messages": messages})
+    return JsonResponse(conversation_cache.stats.as_dict())
@@ -0,0 +1,66 @@
+"""
+Validators for conditional GET on the chats list endpoints.
+
+They are read from the denormalized activity fields on Conversation with a
+single aggregate query, so a 304 is answered before any serialization runs.
+Use them with django.views.decorators.http.condition.
+
+Only ETags are offered: Last-Modified has a resolution of one second, and a
+message sent in the same second as the previous response would be answered
+with a 304 to clients that only send If-Modified-Since.
+"""
+import hashlib
+import uuid
+
+from django.db.models import Count, Max, Sum
+
+from .models import Conversation, ConversationParticipant
+
+
+def _etag(request, *parts):
+    raw = ':'.join(str(part) for part in (request.get_full_path(), *parts))
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def conversation_list_state(request):
+    """
+    Activity summary of every conversation the requesting user is in.
+    """
+    return ConversationParticipant.objects.filter(user_id=request.user.pk).aggregate(
+        conversations=Count('conversation_id'),
+        last_message_at=Max('conversation__last_message_at'),
+        last_created_at=Max('conversation__created_at'),
+        messages=Sum('conversation__message_count'),
+        membership=Sum('conversation__membership_version'),
+    )
+
+
+def conversation_list_etag(request, *args, **kwargs):
+    state = conversation_list_state(request)
+    return _etag(
+        request, request.user.pk, state['conversations'], state['last_message_at'],
+        state['last_created_at'], state['messages'], state['membership']
+    )
+
+
+def message_list_state(request, conversation_pk):
+    """
+    Activity summary of one conversation, or None if it does not exist.
+    """
+    try:
+        conversation_pk = uuid.UUID(str(conversation_pk))
+    except ValueError:
+        return None
+    return Conversation.objects.filter(pk=conversation_pk).values(
+        'last_message_at', 'message_count', 'membership_version'
+    ).first()
+
+
+def message_list_etag(request, *args, conversation_pk=None, **kwargs):
+    state = message_list_state(request, conversation_pk)
+    if state is None:
+        return None
+    return _etag(
+        request, state['last_message_at'], state['message_count'], state['membership_version']
+    )
+
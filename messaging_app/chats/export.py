@@ -0,0 +1,93 @@
+"""
+Streaming exports of messages, as NDJSON or CSV.
+
+Rows are read with a keyset walk over (sent_at, message_id): every batch is
+a short indexed range query started after the last row of the previous one,
+and its rows are streamed with QuerySet.iterator(), so neither the queryset
+cache nor a long-lived cursor ever holds more than one batch. Memory stays
+flat whatever the size of the export.
+"""
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.http import StreamingHttpResponse
+
+from .pagination import MessageCursorPagination
+
+# Rows fetched per query of the keyset walk
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FIELDS = (
+    'message_id', 'conversation_id', 'sender_id', 'sender_email', 'message_body', 'sent_at',
+)
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def iter_messages(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the messages of `queryset` as dicts of EXPORT_FIELDS, oldest first.
+    """
+    keyset = MessageCursorPagination()
+    queryset = queryset.order_by(*keyset.ordering).values(
+        'message_id', 'conversation_id', 'sender_id', 'message_body', 'sent_at',
+        sender_email=F('sender__email'),
+    )
+    position = None
+    while True:
+        batch = queryset
+        if position is not None:
+            batch = batch.filter(keyset.keyset_filter(position, reverse=False))
+        count = 0
+        for row in batch[:chunk_size].iterator(chunk_size=chunk_size):
+            count += 1
+            yield row
+        if count < chunk_size:
+            return
+        position = keyset.position_of(row)
+
+
+def ndjson_lines(rows):
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode({field: row[field] for field in EXPORT_FIELDS}) + '\n'
+
+
+class _Echo:
+    # File-like object for csv.writer that hands each line back
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in rows:
+        sent_at = row['sent_at']
+        yield writer.writerow([
+            *(row[field] for field in EXPORT_FIELDS[:-1]),
+            sent_at.isoformat() if sent_at is not None else '',
+        ])
+
+
+def export_lines(queryset, export_format, chunk_size=EXPORT_CHUNK_SIZE):
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format: {export_format!r}")
+    rows = iter_messages(queryset, chunk_size)
+    return ndjson_lines(rows) if export_format == 'ndjson' else csv_lines(rows)
+
+
+def export_response(queryset, export_format, filename, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    StreamingHttpResponse sending the messages of `queryset` as they are read.
+    """
+    response = StreamingHttpResponse(
+        export_lines(queryset, export_format, chunk_size),
+        content_type=FORMATS[export_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
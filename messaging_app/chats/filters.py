@@ -1,5 +1,7 @@
 import django_filters
+from .membership import get_conversation_ids
 from .models import Message, Conversation
+from .search import search_messages
 
 class MessageFilter(django_filters.FilterSet):
     # Filter by messages within a time range
@@ -14,6 +16,17 @@ class MessageFilter(django_filters.FilterSet):
         help_text="Filter by user ID of a participant in the conversation."
     )
 
+    # Full-text search on message bodies, see chats.search
+    search = django_filters.CharFilter(
+        method='filter_search',
+        help_text="Only messages containing every word of this text."
+    )
+
     class Meta:
         model = Message
-        fields = ['sent_at_after', 'sent_at_before', 'conversation__participants__user']
\ No newline at end of file
+        fields = ['sent_at_after', 'sent_at_before', 'conversation__participants__user', 'search']
+
+    def filter_search(self, queryset, name, value):
+        # Search results never reach outside the user's own conversations
+        conversation_ids = get_conversation_ids(self.request) if self.request is not None else ()
+        return search_messages(queryset.filter(conversation_id__in=conversation_ids), value)
@@ -0,0 +1,249 @@
+"""
+Load runner for the chats API.
+
+Every virtual user logs in through the JWT endpoint, then loops over
+weighted scenarios (list conversations, list messages, walk the message
+history, send a message) on its own keep-alive connection until the run
+ends. Latencies are recorded per scenario step and reported as
+percentiles with the request rate.
+
+Only the standard library is used, so it runs wherever the project does;
+see the load_test_api command.
+"""
+import http.client
+import json
+import math
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class LoadResults:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.started = self.finished = None
+
+    def record(self, name, seconds, ok):
+        with self.lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def summary(self):
+        """
+        {name: {requests, errors, p50, p95, p99 (ms), rps}}, with a "total"
+        entry over every request.
+        """
+        with self.lock:
+            groups = {name: sorted(values) for name, values in self.latencies.items()}
+            errors = dict(self.errors)
+        groups['total'] = sorted(value for values in groups.values() for value in values)
+        errors['total'] = sum(errors.values())
+        elapsed = self.elapsed
+        return {
+            name: {
+                'requests': len(values),
+                'errors': errors.get(name, 0),
+                **{
+                    f'p{int(fraction * 100)}': (
+                        None if not values else round(percentile(values, fraction) * 1000, 2)
+                    )
+                    for fraction in (0.5, 0.95, 0.99)
+                },
+                'rps': round(len(values) / elapsed, 1) if elapsed else None,
+            }
+            for name, values in groups.items()
+        }
+
+
+class VirtualUser:
+    """
+    One client: a keep-alive connection, a JWT and what it has seen so far.
+    """
+
+    def __init__(self, base_url, email, password, results, rng, page_size=50, max_pages=5):
+        url = urlsplit(base_url)
+        self.host, self.port = url.hostname, url.port or (443 if url.scheme == 'https' else 80)
+        self.https = url.scheme == 'https'
+        self.prefix = url.path.rstrip('/')
+        self.email = email
+        self.password = password
+        self.results = results
+        self.rng = rng
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.connection = None
+        self.token = None
+        self.conversation_ids = []
+
+    def connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self.connection = cls(self.host, self.port, timeout=30)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+    def request(self, name, method, path, body=None, expected=(200,)):
+        """
+        Send one request and record its latency under `name`. Returns the
+        decoded JSON body, or None when the request failed.
+        """
+        headers = {'Accept': 'application/json'}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+            body = json.dumps(body)
+        if self.token is not None:
+            headers['Authorization'] = f'Bearer {self.token}'
+        if path.startswith('http'):
+            path = urlsplit(path)._replace(scheme='', netloc='').geturl()
+
+        started = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connect()
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            payload = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            # Broken keep-alive connection: start a new one next time
+            self.close()
+            self.connection = None
+            self.results.record(name, time.perf_counter() - started, ok=False)
+            return None
+        self.results.record(name, time.perf_counter() - started, ok=status in expected)
+
+        if status == 401 and name != 'login':
+            # Access token expired during a long run
+            self.login()
+        if status not in expected:
+            return None
+        return json.loads(payload) if payload else {}
+
+    def login(self):
+        self.token = None
+        data = self.request('login', 'POST', f'{self.prefix}/token/', {
+            'email': self.email, 'password': self.password,
+        })
+        self.token = data and data.get('access')
+        return self.token is not None
+
+    def pick_conversation(self):
+        if not self.conversation_ids:
+            self.list_conversations()
+        return self.rng.choice(self.conversation_ids) if self.conversation_ids else None
+
+    # Scenarios
+
+    def list_conversations(self):
+        data = self.request('list_conversations', 'GET', f'{self.prefix}/conversations/')
+        if data:
+            self.conversation_ids = [c['conversation_id'] for c in data.get('results', [])]
+
+    def list_messages(self):
+        conversation_id = self.pick_conversation()
+        if conversation_id is not None:
+            self.request(
+                'list_messages', 'GET',
+                f'{self.prefix}/conversations/{conversation_id}/messages/'
+            )
+
+    def paginate_messages(self):
+        conversation_id = self.pick_conversation()
+        if conversation_id is None:
+            return
+        url = f'{self.prefix}/conversations/{conversation_id}/messages/?page_size={self.page_size}'
+        for _ in range(self.max_pages):
+            data = self.request('paginate_messages', 'GET', url)
+            url = data and data.get('next')
+            if not url:
+                break
+
+    def create_message(self):
+        conversation_id = self.pick_conversation()
+        if conversation_id is not None:
+            self.request(
+                'create_message', 'POST',
+                f'{self.prefix}/conversations/{conversation_id}/messages/',
+                {
+                    # MessageSerializer requires it, though the URL decides
+                    'conversation': conversation_id,
+                    'message_body': f'load test message {self.rng.random():.6f}',
+                },
+                expected=(201,)
+            )
+
+
+# Relative frequency of each scenario
+DEFAULT_WEIGHTS = {
+    'list_conversations': 2,
+    'list_messages': 5,
+    'paginate_messages': 2,
+    'create_message': 1,
+}
+
+
+def run_load(base_url, accounts, duration, concurrency, weights=None, seed=0, **user_options):
+    """
+    Run `concurrency` virtual users for `duration` seconds, each logged in
+    as one of `accounts` [(email, password)], and return the LoadResults.
+    """
+    weights = weights or DEFAULT_WEIGHTS
+    names, scenario_weights = zip(*weights.items())
+    results = LoadResults()
+
+    def start_clock():
+        # Runs once every user has logged in: logins are not part of the run
+        with results.lock:
+            results.latencies.pop('login', None)
+            results.errors.pop('login', None)
+        results.started = time.perf_counter()
+
+    ready = threading.Barrier(concurrency + 1, action=start_clock, timeout=120)
+
+    def run(index):
+        rng = random.Random(seed + index)
+        email, password = accounts[index % len(accounts)]
+        user = VirtualUser(base_url, email, password, results, rng, **user_options)
+        try:
+            user.login()
+            ready.wait()
+            deadline = results.started + duration
+            while time.perf_counter() < deadline:
+                if user.token is None and not user.login():
+                    # Do not hammer a server that refuses us
+                    time.sleep(0.1)
+                    continue
+                getattr(user, rng.choices(names, scenario_weights)[0])()
+        finally:
+            user.close()
+
+    threads = [
+        threading.Thread(target=run, args=(index,), name=f'virtual-user-{index}', daemon=True)
+        for index in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    for thread in threads:
+        thread.join()
+    results.finished = time.perf_counter()
+    return results
@@ -0,0 +1,81 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chats.export import EXPORT_CHUNK_SIZE, export_lines
+from chats.models import User, Conversation, ConversationParticipant, Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream the export of one large conversation and report the Python "
+        "memory in use as it goes, which should stay flat. Everything runs in "
+        "a rolled back transaction, so the database is left untouched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--messages', type=int, default=1_000_000,
+            help="Number of messages to export."
+        )
+        parser.add_argument(
+            '--format', dest='export_format', choices=['ndjson', 'csv'], default='ndjson',
+            help="Export format."
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+            help="Rows fetched per query."
+        )
+        parser.add_argument(
+            '--report-every', type=int, default=100_000,
+            help="Print the memory in use every this many rows."
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            conversation = self.create_conversation(options['messages'])
+            messages = Message.objects.filter(conversation=conversation)
+
+            self.stdout.write(f"{'rows':>10} {'current KiB':>12} {'peak KiB':>10} {'s':>8}")
+            tracemalloc.start()
+            start = time.perf_counter()
+            rows = 0
+            try:
+                # The header line of a CSV export is not a row
+                for line in export_lines(messages, options['export_format'], options['chunk_size']):
+                    rows += 1
+                    if rows % options['report_every'] == 0:
+                        self.report(rows, start)
+                self.report(rows, start)
+            finally:
+                tracemalloc.stop()
+            transaction.set_rollback(True)
+
+    def report(self, rows, start):
+        current, peak = tracemalloc.get_traced_memory()
+        self.stdout.write(
+            f"{rows:>10} {current // 1024:>12} {peak // 1024:>10} "
+            f"{time.perf_counter() - start:>8.1f}"
+        )
+
+    def create_conversation(self, message_count, batch_size=10_000):
+        senders = User.objects.bulk_create([
+            User(email=f'bench-{i}@example.com', first_name='Bench', last_name=str(i), role='guest')
+            for i in range(2)
+        ])
+        conversation = Conversation.objects.create()
+        ConversationParticipant.objects.bulk_create([
+            ConversationParticipant(conversation=conversation, user=user) for user in senders
+        ])
+        for offset in range(0, message_count, batch_size):
+            Message.objects.bulk_create([
+                Message(
+                    conversation=conversation,
+                    sender=senders[i % 2],
+                    message_body=f'benchmark message {i}'
+                )
+                for i in range(offset, min(offset + batch_size, message_count))
+            ])
+        return conversation
@@ -0,0 +1,98 @@
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from chats.models import User, Conversation, ConversationParticipant, Message
+from chats.search import search_messages
+from chats.signals import messages_created
+
+
+class Command(BaseCommand):
+    help = (
+        "Time full-text searches against a LIKE scan on a seeded corpus. "
+        "Everything runs in a rolled back transaction, so the database is "
+        "left untouched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--messages', type=int, default=1_000_000,
+            help="Number of messages to seed."
+        )
+        parser.add_argument(
+            '--conversations', type=int, default=1000,
+            help="Number of conversations the messages are spread over."
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help="Timed runs per query; the best run is reported."
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            vocabulary = self.seed(options['messages'], options['conversations'])
+            # Words ranked by frequency: rare, medium and very common
+            queries = [vocabulary[-1], vocabulary[100], vocabulary[0], f'{vocabulary[0]} {vocabulary[100]}']
+            # The message list of the busiest conversation, as searched by
+            # MessageViewSet
+            busiest = (
+                Conversation.objects.annotate(n=Count('messages')).order_by('-n')
+                .values_list('pk', 'n').first()
+            )
+            self.stdout.write(f"Busiest conversation: {busiest[1]} messages")
+            scoped = Message.objects.filter(conversation_id=busiest[0]).order_by('sent_at', 'message_id')
+
+            self.stdout.write(f"{'query':>24} {'path':>8} {'matches':>9} {'ms':>10}")
+            for query in queries:
+                paths = {
+                    'index': lambda: list(search_messages(scoped, query)[:20]),
+                    'like': lambda: list(self.like_scan(scoped, query)[:20]),
+                }
+                matches = search_messages(scoped, query).count()
+                for name, path in paths.items():
+                    best = min(timeit.repeat(path, number=1, repeat=options['repeat']))
+                    self.stdout.write(f"{query:>24} {name:>8} {matches:>9} {best * 1000:>10.2f}")
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def like_scan(queryset, query):
+        for word in query.split():
+            queryset = queryset.filter(message_body__icontains=word)
+        return queryset
+
+    def seed(self, message_count, conversation_count, batch_size=10_000):
+        rng = random.Random(0)
+        vocabulary = [f'word{i}' for i in range(5000)]
+        # Zipf-like word frequencies, as in natural text
+        weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+
+        users = User.objects.bulk_create([
+            User(email=f'bench-{i}@example.com', first_name='Bench', last_name=str(i), role='guest')
+            for i in range(conversation_count // 10 + 2)
+        ])
+        conversations = Conversation.objects.bulk_create([
+            Conversation() for _ in range(conversation_count)
+        ])
+        participants = {}
+        for index, conversation in enumerate(conversations):
+            participants[conversation.pk] = [users[index % len(users)], users[(index + 1) % len(users)]]
+        ConversationParticipant.objects.bulk_create([
+            ConversationParticipant(conversation_id=conversation_id, user=user)
+            for conversation_id, members in participants.items() for user in members
+        ])
+
+        for offset in range(0, message_count, batch_size):
+            messages = []
+            for _ in range(min(batch_size, message_count - offset)):
+                conversation = conversations[int(rng.paretovariate(1.2)) % conversation_count]
+                messages.append(Message(
+                    conversation=conversation,
+                    sender=rng.choice(participants[conversation.pk]),
+                    message_body=' '.join(rng.choices(vocabulary, weights, k=rng.randint(3, 30))),
+                ))
+            Message.objects.bulk_create(messages)
+            messages_created.send(sender=Message, messages=messages, using=messages[0]._state.db)
+        return vocabulary
@@ -0,0 +1,77 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from chats.models import User, Conversation, ConversationParticipant, Message
+from chats.serializers import MessageSerializer, MessageListSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare MessageSerializer(many=True) with the MessageListSerializer "
+        "read path on one page of messages. Everything runs in a rolled back "
+        "transaction, so the database is left untouched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-sizes', type=int, nargs='+', default=[20, 100],
+            help="Page sizes to benchmark."
+        )
+        parser.add_argument(
+            '--senders', type=int, default=5,
+            help="Number of distinct senders in the conversation."
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=50,
+            help="Timed runs per path; the best run is reported."
+        )
+
+    def handle(self, *args, **options):
+        renderer = JSONRenderer()
+        self.stdout.write(f"{'page size':>10} {'path':>10} {'ms':>10}")
+        with transaction.atomic():
+            conversation = self.create_conversation(max(options['page_sizes']), options['senders'])
+            queryset = Message.objects.filter(conversation=conversation)
+
+            for page_size in options['page_sizes']:
+                def model_path():
+                    page = list(queryset.select_related('sender')[:page_size])
+                    return renderer.render(MessageSerializer(page, many=True).data)
+
+                def values_path():
+                    page = list(MessageListSerializer.values(queryset)[:page_size])
+                    return renderer.render(MessageListSerializer(page).data)
+
+                if model_path() != values_path():
+                    self.stderr.write(self.style.ERROR("Outputs differ"))
+                for name, path in (('model', model_path), ('values', values_path)):
+                    best = min(timeit.repeat(path, number=1, repeat=options['repeat']))
+                    self.stdout.write(f"{page_size:>10} {name:>10} {best * 1000:>10.3f}")
+            transaction.set_rollback(True)
+
+    def create_conversation(self, message_count, sender_count):
+        senders = User.objects.bulk_create([
+            User(
+                email=f'bench-{i}@example.com',
+                first_name='Bench',
+                last_name=str(i),
+                role='guest',
+            )
+            for i in range(sender_count)
+        ])
+        conversation = Conversation.objects.create()
+        ConversationParticipant.objects.bulk_create([
+            ConversationParticipant(conversation=conversation, user=user) for user in senders
+        ])
+        Message.objects.bulk_create([
+            Message(
+                conversation=conversation,
+                sender=senders[i % sender_count],
+                message_body=f'benchmark message {i}'
+            )
+            for i in range(message_count)
+        ])
+        return conversation
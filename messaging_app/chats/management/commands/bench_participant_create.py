@@ -0,0 +1,67 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.shortcuts import get_object_or_404
+from django.test.utils import CaptureQueriesContext
+
+from chats.models import User, Conversation, ConversationParticipant
+from chats.views import ConversationViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the per-participant and the bulk participant creation paths "
+        "of ConversationViewSet.create. Everything runs in a rolled back "
+        "transaction, so the database is left untouched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[10, 100, 1000],
+            help="Numbers of participants to benchmark."
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'participants':>12} {'path':>8} {'queries':>8} {'ms':>10}")
+        for size in options['sizes']:
+            with transaction.atomic():
+                user_ids = self.create_users(size)
+                for name, path in (('loop', self.loop_path), ('bulk', self.bulk_path)):
+                    conversation = Conversation.objects.create()
+                    with CaptureQueriesContext(connection) as queries:
+                        start = time.perf_counter()
+                        path(conversation, user_ids)
+                        elapsed = (time.perf_counter() - start) * 1000
+                    self.stdout.write(
+                        f"{size:>12} {name:>8} {len(queries):>8} {elapsed:>10.2f}"
+                    )
+                transaction.set_rollback(True)
+
+    def create_users(self, count):
+        users = User.objects.bulk_create([
+            User(
+                email=f'bench-{i}@example.com',
+                first_name='Bench',
+                last_name=str(i),
+                role='guest',
+            )
+            for i in range(count)
+        ])
+        return [str(user.user_id) for user in users]
+
+    @staticmethod
+    def loop_path(conversation, user_ids):
+        # The original implementation: one lookup and one get_or_create each
+        for user_id in user_ids:
+            user = get_object_or_404(User, user_id=user_id)
+            ConversationParticipant.objects.get_or_create(
+                conversation=conversation,
+                user=user
+            )
+
+    @staticmethod
+    def bulk_path(conversation, user_ids):
+        with transaction.atomic():
+            found, _ = ConversationViewSet.resolve_participants(user_ids)
+            ConversationViewSet.add_participants(conversation, found)
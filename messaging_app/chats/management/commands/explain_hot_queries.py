@@ -0,0 +1,130 @@
+import re
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from chats.models import Conversation, ConversationParticipant, Message
+from chats.pagination import MessageCursorPagination
+
+
+class Command(BaseCommand):
+    help = (
+        "Run EXPLAIN on the hot chats querysets and report whether the "
+        "planner picks the indexes declared on the models."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--conversation', type=uuid.UUID,
+            help="Conversation ID to plan with (defaults to an existing one)."
+        )
+        parser.add_argument(
+            '--user', type=uuid.UUID,
+            help="User ID to plan with (defaults to a participant of the conversation)."
+        )
+
+    def handle(self, *args, **options):
+        conversation_id, user_id = self.sample_ids(options)
+        self.stdout.write(f"Database vendor: {connection.vendor}")
+
+        for name, queryset, expected, bounded in self.hot_querysets(conversation_id, user_id):
+            plan = queryset.explain()
+            used = [index for index in expected if index in plan]
+            unbounded = [column for column in bounded if not plan_bounds(plan, column)]
+            self.stdout.write(f"\n== {name}")
+            self.stdout.write(plan)
+            if used and unbounded:
+                # The index is only used for its leading columns
+                self.stdout.write(self.style.WARNING(
+                    f"uses {', '.join(used)} without bounding {', '.join(unbounded)}"
+                ))
+            elif used:
+                self.stdout.write(self.style.SUCCESS(f"uses {', '.join(used)}"))
+            else:
+                self.stdout.write(self.style.WARNING(
+                    f"none of {', '.join(expected)} in plan"
+                ))
+
+    def sample_ids(self, options):
+        conversation_id = options['conversation']
+        if conversation_id is None:
+            conversation_id = (
+                Conversation.objects.values_list('conversation_id', flat=True).first()
+                or uuid.uuid4()
+            )
+        user_id = options['user']
+        if user_id is None:
+            user_id = (
+                ConversationParticipant.objects.filter(conversation_id=conversation_id)
+                .values_list('user_id', flat=True).first()
+                or uuid.uuid4()
+            )
+        return conversation_id, user_id
+
+    def hot_querysets(self, conversation_id, user_id):
+        """
+        Yield (name, queryset, expected index names, columns the index
+        search must bound) for each hot access path.
+        """
+        message_index = index_names(Message)
+        participant_index = index_names(ConversationParticipant)
+        # unique_together (conversation, user) already backs the membership
+        # probe; its generated name contains the column pair
+        membership_index = participant_index + ['_conversation_id_user_id_']
+
+        history = Message.objects.filter(conversation_id=conversation_id)
+        yield (
+            'message history, first page',
+            history.order_by('sent_at', 'message_id')[:21],
+            message_index,
+            (),
+        )
+        yield (
+            'message history, keyset page',
+            history.filter(
+                MessageCursorPagination().keyset_filter((timezone.now(), uuid.uuid4()), reverse=False)
+            ).order_by('sent_at', 'message_id')[:21],
+            message_index,
+            # Otherwise every page scans the conversation from its start
+            ('sent_at',),
+        )
+        yield (
+            'latest messages per conversation',
+            history.order_by('-sent_at', '-message_id')[:5],
+            message_index,
+            (),
+        )
+        yield (
+            'membership probe',
+            ConversationParticipant.objects.filter(
+                conversation_id=conversation_id, user_id=user_id
+            )[:1],
+            membership_index,
+            (),
+        )
+        yield (
+            "user's conversations",
+            ConversationParticipant.objects.filter(user_id=user_id).values('conversation_id'),
+            participant_index,
+            (),
+        )
+
+
+def index_names(model):
+    return [index.name for index in model._meta.indexes]
+
+
+def plan_bounds(plan, column):
+    """
+    Whether the index search of `plan` has a condition on `column`, as in
+    SQLite's "USING INDEX name (a=? AND column>?)" or PostgreSQL's
+    "Index Cond: (... column >= ...)".
+    """
+    for line in plan.splitlines():
+        if 'USING' in line and 'INDEX' in line and re.search(rf'\b{column}[<>=]', line):
+            return True
+        if 'Index Cond' in line and re.search(rf'\b{column}\b', line):
+            return True
+    return False
@@ -0,0 +1,61 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from chats.export import EXPORT_CHUNK_SIZE, FORMATS, export_lines
+from chats.models import Conversation, Message, User
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream the messages of a conversation, or every message sent by a "
+        "user, as NDJSON or CSV. Memory use does not grow with the export."
+    )
+
+    def add_arguments(self, parser):
+        scope = parser.add_mutually_exclusive_group(required=True)
+        scope.add_argument('--conversation', help="Conversation ID to export.")
+        scope.add_argument('--user', help="ID or email of the sender to export.")
+        parser.add_argument(
+            '--format', dest='export_format', choices=sorted(FORMATS), default='ndjson',
+            help="Output format."
+        )
+        parser.add_argument(
+            '--output', default='-',
+            help="File to write to, - for standard output."
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+            help="Rows fetched per query."
+        )
+
+    def handle(self, *args, **options):
+        messages = self.messages(options)
+        lines = export_lines(messages, options['export_format'], options['chunk_size'])
+        if options['output'] == '-':
+            self.write(self.stdout, lines)
+            return
+        with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+            count = self.write(output, lines)
+        self.stderr.write(f"Exported {count} lines to {options['output']}.")
+
+    @staticmethod
+    def write(output, lines):
+        count = 0
+        for count, line in enumerate(lines, 1):
+            output.write(line)
+        return count
+
+    def messages(self, options):
+        if options['conversation']:
+            try:
+                conversation = Conversation.objects.get(pk=options['conversation'])
+            except (Conversation.DoesNotExist, ValidationError):
+                raise CommandError(f"No conversation {options['conversation']}")
+            return Message.objects.filter(conversation=conversation)
+
+        lookup = {'email': options['user']} if '@' in options['user'] else {'pk': options['user']}
+        try:
+            user = User.objects.get(**lookup)
+        except (User.DoesNotExist, ValidationError):
+            raise CommandError(f"No user {options['user']}")
+        return Message.objects.filter(sender=user)
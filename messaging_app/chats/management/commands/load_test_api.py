@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chats.loadtest import DEFAULT_WEIGHTS, run_load
+from chats.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test a running server through the JWT-authenticated chats API "
+        "and report p50/p95/p99 latency and requests per second per "
+        "scenario. Log in with users made by seed_chat_data, e.g.:\n"
+        "  manage.py seed_chat_data && manage.py runserver --noreload &\n"
+        "  manage.py load_test_api --url http://127.0.0.1:8000/api/"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', default='http://127.0.0.1:8000/api/',
+            help="Base URL of the chats API."
+        )
+        parser.add_argument('--concurrency', type=int, default=10, help="Number of virtual users.")
+        parser.add_argument('--duration', type=float, default=30, help="Seconds to run for.")
+        parser.add_argument(
+            '--email-prefix', default='seed',
+            help="Log in as the <prefix>-<n>@example.com users of seed_chat_data."
+        )
+        parser.add_argument('--password', default='seed-password', help="Password of those users.")
+        parser.add_argument(
+            '--weight', action='append', default=[], metavar='SCENARIO=N',
+            help=f"Relative frequency of a scenario, among {', '.join(DEFAULT_WEIGHTS)}. Repeatable."
+        )
+        parser.add_argument('--page-size', type=int, default=50, help="Page size of paginate_messages.")
+        parser.add_argument('--max-pages', type=int, default=5, help="Pages walked by paginate_messages.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed of the virtual users.")
+
+    def handle(self, *args, **options):
+        weights = dict(DEFAULT_WEIGHTS)
+        for item in options['weight']:
+            name, _, value = item.partition('=')
+            if name not in weights or not value.isdigit():
+                raise CommandError(f"Invalid --weight {item!r}")
+            weights[name] = int(value)
+        weights = {name: weight for name, weight in weights.items() if weight}
+        if not weights:
+            raise CommandError("Every scenario has a weight of 0.")
+
+        # The accounts are read from the database the server uses
+        emails = list(
+            User.objects.filter(email__startswith=f"{options['email_prefix']}-")
+            .order_by('email').values_list('email', flat=True)[:options['concurrency']]
+        )
+        if not emails:
+            raise CommandError("No seeded users: run seed_chat_data first.")
+        accounts = [(email, options['password']) for email in emails]
+
+        self.stdout.write(
+            f"{options['concurrency']} virtual users for {options['duration']:g}s "
+            f"against {options['url']}"
+        )
+        results = run_load(
+            options['url'], accounts, options['duration'], options['concurrency'],
+            weights=weights, seed=options['seed'],
+            page_size=options['page_size'], max_pages=options['max_pages'],
+        )
+
+        self.stdout.write(
+            f"{'scenario':>20} {'requests':>9} {'errors':>7} "
+            f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}"
+        )
+        for name, row in results.summary().items():
+            self.stdout.write(
+                f"{name:>20} {row['requests']:>9} {row['errors']:>7} "
+                f"{self.ms(row['p50']):>9} {self.ms(row['p95']):>9} {self.ms(row['p99']):>9} "
+                f"{row['rps'] or 0:>8.1f}"
+            )
+
+    @staticmethod
+    def ms(value):
+        return '-' if value is None else f'{value:.2f}'
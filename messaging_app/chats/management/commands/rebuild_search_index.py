@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from chats.search import rebuild_index, search_backend
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the full-text search index of message bodies, e.g. after "
+        "bodies were changed with QuerySet.update(), which sends no signal."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database', default=DEFAULT_DB_ALIAS,
+            help="Database to rebuild the index of."
+        )
+
+    def handle(self, *args, **options):
+        using = options['database']
+        backend = search_backend(connections[using])
+        if backend != 'fts5':
+            self.stdout.write(f"Nothing to do: the {backend or 'fallback'} search needs no rebuild.")
+            return
+        with transaction.atomic(using=using):
+            count = rebuild_index(using)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} messages."))
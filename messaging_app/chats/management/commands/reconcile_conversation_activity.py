@@ -0,0 +1,100 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from chats.models import Conversation, Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Backfill and reconcile Conversation.last_message_at, last_message "
+        "and message_count from the Message table, in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Number of conversations checked per transaction."
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Report drifted conversations without writing."
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = fixed = 0
+        last_pk = None
+
+        while True:
+            conversations = Conversation.objects.order_by('pk')
+            if last_pk is not None:
+                conversations = conversations.filter(pk__gt=last_pk)
+            batch = list(self.with_actual_activity(conversations[:batch_size]))
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            drifted = [c.pk for c in batch if self.drifted(c)]
+            if drifted and not options['dry_run']:
+                with transaction.atomic():
+                    # Locked before the values are computed again, in the
+                    # UPDATE itself: a message recorded since the check is
+                    # counted, and one being recorded waits for the commit
+                    # and adds itself to the corrected count
+                    locked = Conversation.objects.select_for_update().filter(pk__in=drifted)
+                    Conversation.objects.filter(pk__in=list(locked.values_list('pk', flat=True))).update(
+                        **self.actual_activity()
+                    )
+            checked += len(batch)
+            fixed += len(drifted)
+            self.stdout.write(f"checked {checked} conversations, {fixed} drifted")
+
+        verb = 'would fix' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {checked} conversations checked, {verb} {fixed}."
+        ))
+
+    @staticmethod
+    def actual_activity():
+        """
+        The activity fields as computed from the messages of the conversation.
+        """
+        messages = Message.objects.filter(conversation=OuterRef('pk'))
+        latest = messages.order_by('-sent_at', '-message_id')
+        count = messages.order_by().values('conversation').annotate(n=Count('*')).values('n')
+        return {
+            'message_count': Coalesce(Subquery(count), 0),
+            'last_message': Subquery(latest.values('message_id')[:1]),
+            'last_message_at': Subquery(latest.values('sent_at')[:1]),
+        }
+
+    @classmethod
+    def with_actual_activity(cls, conversations):
+        """
+        Annotate each conversation with the values computed from its messages.
+        """
+        actual = cls.actual_activity()
+        return conversations.annotate(
+            actual_count=actual['message_count'],
+            actual_last_id=actual['last_message'],
+            actual_last_at=actual['last_message_at'],
+        )
+
+    @staticmethod
+    def drifted(conversation):
+        """
+        True if the stored values differ from the computed ones.
+        """
+        actual = (
+            conversation.actual_count,
+            conversation.actual_last_id,
+            conversation.actual_last_at,
+        )
+        stored = (
+            conversation.message_count,
+            conversation.last_message_id,
+            conversation.last_message_at,
+        )
+        return actual != stored
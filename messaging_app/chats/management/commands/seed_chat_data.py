@@ -0,0 +1,145 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from chats.models import User, Conversation, ConversationParticipant, Message
+from chats.signals import messages_created
+
+WORDS = (
+    "hi hello hey thanks ok okay sure yes no maybe later today tomorrow tonight "
+    "meeting lunch dinner coffee call send file photo link docs review deploy "
+    "bug fix release plan trip flight hotel booking price invoice payment "
+    "weekend birthday party game match score team project deadline update "
+    "morning evening soon now again great cool sorry please check see"
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-generate users, conversations and messages for load tests. "
+        "Activity is skewed like real chat traffic: a few users are in most "
+        "conversations and a few conversations get most of the messages. "
+        "Every user can log in with --password."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help="Number of users.")
+        parser.add_argument('--conversations', type=int, default=5000, help="Number of conversations.")
+        parser.add_argument('--messages', type=int, default=100_000, help="Number of messages.")
+        parser.add_argument(
+            '--days', type=int, default=90,
+            help="The messages are spread over this many past days."
+        )
+        parser.add_argument(
+            '--email-prefix', default='seed',
+            help="Users are <prefix>-<n>@example.com."
+        )
+        parser.add_argument('--password', default='seed-password', help="Password of every user.")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Messages per transaction.")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, for repeatable data.")
+
+    def handle(self, *args, **options):
+        prefix = options['email_prefix']
+        if User.objects.filter(email__startswith=f'{prefix}-').exists():
+            raise CommandError(
+                f"Users with the {prefix!r} prefix already exist: use another --email-prefix "
+                "or a fresh database."
+            )
+        if options['users'] < 2 or options['conversations'] < 1:
+            raise CommandError("At least 2 users and 1 conversation are needed.")
+        rng = random.Random(options['seed'])
+
+        with transaction.atomic():
+            users = self.create_users(options['users'], prefix, options['password'], rng)
+            conversations = self.create_conversations(options['conversations'], users, rng)
+        self.stdout.write(f"Created {len(users)} users and {len(conversations)} conversations.")
+
+        created = self.create_messages(
+            options['messages'], conversations, options['days'], options['batch_size'], rng
+        )
+        # Activity fields of every conversation in one batched pass
+        call_command('reconcile_conversation_activity', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {created} messages. Log in as {prefix}-0@example.com ... "
+            f"{prefix}-{len(users) - 1}@example.com."
+        ))
+
+    @staticmethod
+    def zipf_weights(count, exponent=1.1):
+        return [1 / (rank + 1) ** exponent for rank in range(count)]
+
+    def create_users(self, count, prefix, password, rng):
+        # Hashing is slow on purpose: hash once and share the result
+        hashed = make_password(password)
+        roles = rng.choices(['guest', 'host', 'admin'], weights=[90, 9, 1], k=count)
+        return User.objects.bulk_create([
+            User(
+                email=f'{prefix}-{i}@example.com',
+                first_name='Seed',
+                last_name=f'User {i}',
+                role=roles[i],
+                password=hashed,
+            )
+            for i in range(count)
+        ], batch_size=1000)
+
+    def create_conversations(self, count, users, rng):
+        """
+        Mostly one-to-one conversations and some groups, whose members are
+        drawn so that popular users are in many more conversations.
+        """
+        conversations = Conversation.objects.bulk_create(
+            [Conversation() for _ in range(count)], batch_size=1000
+        )
+        weights = self.zipf_weights(len(users))
+        participants = []
+        for conversation in conversations:
+            size = 2 if rng.random() < 0.8 else rng.randint(3, min(8, len(users)))
+            members = set()
+            while len(members) < size:
+                members.add(rng.choices(users, weights)[0])
+            conversation.members = list(members)
+            participants.extend(
+                ConversationParticipant(conversation=conversation, user=user) for user in members
+            )
+        ConversationParticipant.objects.bulk_create(participants, batch_size=1000)
+        return conversations
+
+    def create_messages(self, count, conversations, days, batch_size, rng):
+        """
+        Messages in chronological order, most of them in a few busy
+        conversations, indexed for search as they are created.
+        """
+        weights = self.zipf_weights(len(conversations))
+        start = timezone.now() - timedelta(days=days)
+        step = timedelta(days=days) / max(count, 1)
+        created = 0
+        while created < count:
+            size = min(batch_size, count - created)
+            messages = []
+            for conversation in rng.choices(conversations, weights, k=size):
+                body = ' '.join(rng.choices(WORDS, k=rng.randint(1, 25)))
+                messages.append(Message(
+                    conversation=conversation,
+                    sender=rng.choice(conversation.members),
+                    message_body=body[0].upper() + body[1:],
+                ))
+
+            with transaction.atomic():
+                Message.objects.bulk_create(messages, batch_size=1000)
+                # sent_at is auto_now_add, so the insert stamped every
+                # message with the current time: backdate them afterwards
+                for i, message in enumerate(messages, created):
+                    message.sent_at = start + step * i
+                Message.objects.bulk_update(messages, ['sent_at'], batch_size=1000)
+                messages_created.send(sender=Message, messages=messages, using=messages[0]._state.db)
+
+            created += size
+            self.stdout.write(f"{created}/{count} messages")
+        return created
+
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import ConversationParticipant
+
+# Seconds a user's conversation-ID set may be served from the cache
+MEMBERSHIP_CACHE_TIMEOUT = getattr(settings, 'CHATS_MEMBERSHIP_CACHE_TIMEOUT', 30)
+
+
+def membership_cache_key(user_id):
+    return f'chats:membership:{user_id}'
+
+
+def get_conversation_ids(request):
+    """
+    Return the set of conversation IDs the requesting user participates in.
+
+    The set is loaded at most once per request, and shared between requests
+    of the same user through the cache for MEMBERSHIP_CACHE_TIMEOUT seconds.
+    """
+    # DRF wraps the Django request; keep the set on the underlying one so
+    # that permissions, views and middleware all see the same copy
+    http_request = getattr(request, '_request', request)
+    conversation_ids = getattr(http_request, '_conversation_ids', None)
+    if conversation_ids is None:
+        conversation_ids = load_conversation_ids(request.user.pk)
+        http_request._conversation_ids = conversation_ids
+    return conversation_ids
+
+
+def load_conversation_ids(user_id):
+    key = membership_cache_key(user_id)
+    conversation_ids = cache.get(key)
+    if conversation_ids is None:
+        conversation_ids = frozenset(
+            ConversationParticipant.objects.filter(user_id=user_id)
+            .values_list('conversation_id', flat=True)
+        )
+        cache.set(key, conversation_ids, MEMBERSHIP_CACHE_TIMEOUT)
+    return conversation_ids
+
+
+def invalidate_membership(user_ids):
+    """
+    Drop the cached conversation-ID sets of the given users.
+    """
+    cache.delete_many([membership_cache_key(user_id) for user_id in user_ids])
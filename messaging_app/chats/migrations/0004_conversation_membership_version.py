@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0003_conversation_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='membership_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0004_conversation_membership_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['sender', 'sent_at', 'message_id'], name='chats_messa_sender__a564e0_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations
+
+# Kept in sync with chats.search
+FTS_TABLE = 'chats_message_fts'
+FTS_KEY_TABLE = 'chats_message_fts_key'
+FTS_OPTIONS = "tokenize = 'unicode61 remove_diacritics 2'"
+
+
+def key_search_index_on_message_id(apps, schema_editor):
+    # 0006 keyed the FTS5 rows on the implicit rowids of chats_message,
+    # which a table remake renumbers: index again under stable keys
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"DROP TABLE {FTS_TABLE}")
+    schema_editor.execute(
+        f"CREATE TABLE {FTS_KEY_TABLE} ("
+        f"id integer NOT NULL PRIMARY KEY, "
+        f"message_id char(32) NOT NULL UNIQUE)"
+    )
+    schema_editor.execute(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(message_body, {FTS_OPTIONS})")
+    schema_editor.execute(
+        f"INSERT INTO {FTS_KEY_TABLE} (message_id) SELECT message_id FROM chats_message"
+    )
+    schema_editor.execute(
+        f"INSERT INTO {FTS_TABLE} (rowid, message_body) "
+        f"SELECT {FTS_KEY_TABLE}.id, chats_message.message_body FROM {FTS_KEY_TABLE} "
+        f"JOIN chats_message USING (message_id)"
+    )
+
+
+def key_search_index_on_rowid(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"DROP TABLE {FTS_TABLE}")
+    schema_editor.execute(f"DROP TABLE {FTS_KEY_TABLE}")
+    schema_editor.execute(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(message_body, {FTS_OPTIONS})")
+    schema_editor.execute(
+        f"INSERT INTO {FTS_TABLE} (rowid, message_body) "
+        f"SELECT rowid, message_body FROM chats_message"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0006_message_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(key_search_index_on_message_id, key_search_index_on_rowid),
+    ]
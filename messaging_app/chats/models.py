@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Case, F, Q, Value, When
 from django.contrib.auth.models import AbstractUser, Group, Permission
 import uuid
 
@@ -73,9 +74,54 @@ class Conversation(models.Model):
         related_name='conversations'
     )
 
+    # Denormalized activity, kept up to date by record_messages()
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    last_message = models.ForeignKey(
+        'Message',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    message_count = models.PositiveIntegerField(default=0)
+    # Bumped whenever participants are added, for cache validators
+    membership_version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Conversations sorted by recent activity
+            models.Index(fields=['-last_message_at']),
+        ]
+
     def __str__(self):
         return f"Conversation {self.conversation_id}"
 
+    def record_messages(self, messages):
+        """
+        Fold newly created messages into the activity fields.
+
+        Must run in the transaction that inserted the messages. The update is
+        a single statement, so concurrent senders never lose a count and an
+        older message never replaces a newer last_message.
+        """
+        if not messages:
+            return
+        latest = max(messages, key=lambda m: (m.sent_at, str(m.message_id)))
+        is_newer = Q(last_message_at__isnull=True) | Q(last_message_at__lt=latest.sent_at)
+        Conversation.objects.filter(pk=self.pk).update(
+            message_count=F('message_count') + len(messages),
+            last_message_at=Case(
+                When(is_newer, then=Value(latest.sent_at)),
+                default=F('last_message_at'),
+                output_field=models.DateTimeField()
+            ),
+            last_message=Case(
+                When(is_newer, then=Value(latest.message_id)),
+                default=F('last_message'),
+                output_field=models.UUIDField()
+            ),
+        )
+
 
 class ConversationParticipant(models.Model):
     conversation = models.ForeignKey(
@@ -91,6 +137,10 @@ class ConversationParticipant(models.Model):
 
     class Meta:
         unique_together = ('conversation', 'user')
+        indexes = [
+            # request.user.conversations: participations of one user
+            models.Index(fields=['user', 'conversation']),
+        ]
 
     def __str__(self):
         return f"{self.user.email} in {self.conversation.conversation_id}"
@@ -118,6 +168,12 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['sent_at']
+        indexes = [
+            # Message history of a conversation, walked by keyset cursor
+            models.Index(fields=['conversation', 'sent_at', 'message_id']),
+            # Every message of one sender, walked by the streaming export
+            models.Index(fields=['sender', 'sent_at', 'message_id']),
+        ]
 
     def __str__(self):
         return f"Message {self.message_id} by {self.sender.email}"
@@ -0,0 +1,86 @@
+"""
+In-process wake-up signal for long-polling message clients.
+
+Waiters are plain futures on the event loop of the async view, so a waiting
+client holds no worker thread. notify() is thread-safe and is called from the
+sync request threads once a new message has been committed.
+
+Only waiters in the same process are woken; the long-poll view re-reads the
+database when its wait times out, so messages written by other processes are
+still delivered, just no sooner than the timeout.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+
+class MessageNotifier:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = defaultdict(set)
+
+    def listen(self, key):
+        """
+        Subscribe to `key` before reading the database, so a message that is
+        committed between the read and the wait is not missed.
+        """
+        return Subscription(self, key)
+
+    def notify(self, key):
+        with self._lock:
+            waiters = self._waiters.pop(key, ())
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    def waiting(self, key=None):
+        with self._lock:
+            if key is not None:
+                return len(self._waiters.get(key, ()))
+            return sum(len(waiters) for waiters in self._waiters.values())
+
+    def _add(self, key, waiter):
+        with self._lock:
+            self._waiters[key].add(waiter)
+
+    def _discard(self, key, waiter):
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    del self._waiters[key]
+
+
+class Subscription:
+    def __init__(self, notifier, key):
+        self.notifier = notifier
+        self.key = key
+        self.waiter = None
+
+    def __enter__(self):
+        loop = asyncio.get_running_loop()
+        self.waiter = (loop, loop.create_future())
+        self.notifier._add(self.key, self.waiter)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.notifier._discard(self.key, self.waiter)
+
+    async def wait(self, timeout):
+        """
+        Wait up to `timeout` seconds; return True if notified.
+        """
+        try:
+            await asyncio.wait_for(self.waiter[1], timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+# Shared by the views of this process
+message_notifier = MessageNotifier()
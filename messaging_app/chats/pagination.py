@@ -1,5 +1,14 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+import uuid
+from base64 import b64decode, b64encode
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
 
 class MessagePagination(PageNumberPagination):
     page_size = 20
@@ -12,4 +21,187 @@ class MessagePagination(PageNumberPagination):
             'next': self.get_next_link(),
             'previous': self.get_previous_link(),
             'results': data
-        })
\ No newline at end of file
+        })
+
+
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination over (sent_at, message_id).
+
+    Each page is a single indexed range scan, so deep pages cost the same
+    as the first one and no COUNT query is issued.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    ordering = ('sent_at', 'message_id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+
+        reverse = cursor is not None and cursor['reverse']
+        ordering = [f'-{field}' for field in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self.keyset_filter(cursor['position'], reverse))
+
+        # Fetch one extra row to know whether there is more in this direction
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+
+        if reverse:
+            results.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'since': self.get_since_token(),
+            'results': data
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'since': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # An empty page reached by a reverse cursor: restart from the top
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.link_for(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.link_for(self.page[0], reverse=True)
+
+    def get_since_token(self):
+        """
+        Token for delta mode (?since=) starting after the last message shown.
+        """
+        if not self.page:
+            return None
+        return self.encode_cursor(self.position_of(self.page[-1]), reverse=False)
+
+    def link_for(self, message, reverse):
+        token = self.encode_cursor(self.position_of(message), reverse)
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def keyset_filter(self, position, reverse):
+        """
+        Rows after `position` (before it when `reverse`) in page order.
+
+        The leading sent_at >= / <= bound is implied by the rest, but it is
+        what lets the planner start the index scan at the position; with
+        only the OR, every page scans the conversation from its start.
+        """
+        sent_at, message_id = position
+        lookup = 'lt' if reverse else 'gt'
+        return Q(**{f'sent_at__{lookup}e': sent_at}) & (
+            Q(**{f'sent_at__{lookup}': sent_at})
+            | Q(**{f'message_id__{lookup}': message_id})
+        )
+
+    @staticmethod
+    def position_of(message):
+        # Pages hold model instances or .values() rows
+        if isinstance(message, dict):
+            return message['sent_at'], message['message_id']
+        return message.sent_at, message.message_id
+
+    def encode_cursor(self, position, reverse):
+        sent_at, message_id = position
+        payload = {'s': sent_at.isoformat(), 'm': str(message_id), 'r': int(reverse)}
+        raw = json.dumps(payload, separators=(',', ':')).encode('ascii')
+        return b64encode(raw).decode('ascii')
+
+    def decode_cursor(self, request):
+        """
+        Return the cursor in the request as a dict, or None for the first page.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(b64decode(encoded.encode('ascii')).decode('ascii'))
+            sent_at = parse_datetime(payload['s'])
+            message_id = uuid.UUID(payload['m'])
+            reverse = bool(payload.get('r', 0))
+        except (TypeError, ValueError, KeyError, AttributeError):
+            raise NotFound(self.invalid_cursor_message)
+        if sent_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return {'position': (sent_at, message_id), 'reverse': reverse}
+
+
+class MessageDeltaPagination(MessageCursorPagination):
+    """
+    Delta mode: the messages newer than the position sent in ?since=.
+
+    The response carries the token to send as ?since= on the next poll, which
+    stays the same when there is nothing new.
+    """
+    cursor_query_param = 'since'
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        if cursor is not None:
+            # A delta always moves forward, whatever the token says
+            cursor['reverse'] = False
+        return cursor
+
+    def get_paginated_response(self, data):
+        return Response({
+            'since': self.get_since_token(),
+            'has_more': self.has_next,
+            'results': data
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'since': {'type': 'string', 'nullable': True},
+                'has_more': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
+
+    def get_since_token(self):
+        if self.page:
+            return self.encode_cursor(self.position_of(self.page[-1]), reverse=False)
+        return self.request.query_params.get(self.cursor_query_param) or None
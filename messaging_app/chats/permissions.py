@@ -1,17 +1,18 @@
 from rest_framework import permissions
-from .models import ConversationParticipant
+from .models import Conversation
+from .membership import get_conversation_ids
 
 class IsOwnerOrParticipant(permissions.BasePermission):
     """User can only access their own messages or conversations they participate in"""
     
     def has_object_permission(self, request, view, obj):
         # For messages
-        if hasattr(obj, 'sender'):
-            return obj.sender == request.user
+        if hasattr(obj, 'sender_id'):
+            return obj.sender_id == request.user.pk
         
         # For conversations
         if hasattr(obj, 'participants'):
-            return request.user in obj.participants.all()
+            return obj.pk in get_conversation_ids(request)
         
         return False
 
@@ -28,17 +29,13 @@ class IsParticipantOfConversation(permissions.BasePermission):
 
     def has_object_permission(self, request, view, obj):
         # For messages - check if user is in conversation participants
-        if hasattr(obj, 'conversation'):
-            return ConversationParticipant.objects.filter(
-                conversation=obj.conversation,
-                user=request.user
-            ).exists() and request.method in ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+        if hasattr(obj, 'conversation_id'):
+            return obj.conversation_id in get_conversation_ids(request) \
+                and request.method in ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
 
         # For conversations directly
         if isinstance(obj, Conversation):
-            return ConversationParticipant.objects.filter(
-                conversation=obj,
-                user=request.user
-            ).exists() and request.method in ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+            return obj.pk in get_conversation_ids(request) \
+                and request.method in ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
 
         return False
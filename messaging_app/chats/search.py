@@ -0,0 +1,138 @@
+"""
+Full-text search over Message.message_body.
+
+On SQLite the index is an FTS5 table, with a key table mapping each of
+its rowids to a message_id; the signal receivers in chats.signals keep both
+in sync. The implicit rowids of chats_message cannot serve as the key: any
+migration that remakes the table (most AlterFields on SQLite) renumbers
+them. On PostgreSQL the index is a GIN index on
+to_tsvector('simple', message_body), which the database maintains itself.
+See migrations 0006 and 0007. Other databases fall back to a LIKE scan.
+
+Neither backend stems words, so a query matches the same messages on both:
+every word of the query must appear in the message.
+"""
+from django.db import connections, router
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+
+from .models import Message
+
+FTS_TABLE = 'chats_message_fts'
+# rowid of the FTS5 row -> message_id, indexed both ways
+FTS_KEY_TABLE = 'chats_message_fts_key'
+MESSAGE_TABLE = 'chats_message'
+# Must match the expression of the GIN index for PostgreSQL to use it
+TSVECTOR_SQL = "to_tsvector('simple', \"chats_message\".\"message_body\")"
+
+# Message IDs per statement, under SQLite's limit on query parameters
+INDEX_BATCH_SIZE = 500
+
+
+def search_backend(connection):
+    if connection.vendor == 'sqlite':
+        return 'fts5'
+    if connection.vendor == 'postgresql':
+        return 'tsvector'
+    return None
+
+
+def search_messages(queryset, query):
+    """
+    Narrow a Message queryset down to the messages containing every word
+    of `query`.
+    """
+    words = query.split()
+    if not words:
+        return queryset
+    backend = search_backend(connections[queryset.db])
+    if backend == 'fts5':
+        # Costs one key lookup per match, the price of keys that survive a
+        # remake of chats_message
+        return queryset.filter(RawSQL(
+            f'"{MESSAGE_TABLE}"."message_id" IN '
+            f'(SELECT {FTS_KEY_TABLE}.message_id FROM {FTS_TABLE} '
+            f'JOIN {FTS_KEY_TABLE} ON {FTS_KEY_TABLE}.id = {FTS_TABLE}.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s)',
+            [fts5_query(words)],
+            output_field=BooleanField()
+        ))
+    if backend == 'tsvector':
+        return queryset.filter(RawSQL(
+            f"{TSVECTOR_SQL} @@ plainto_tsquery('simple', %s)",
+            [' '.join(words)],
+            output_field=BooleanField()
+        ))
+    for word in words:
+        queryset = queryset.filter(message_body__icontains=word)
+    return queryset
+
+
+def fts5_query(words):
+    # Quote every word, so that user input is never read as FTS5 syntax
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+UNINDEX_SQL = [
+    f'DELETE FROM {FTS_TABLE} WHERE rowid IN '
+    f'(SELECT id FROM {FTS_KEY_TABLE} WHERE message_id IN ({{ids}}))',
+    f'DELETE FROM {FTS_KEY_TABLE} WHERE message_id IN ({{ids}})',
+]
+INDEX_SQL = [
+    f'INSERT INTO {FTS_KEY_TABLE} (message_id) '
+    f'SELECT message_id FROM {MESSAGE_TABLE} WHERE message_id IN ({{ids}})',
+    f'INSERT INTO {FTS_TABLE} (rowid, message_body) '
+    f'SELECT {FTS_KEY_TABLE}.id, {MESSAGE_TABLE}.message_body FROM {FTS_KEY_TABLE} '
+    f'JOIN {MESSAGE_TABLE} USING (message_id) WHERE message_id IN ({{ids}})',
+]
+REBUILD_SQL = [
+    f'DELETE FROM {FTS_TABLE}',
+    f'DELETE FROM {FTS_KEY_TABLE}',
+    f'INSERT INTO {FTS_KEY_TABLE} (message_id) SELECT message_id FROM {MESSAGE_TABLE}',
+    f'INSERT INTO {FTS_TABLE} (rowid, message_body) '
+    f'SELECT {FTS_KEY_TABLE}.id, {MESSAGE_TABLE}.message_body FROM {FTS_KEY_TABLE} '
+    f'JOIN {MESSAGE_TABLE} USING (message_id)',
+]
+
+
+def index_messages(message_ids, using=None):
+    """
+    (Re)index the bodies of the given messages, as they are in the database.
+    """
+    _execute_for_ids(UNINDEX_SQL + INDEX_SQL, message_ids, using)
+
+
+def unindex_messages(message_ids, using=None):
+    """
+    Drop the given messages from the index.
+    """
+    _execute_for_ids(UNINDEX_SQL, message_ids, using)
+
+
+def _execute_for_ids(statements, message_ids, using):
+    connection = connections[using or router.db_for_write(Message)]
+    if search_backend(connection) != 'fts5':
+        return
+    pk = Message._meta.pk
+    message_ids = [pk.get_db_prep_value(message_id, connection) for message_id in message_ids]
+    with connection.cursor() as cursor:
+        for start in range(0, len(message_ids), INDEX_BATCH_SIZE):
+            batch = message_ids[start:start + INDEX_BATCH_SIZE]
+            placeholders = ', '.join(['%s'] * len(batch))
+            for statement in statements:
+                cursor.execute(statement.format(ids=placeholders), batch)
+
+
+def rebuild_index(using=None):
+    """
+    Index every message from scratch, e.g. after bodies were changed with
+    QuerySet.update(), which sends no signal. Returns the number indexed.
+    """
+    connection = connections[using or router.db_for_write(Message)]
+    if search_backend(connection) != 'fts5':
+        return 0
+    with connection.cursor() as cursor:
+        for statement in REBUILD_SQL:
+            cursor.execute(statement)
+        return cursor.rowcount
+
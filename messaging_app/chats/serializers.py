@@ -1,12 +1,11 @@
+from django.db.models import Prefetch
 from rest_framework import serializers
 from .models import User, Message, Conversation, ConversationParticipant
 
 
 class UserSerializers(serializers.ModelSerializer):
-    username = serializers.CharField(read_only=True)
-
-
     class Meta:
+        model = User
         fields = [
             'user_id',
             'first_name',
@@ -32,9 +31,108 @@ class MessageSerializer(serializers.ModelSerializer):
         ]
 
 
+class MessageListSerializer:
+    """
+    Read-only fast path for message lists.
+
+    Produces the same output as MessageSerializer(many=True) from .values()
+    rows. Each distinct sender is loaded once, and the field instances of
+    MessageSerializer are reused for formatting instead of running the
+    serializer machinery per row.
+    """
+    row_fields = ('message_id', 'sender_id', 'conversation_id', 'message_body', 'sent_at')
+    _formatters = None
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @classmethod
+    def values(cls, queryset):
+        return queryset.values(*cls.row_fields)
+
+    @classmethod
+    def formatters(cls):
+        if cls._formatters is None:
+            fields = MessageSerializer().fields
+            sender_fields = fields['sender'].fields
+            cls._formatters = (
+                {name: fields[name].to_representation
+                 for name in ('message_id', 'message_body', 'sent_at')},
+                [(name, sender_fields[name].to_representation)
+                 for name in UserSerializers.Meta.fields],
+            )
+        return cls._formatters
+
+    @property
+    def data(self):
+        message_format, sender_format = self.formatters()
+        format_id = message_format['message_id']
+        format_body = message_format['message_body']
+        format_sent_at = message_format['sent_at']
+
+        sender_rows = User.objects.filter(
+            pk__in={row['sender_id'] for row in self.rows}
+        ).values(*UserSerializers.Meta.fields)
+        senders = {
+            sender['user_id']: {
+                name: None if sender[name] is None else to_representation(sender[name])
+                for name, to_representation in sender_format
+            }
+            for sender in sender_rows
+        }
+
+        return [
+            {
+                'message_id': format_id(row['message_id']),
+                'sender': senders[row['sender_id']],
+                'conversation': row['conversation_id'],
+                'message_body': format_body(row['message_body']),
+                'sent_at': None if row['sent_at'] is None else format_sent_at(row['sent_at']),
+            }
+            for row in self.rows
+        ]
+
+
+class MessageBatchListSerializer(serializers.ListSerializer):
+    """
+    Validates every item and keeps the valid ones instead of failing the
+    whole batch. Per-item errors are collected in `item_errors`.
+    """
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise serializers.ValidationError({
+                'non_field_errors': ['Expected a list of messages.']
+            })
+        if self.max_length is not None and len(data) > self.max_length:
+            raise serializers.ValidationError({
+                'non_field_errors': [f'A batch holds at most {self.max_length} messages.']
+            })
+
+        self.item_errors = []
+        validated = []
+        for index, item in enumerate(data):
+            try:
+                validated.append(self.child.run_validation(item))
+            except serializers.ValidationError as exc:
+                self.item_errors.append({'index': index, 'errors': exc.detail})
+        return validated
+
+
+class MessageIngestSerializer(serializers.Serializer):
+    """Write-only shape of one message in a batch ingest"""
+    message_body = serializers.CharField()
+
+    class Meta:
+        list_serializer_class = MessageBatchListSerializer
+
+
 class ConversationSerializer(serializers.ModelSerializer):
     participants = serializers.SerializerMethodField()
-    messages = serializers.SerializerMethodField()
+    last_messages = serializers.SerializerMethodField()
+
+    # Number of most recent messages embedded in each conversation
+    last_messages_limit = 5
 
 
     class Meta:
@@ -42,17 +140,41 @@ class ConversationSerializer(serializers.ModelSerializer):
         fields = [
             'conversation_id',
             'participants',
-            'messages',
+            'last_messages',
+            'last_message_at',
+            'message_count',
             'created_at'
         ]
 
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        """
+        Prefetch participants and the latest messages of every conversation
+        in a constant number of queries.
+        """
+        latest_messages = Message.objects.select_related('sender').order_by(
+            '-sent_at', '-message_id'
+        )[:cls.last_messages_limit]
+        return queryset.prefetch_related(
+            Prefetch(
+                'participants_info',
+                queryset=ConversationParticipant.objects.select_related('user')
+            ),
+            Prefetch('messages', queryset=latest_messages, to_attr='latest_messages'),
+        )
+
     def get_participants(self, obj):
-        participants = obj.participants_info.all().select_related('user')
-        return UserSerializer([p.user for p in participants], many=True).data
+        participants = obj.participants_info.all()
+        return UserSerializers([p.user for p in participants], many=True).data
 
-    def get_messages(self, obj):
-        messages = obj.messages.all().select_related('sender')
-        return MessageSerializer(messages, many=True).data
+    def get_last_messages(self, obj):
+        messages = getattr(obj, 'latest_messages', None)
+        if messages is None:
+            messages = obj.messages.select_related('sender').order_by(
+                '-sent_at', '-message_id'
+            )[:self.last_messages_limit]
+        # Newest first from the database, oldest first in the preview
+        return MessageSerializer(list(messages)[::-1], many=True).data
 
     def validate(self, data):
         participants = self.initial_data.get('participants', [])
@@ -0,0 +1,26 @@
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import Signal, receiver
+
+from .models import Message
+from .search import index_messages, unindex_messages
+
+# Sent after Message.objects.bulk_create(), which sends no post_save;
+# `messages` is the list of created messages
+messages_created = Signal()
+
+
+@receiver(post_save, sender=Message)
+def index_saved_message(sender, instance, update_fields=None, using=None, **kwargs):
+    if update_fields is not None and 'message_body' not in update_fields:
+        return
+    index_messages([instance.pk], using=using)
+
+
+@receiver(messages_created, sender=Message)
+def index_created_messages(sender, messages, using=None, **kwargs):
+    index_messages([message.pk for message in messages], using=using)
+
+
+@receiver(pre_delete, sender=Message)
+def unindex_deleted_message(sender, instance, using=None, **kwargs):
+    unindex_messages([instance.pk], using=using)
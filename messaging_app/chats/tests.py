@@ -1,3 +1,993 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import math
+import threading
+import time
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, models
+from django.test import (
+    AsyncClient, LiveServerTestCase, SimpleTestCase, TestCase, TransactionTestCase,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .export import export_lines
+from .management.commands.explain_hot_queries import plan_bounds
+from .loadtest import percentile, run_load
+from .management.commands.reconcile_conversation_activity import Command as ReconcileCommand
+from .models import User, Conversation, ConversationParticipant, Message
+from .membership import get_conversation_ids
+from .pagination import MessageCursorPagination
+from .notifier import MessageNotifier, message_notifier
+from .permissions import IsParticipantOfConversation
+from .search import fts5_query, search_messages
+from .serializers import ConversationSerializer, MessageSerializer, MessageListSerializer
+
+
+def make_user(email, **kwargs):
+    return User.objects.create(
+        email=email,
+        first_name=kwargs.pop('first_name', 'Test'),
+        last_name=kwargs.pop('last_name', 'User'),
+        role=kwargs.pop('role', 'guest'),
+        **kwargs
+    )
+
+
+def make_conversation(*users):
+    conversation = Conversation.objects.create()
+    ConversationParticipant.objects.bulk_create([
+        ConversationParticipant(conversation=conversation, user=user) for user in users
+    ])
+    return conversation
+
+
+def make_messages(conversation, sender, count, start=None, step=timedelta(seconds=1)):
+    '''
+    Create `count` messages with increasing sent_at values starting at `start`.
+    '''
+    start = start or timezone.now() - timedelta(days=1)
+    messages = Message.objects.bulk_create([
+        Message(conversation=conversation, sender=sender, message_body=f'message {i}')
+        for i in range(count)
+    ])
+    # sent_at is auto_now_add, so spread the timestamps after the insert
+    for i, message in enumerate(messages):
+        message.sent_at = start + step * i
+    Message.objects.bulk_update(messages, ['sent_at'])
+    return messages
+
+
+class MessageCursorPaginationTests(APITestCase):
+    def setUp(self):
+        self.user = make_user('alice@example.com')
+        self.other = make_user('bob@example.com')
+        self.conversation = make_conversation(self.user, self.other)
+        self.client.force_authenticate(self.user)
+        self.url = reverse(
+            'message-list',
+            kwargs={'conversation_pk': self.conversation.conversation_id}
+        )
+
+    def walk(self, url):
+        '''
+        Follow next links from `url` and return the message ids in order.
+        '''
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen.extend(item['message_id'] for item in response.data['results'])
+            url = response.data['next']
+        return seen
+
+    def test_walks_full_history_in_order(self):
+        messages = make_messages(self.conversation, self.other, 45)
+
+        seen = self.walk(self.url)
+
+        self.assertEqual(seen, [str(m.message_id) for m in messages])
+
+    def test_ties_on_sent_at_are_broken_by_message_id(self):
+        messages = make_messages(self.conversation, self.other, 30, step=timedelta(0))
+        expected = sorted(str(m.message_id) for m in messages)
+
+        seen = self.walk(f'{self.url}?page_size=7')
+
+        self.assertEqual(sorted(seen), expected)
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_no_count_query_on_deep_pages(self):
+        make_messages(self.conversation, self.other, 60)
+        response = self.client.get(f'{self.url}?page_size=20')
+        next_url = self.client.get(response.data['next']).data['next']
+
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(f'{self.url}?page_size=20')
+        with CaptureQueriesContext(connection) as deep:
+            self.client.get(next_url)
+
+        self.assertEqual(len(first), len(deep))
+        for query in deep.captured_queries:
+            self.assertNotIn('COUNT(', query['sql'].upper())
+            self.assertNotIn('OFFSET', query['sql'].upper())
+
+    def test_keyset_page_is_an_index_range(self):
+        message = make_messages(self.conversation, self.other, 3)[1]
+        paginator = MessageCursorPagination()
+
+        for reverse in (False, True):
+            plan = Message.objects.filter(
+                conversation=self.conversation
+            ).filter(
+                paginator.keyset_filter((message.sent_at, message.message_id), reverse)
+            ).order_by('sent_at', 'message_id').explain()
+            # The scan starts at the cursor instead of the first message
+            self.assertRegex(plan, r'conversation_id=\? AND sent_at[<>]')
+
+    def test_previous_link_returns_previous_page(self):
+        make_messages(self.conversation, self.other, 25)
+        first = self.client.get(f'{self.url}?page_size=10').data
+        second = self.client.get(first['next']).data
+
+        self.assertIsNone(first['previous'])
+        back = self.client.get(second['previous']).data
+
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_time_range_filter_is_kept_across_pages(self):
+        start = timezone.now() - timedelta(days=1)
+        messages = make_messages(self.conversation, self.other, 30, start=start)
+        after = (start + timedelta(seconds=5)).isoformat()
+        before = (start + timedelta(seconds=24)).isoformat()
+
+        seen = self.walk(
+            f'{self.url}?page_size=6&sent_at_after={after}&sent_at_before={before}'.replace('+', '%2B')
+        )
+
+        self.assertEqual(seen, [str(m.message_id) for m in messages[5:25]])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(f'{self.url}?cursor=not-a-cursor')
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_parameter_keeps_page_number_pagination(self):
+        make_messages(self.conversation, self.other, 5)
+
+        response = self.client.get(f'{self.url}?page=1')
+
+        self.assertEqual(response.data['count'], 5)
+
+
+class ConversationListQueryTests(APITestCase):
+    def setUp(self):
+        self.user = make_user('alice@example.com')
+        self.client.force_authenticate(self.user)
+        self.url = reverse('conversation-list')
+
+    def add_conversations(self, count):
+        for i in range(count):
+            other = make_user(f'user{i}-{User.objects.count()}@example.com')
+            conversation = make_conversation(self.user, other)
+            make_messages(conversation, other, 8)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(context), response
+
+    def test_query_count_does_not_grow_with_conversations(self):
+        self.add_conversations(2)
+        few, _ = self.count_queries()
+
+        self.add_conversations(8)
+        many, response = self.count_queries()
+
+        self.assertEqual(few, many)
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_embeds_bounded_preview_of_latest_messages(self):
+        other = make_user('bob@example.com')
+        conversation = make_conversation(self.user, other)
+        messages = make_messages(conversation, other, 12)
+        limit = ConversationSerializer.last_messages_limit
+
+        _, response = self.count_queries()
+
+        result = response.data['results'][0]
+        self.assertEqual(
+            [m['message_id'] for m in result['last_messages']],
+            [str(m.message_id) for m in messages[-limit:]]
+        )
+        self.assertEqual(len(result['participants']), 2)
+
+
+class ConversationCreateTests(APITestCase):
+    def setUp(self):
+        self.user = make_user('alice@example.com')
+        self.client.force_authenticate(self.user)
+        self.url = reverse('conversation-list')
+
+    def create(self, participants):
+        return self.client.post(self.url, {'participants': participants}, format='json')
+
+    def test_creates_all_participants_in_constant_queries(self):
+        few = [str(make_user(f'few{i}@example.com').user_id) for i in range(2)]
+        many = [str(make_user(f'many{i}@example.com').user_id) for i in range(30)]
+
+        with CaptureQueriesContext(connection) as few_queries:
+            response = self.create(few)
+        self.assertEqual(response.status_code, 201)
+        with CaptureQueriesContext(connection) as many_queries:
+            response = self.create(many)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(few_queries), len(many_queries))
+        conversation = Conversation.objects.get(conversation_id=response.data['conversation_id'])
+        self.assertEqual(conversation.participants.count(), 31)
+
+    def test_unknown_ids_are_reported_together(self):
+        known = str(make_user('bob@example.com').user_id)
+        missing = str(uuid.uuid4())
+
+        response = self.create([known, missing, 'not-a-uuid'])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.data['participants']), 2)
+        self.assertIn(f'Unknown user ID: {missing}', response.data['participants'])
+        self.assertIn('Unknown user ID: not-a-uuid', response.data['participants'])
+        self.assertFalse(Conversation.objects.exists())
+
+
+class HotQueryIndexTests(TestCase):
+    def test_planner_uses_declared_indexes(self):
+        user = make_user('alice@example.com')
+        conversation = make_conversation(user)
+        out = StringIO()
+
+        call_command(
+            'explain_hot_queries',
+            conversation=conversation.conversation_id,
+            user=user.user_id,
+            stdout=out
+        )
+
+        self.assertEqual(out.getvalue().count('\nuses '), 5)
+        self.assertNotIn('without bounding', out.getvalue())
+
+    def test_plan_bounds_reads_the_index_condition(self):
+        self.assertTrue(plan_bounds(
+            'SEARCH chats_message USING INDEX idx (conversation_id=? AND sent_at>?)', 'sent_at'
+        ))
+        self.assertFalse(plan_bounds(
+            'SEARCH chats_message USING INDEX idx (conversation_id=?)', 'sent_at'
+        ))
+        self.assertTrue(plan_bounds(
+            "Index Cond: ((conversation_id = '1'::uuid) AND (sent_at >= now()))", 'sent_at'
+        ))
+
+
+class MembershipCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('alice@example.com')
+        self.other = make_user('bob@example.com')
+        self.conversation = make_conversation(self.user, self.other)
+        self.factory = APIRequestFactory()
+
+    def request_for(self, user):
+        request = self.factory.get('/')
+        request.user = user
+        return request
+
+    def test_many_permission_checks_cost_one_query(self):
+        make_messages(self.conversation, self.other, 20)
+        foreign_conversation = make_conversation(self.other)
+        make_messages(foreign_conversation, self.other, 1)
+        messages = list(Message.objects.filter(conversation=self.conversation))
+        foreign = Message.objects.get(conversation=foreign_conversation)
+        request = self.request_for(self.user)
+        permission = IsParticipantOfConversation()
+
+        with self.assertNumQueries(1):
+            allowed = [permission.has_object_permission(request, None, m) for m in messages]
+            denied = permission.has_object_permission(request, None, foreign)
+
+        self.assertTrue(all(allowed))
+        self.assertFalse(denied)
+
+    def test_cache_is_shared_between_requests(self):
+        get_conversation_ids(self.request_for(self.user))
+
+        with self.assertNumQueries(0):
+            ids = get_conversation_ids(self.request_for(self.user))
+
+        self.assertEqual(ids, {self.conversation.conversation_id})
+
+    def test_creating_a_conversation_invalidates_membership(self):
+        get_conversation_ids(self.request_for(self.other))
+        self.client.force_authenticate(self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('conversation-list'),
+                {'participants': [str(self.other.user_id), str(self.user.user_id)]},
+                format='json'
+            )
+
+        ids = get_conversation_ids(self.request_for(self.other))
+        self.assertIn(uuid.UUID(response.data['conversation_id']), ids)
+
+
+class ConversationActivityTests(APITestCase):
+    def setUp(self):
+        self.user = make_user('alice@example.com')
+        self.other = make_user('bob@example.com')
+        self.client.force_authenticate(self.user)
+
+    def post_message(self, conversation, body='hello'):
+        url = reverse('message-list', kwargs={'conversation_pk': conversation.conversation_id})
+        response = self.client.post(url, {'message_body': body, 'conversation': str(conversation.pk)}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Message.objects.get(message_id=response.data['message_id'])
+
+    def test_posting_a_message_updates_activity(self):
+        conversation = make_conversation(self.user, self.other)
+
+        self.post_message(conversation)
+        message = self.post_message(conversation)
+
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.message_count, 2)
+        self.assertEqual(conversation.last_message_id, message.message_id)
+        self.assertEqual(conversation.last_message_at, message.sent_at)
+
+    def test_ordering_by_recent_activity(self):
+        quiet = make_conversation(self.user, self.other)
+        busy = make_conversation(self.user, self.other)
+        self.post_message(quiet)
+        self.post_message(busy)
+
+        response = self.client.get(reverse('conversation-list'), {'ordering': '-last_message_at'})
+
+        self.assertEqual(
+            [c['conversation_id'] for c in response.data['results']],
+            [str(busy.pk), str(quiet.pk)]
+        )
+
+    def test_reconcile_command_backfills_existing_data(self):
+        conversations = [make_conversation(self.user, self.other) for _ in range(3)]
+        for i, conversation in enumerate(conversations):
+            make_messages(conversation, self.other, i)
+        expected = {
+            c.pk: c.messages.order_by('-sent_at', '-message_id').first() for c in conversations
+        }
+
+        call_command('reconcile_conversation_activity', batch_size=2, stdout=StringIO())
+
+        for conversation in conversations:
+            conversation.refresh_from_db()
+            latest = expected[conversation.pk]
+            self.assertEqual(conversation.message_count, conversation.messages.count())
+            self.assertEqual(conversation.last_message_id, latest and latest.message_id)
+            self.assertEqual(conversation.last_message_at, latest and latest.sent_at)
+
+        out = StringIO()
+        call_command('reconcile_conversation_activity', stdout=out)
+        self.assertIn('fixed 0', out.getvalue())
+
+    def test_reconcile_keeps_messages_recorded_during_the_run(self):
+        conversation = make_conversation(self.user, self.other)
+        make_messages(conversation, self.other, 3)
+        drifted = ReconcileCommand.drifted
+
+        def send_after_the_check(conversation):
+            # A sender records a message between the check and the write
+            result = drifted(conversation)
+            message = Message.objects.create(
+                conversation_id=conversation.pk, sender=self.user, message_body='late'
+            )
+            Conversation(pk=conversation.pk).record_messages([message])
+            return result
+
+        with mock.patch.object(ReconcileCommand, 'drifted', staticmethod(send_after_the_check)):
+            call_command('reconcile_conversation_activity', stdout=StringIO())
+
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.message_count, 4)
+        self.assertEqual(conversation.last_message.message_body, 'late')
+
+
+class MessageBatchCreateTests(APITestCase):
+    def setUp(self):
+        self.user = make_user('alice@example.com')
+        self.other = make_user('bob@example.com')
+        self.conversation = make_conversation(self.user, self.other)
+        self.client.force_authenticate(self.user)
+        self.url = reverse(
+            'message-batch-create',
+            kwargs={'conversation_pk': self.conversation.conversation_id}
+        )
+
+    def test_creates_valid_items_and_reports_invalid_ones(self):
+        payload = [{'message_body': f'replayed {i}'} for i in range(3)]
+        payload.insert(1, {'message_body': ''})
+
+        response = self.client.post(self.url, payload, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual([e['index'] for e in response.data['errors']], [1])
+        self.assertEqual(self.conversation.messages.count(), 3)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.message_count, 3)
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        small = [{'message_body': 'hi'}] * 5
+        large = [{'message_body': 'hi'}] * 150
+        # Warm the membership cache so both requests do the same lookups
+        self.client.post(self.url, small, format='json')
+
+        with CaptureQueriesContext(connection) as small_queries:
+            self.client.post(self.url, small, format='json')
+        with CaptureQueriesContext(connection) as large_queries:
+            self.client.post(self.url, large, format='json')
+
+        self.assertEqual(len(small_queries), len(large_queries))
+        self.assertEqual(self.conversation.messages.count(), 160)
+
+    def test_non_participants_are_rejected(self):
+        self.client.force_authenticate(make_user('eve@example.com'))
+
+        response = self.client.post(self.url, [{'message_body': 'hi'}], format='json')
+
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(self.conversation.messages.exists())
+
+    def test_all_invalid_batch_is_a_bad_request(self):
+        response = self.client.post(self.url, [{}, {'message_body': ''}], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.data['errors']), 2)
+
+
+class MessageListSerializerTests(TestCase):
+    def test_output_matches_message_serializer_byte_for_byte(self):
+        alice = make_user('alice@example.com', phone_number='+22901020304')
+        bob = make_user('bob@example.com', role='host')
+        conversation = make_conversation(alice, bob)
+        make_messages(conversation, alice, 3)
+        make_messages(conversation, bob, 3)
+        queryset = Message.objects.filter(conversation=conversation)
+        renderer = JSONRenderer()
+
+        expected = renderer.render(MessageSerializer(queryset.select_related('sender'), many=True).data)
+        rows = list(MessageListSerializer.values(queryset))
+        with self.assertNumQueries(1):
+            actual = renderer.render(MessageListSerializer(rows).data)
+
+        self.assertEqual(actual, expected)
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        self.user = make_user('alice@example.com')
+        self.other = make_user('bob@example.com')
+        self.conversation = make_conversation(self.user, self.other)
+        make_messages(self.conversation, self.other, 3)
+        call_command('reconcile_conversation_activity', stdout=StringIO())
+        self.client.force_authenticate(self.user)
+        self.messages_url = reverse(
+            'message-list',
+            kwargs={'conversation_pk': self.conversation.conversation_id}
+        )
+        self.conversations_url = reverse('conversation-list')
+
+    def post_message(self):
+        self.client.post(self.messages_url, {'message_body': 'new', 'conversation': str(self.conversation.pk)}, format='json')
+
+    def test_unchanged_message_list_is_not_modified(self):
+        etag = self.client.get(self.messages_url)['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.messages_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_new_message_changes_message_list_etag(self):
+        etag = self.client.get(self.messages_url)['ETag']
+        self.post_message()
+
+        response = self.client.get(self.messages_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 4)
+
+    def test_etag_depends_on_query_string(self):
+        etag = self.client.get(self.messages_url)['ETag']
+
+        response = self.client.get(self.messages_url, {'page_size': 2}, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_message_in_the_same_second_is_not_hidden_by_if_modified_since(self):
+        response = self.client.get(self.messages_url)
+        self.assertNotIn('Last-Modified', response)
+        self.post_message()
+
+        # Within the second of the first response, as far as HTTP dates go
+        response = self.client.get(
+            self.messages_url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 1)
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 4)
+
+    def test_conversation_list_is_validated_per_user(self):
+        etag = self.client.get(self.conversations_url)['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.conversations_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.force_authenticate(self.other)
+        response = self.client.get(self.conversations_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_new_conversation_changes_conversation_list_etag(self):
+        etag = self.client.get(self.conversations_url)['ETag']
+        make_conversation(self.user, make_user('carol@example.com'))
+
+        response = self.client.get(self.conversations_url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+
+
+class MessageDeltaTests(APITestCase):
+    def setUp(self):
+        self.user = make_user('alice@example.com')
+        self.other = make_user('bob@example.com')
+        self.conversation = make_conversation(self.user, self.other)
+        self.client.force_authenticate(self.user)
+        self.url = reverse(
+            'message-list',
+            kwargs={'conversation_pk': self.conversation.conversation_id}
+        )
+
+    def test_since_returns_only_newer_messages(self):
+        make_messages(self.conversation, self.other, 3)
+        since = self.client.get(self.url).data['since']
+        newer = make_messages(self.conversation, self.other, 2, start=timezone.now())
+
+        response = self.client.get(self.url, {'since': since})
+
+        self.assertEqual(
+            [m['message_id'] for m in response.data['results']],
+            [str(m.message_id) for m in newer]
+        )
+        self.assertFalse(response.data['has_more'])
+
+    def test_since_token_is_kept_when_nothing_is_new(self):
+        make_messages(self.conversation, self.other, 3)
+        since = self.client.get(self.url).data['since']
+
+        response = self.client.get(self.url, {'since': since})
+
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(response.data['since'], since)
+
+    def test_poll_at_the_newest_message_is_an_index_range(self):
+        make_messages(self.conversation, self.other, 3)
+        since = self.client.get(self.url).data['since']
+        executed = []
+
+        def capture(execute, sql, params, many, context):
+            executed.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(capture):
+            self.client.get(self.url, {'since': since})
+
+        # The poll position is usually the newest message: scanning from the
+        # start of the conversation would make it the most expensive one.
+        # Planned with bound parameters, as it runs: SQLite plans literals
+        # differently
+        sql, params = next(
+            (sql, params) for sql, params in executed
+            if sql.startswith('SELECT') and 'FROM "chats_message"' in sql
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = '\n'.join(row[-1] for row in cursor.fetchall())
+        self.assertTrue(plan_bounds(plan, 'sent_at'), plan)
+
+
+class MessageNotifierTests(SimpleTestCase):
+    async def test_thousand_waiters_are_woken_by_one_notify(self):
+        notifier = MessageNotifier()
+        started = asyncio.Event()
+
+        async def waiter():
+            with notifier.listen('conversation') as subscription:
+                if notifier.waiting('conversation') == 1000:
+                    started.set()
+                return await subscription.wait(5)
+
+        tasks = [asyncio.create_task(waiter()) for _ in range(1000)]
+        await asyncio.wait_for(started.wait(), 5)
+        # perform_create notifies from a request thread, not the event loop
+        thread = threading.Thread(target=notifier.notify, args=('conversation',))
+        thread.start()
+        results = await asyncio.wait_for(asyncio.gather(*tasks), 5)
+        thread.join()
+
+        self.assertEqual(results, [True] * 1000)
+        self.assertEqual(notifier.waiting(), 0)
+
+    async def test_wait_times_out(self):
+        notifier = MessageNotifier()
+
+        with notifier.listen('conversation') as subscription:
+            woken = await subscription.wait(0.01)
+
+        self.assertFalse(woken)
+        self.assertEqual(notifier.waiting(), 0)
+
+
+class MessageLongPollTests(TestCase):
+    def setUp(self):
+        self.user = make_user('alice@example.com')
+        self.other = make_user('bob@example.com')
+        self.conversation = make_conversation(self.user, self.other)
+        make_messages(self.conversation, self.other, 2)
+        token = RefreshToken.for_user(self.user).access_token
+        self.async_client = AsyncClient()
+        self.headers = {'authorization': f'Bearer {token}'}
+        self.url = reverse(
+            'message-updates',
+            kwargs={'conversation_pk': self.conversation.conversation_id}
+        )
+
+    async def test_returns_when_a_message_is_committed(self):
+        since = (await self.async_client.get(self.url, headers=self.headers)).json()['since']
+
+        def send():
+            message = make_messages(self.conversation, self.other, 1, start=timezone.now())[0]
+            message_notifier.notify(self.conversation.pk)
+            return message
+
+        async def send_later():
+            while not message_notifier.waiting(self.conversation.pk):
+                await asyncio.sleep(0.01)
+            return await sync_to_async(send)()
+
+        response, message = await asyncio.gather(
+            self.async_client.get(self.url, {'since': since, 'wait': 5}, headers=self.headers),
+            send_later()
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [m['message_id'] for m in response.json()['results']],
+            [str(message.message_id)]
+        )
+
+    async def test_times_out_with_no_new_messages(self):
+        since = (await self.async_client.get(self.url, headers=self.headers)).json()['since']
+
+        response = await self.async_client.get(
+            self.url, {'since': since, 'wait': 0.05}, headers=self.headers
+        )
+
+        self.assertEqual(response.json(), {'since': since, 'has_more': False, 'results': []})
+
+    async def test_requires_membership(self):
+        outsider = await sync_to_async(make_user)('eve@example.com')
+        token = RefreshToken.for_user(outsider).access_token
+
+        response = await self.async_client.get(
+            self.url, headers={'authorization': f'Bearer {token}'}
+        )
+
+        self.assertEqual(response.status_code, 403)
+
+
+class MessageExportTests(APITestCase):
+    def setUp(self):
+        self.user = make_user('alice@example.com')
+        self.other = make_user('bob@example.com')
+        self.conversation = make_conversation(self.user, self.other)
+        self.messages = make_messages(self.conversation, self.user, 5) + make_messages(
+            self.conversation, self.other, 5, start=timezone.now() - timedelta(hours=1)
+        )
+        self.client.force_authenticate(self.user)
+        self.url = reverse(
+            'message-export',
+            kwargs={'conversation_pk': self.conversation.conversation_id}
+        )
+
+    def test_ndjson_streams_the_whole_conversation_in_order(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(
+            [row['message_id'] for row in rows],
+            [str(message.message_id) for message in self.messages]
+        )
+        self.assertEqual(rows[-1]['sender_email'], 'bob@example.com')
+
+    def test_csv_export(self):
+        response = self.client.get(self.url, {'as': 'csv'})
+
+        content = b''.join(response.streaming_content).decode('utf-8')
+        rows = list(csv.DictReader(content.splitlines()))
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(rows[0]['message_body'], 'message 0')
+
+    def test_keyset_walk_crosses_chunk_boundaries(self):
+        queryset = Message.objects.filter(conversation=self.conversation)
+
+        with CaptureQueriesContext(connection) as queries:
+            lines = list(export_lines(queryset, 'ndjson', chunk_size=3))
+
+        self.assertEqual(len(lines), 10)
+        # 3 + 3 + 3 + 1 rows, the short chunk ends the walk
+        self.assertEqual(len(queries), 4)
+
+    def test_every_chunk_after_the_first_is_an_index_range(self):
+        queryset = Message.objects.filter(conversation=self.conversation)
+        executed = []
+
+        def capture(execute, sql, params, many, context):
+            executed.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(capture):
+            list(export_lines(queryset, 'ndjson', chunk_size=3))
+
+        # A chunk that scans from the start of the conversation makes the
+        # export quadratic in its length. Planned with bound parameters, as
+        # it runs: SQLite plans literals differently
+        with connection.cursor() as cursor:
+            for sql, params in executed[1:]:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                plan = '\n'.join(row[-1] for row in cursor.fetchall())
+                self.assertTrue(plan_bounds(plan, 'sent_at'), plan)
+
+    def test_rows_are_read_one_chunk_at_a_time(self):
+        make_messages(self.conversation, self.user, 2000)
+        queryset = Message.objects.filter(conversation=self.conversation)
+        lines = export_lines(queryset, 'ndjson', chunk_size=100)
+
+        # Memory stays flat if no query reads more than a chunk, and the
+        # next chunk is not read before the previous one was sent
+        with CaptureQueriesContext(connection) as queries:
+            for _ in zip(range(250), lines):
+                pass
+            self.assertEqual(len(queries), 3)
+            for _ in lines:
+                pass
+
+        # The short last chunk ends the walk
+        self.assertEqual(len(queries), math.ceil(2010 / 100))
+        self.assertTrue(all(query['sql'].endswith('LIMIT 100') for query in queries), queries)
+
+    def test_non_participants_are_rejected(self):
+        self.client.force_authenticate(make_user('eve@example.com'))
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_unknown_format_is_a_bad_request(self):
+        response = self.client.get(self.url, {'as': 'xml'})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_user_export_only_has_their_own_messages(self):
+        response = self.client.get(reverse('message-export-mine'))
+
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual({row['sender_id'] for row in rows}, {str(self.user.user_id)})
+
+    def test_command_exports_a_conversation(self):
+        out = StringIO()
+
+        call_command(
+            'export_messages', conversation=str(self.conversation.conversation_id),
+            export_format='csv', stdout=out
+        )
+
+        self.assertEqual(len(out.getvalue().splitlines()), 11)
+
+
+class MessageSearchTests(APITestCase):
+    def setUp(self):
+        self.user = make_user('alice@example.com')
+        self.other = make_user('bob@example.com')
+        self.conversation = make_conversation(self.user, self.other)
+        self.client.force_authenticate(self.user)
+        self.url = reverse(
+            'message-list',
+            kwargs={'conversation_pk': self.conversation.conversation_id}
+        )
+
+    def send(self, body, conversation=None):
+        return Message.objects.create(
+            conversation=conversation or self.conversation, sender=self.user, message_body=body
+        )
+
+    def search(self, query):
+        response = self.client.get(self.url, {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [item['message_body'] for item in response.data['results']]
+
+    def test_matches_every_word_of_the_query(self):
+        self.send('Lunch at noon?')
+        self.send('Noon works, see you at lunch')
+        self.send('Dinner then')
+
+        self.assertEqual(self.search('lunch noon'), ['Lunch at noon?', 'Noon works, see you at lunch'])
+        self.assertEqual(self.search('dinner'), ['Dinner then'])
+
+    def test_index_follows_edits_and_deletes(self):
+        message = self.send('draft')
+        message.message_body = 'final'
+        message.save()
+        self.assertEqual(self.search('draft'), [])
+        self.assertEqual(self.search('final'), ['final'])
+
+        message.delete()
+        self.assertEqual(self.search('final'), [])
+
+    def test_batch_created_messages_are_indexed(self):
+        batch_url = reverse(
+            'message-batch-create',
+            kwargs={'conversation_pk': self.conversation.conversation_id}
+        )
+        self.client.post(batch_url, [{'message_body': 'imported history'}], format='json')
+
+        self.assertEqual(self.search('imported'), ['imported history'])
+
+    def test_results_stay_in_the_users_conversations(self):
+        elsewhere = make_conversation(make_user('eve@example.com'), self.other)
+        self.send('secret plans', conversation=elsewhere)
+        self.url = reverse('message-list', kwargs={'conversation_pk': elsewhere.conversation_id})
+
+        self.assertEqual(self.search('secret'), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.send('a "quoted" word AND more')
+
+        self.assertEqual(self.search('"quoted OR'), [])
+        self.assertEqual(self.search('quoted AND'), ['a "quoted" word AND more'])
+
+    def test_fts5_query_quotes_every_word(self):
+        self.assertEqual(fts5_query(['say', '"hi"']), '"say" """hi"""')
+
+    def test_blank_query_is_ignored(self):
+        self.send('hello')
+
+        self.assertEqual(
+            search_messages(Message.objects.all(), '  ').count(), 1
+        )
+
+    def test_rebuild_command_reindexes_bulk_updates(self):
+        message = self.send('before')
+        Message.objects.filter(pk=message.pk).update(message_body='after')
+        self.assertEqual(self.search('after'), [])
+
+        call_command('rebuild_search_index', stdout=StringIO())
+
+        self.assertEqual(self.search('after'), ['after'])
+
+
+class MessageSearchTableRemakeTests(TransactionTestCase):
+    # The SQLite schema editor cannot run inside the transaction of a TestCase
+
+    def remake_message_table(self):
+        # Any AlterField on SQLite copies chats_message into a new table,
+        # which renumbers its implicit rowids
+        old_field = Message._meta.get_field('message_body')
+        new_field = models.TextField(null=True)
+        new_field.set_attributes_from_name('message_body')
+        with connection.schema_editor() as editor:
+            editor.alter_field(Message, old_field, new_field)
+        self.addCleanup(self.restore_message_table, new_field, old_field)
+
+    def restore_message_table(self, new_field, old_field):
+        with connection.schema_editor() as editor:
+            editor.alter_field(Message, new_field, old_field)
+
+    def test_index_survives_a_message_table_remake(self):
+        sender = make_user('alice@example.com')
+        conversation = make_conversation(sender, make_user('bob@example.com'))
+        first, *_ = [
+            Message.objects.create(conversation=conversation, sender=sender, message_body=body)
+            for body in ('first', 'second', 'third')
+        ]
+        # Leaves a gap in the rowids, which the copy closes
+        first.delete()
+        self.addCleanup(Message.objects.all().delete)
+
+        self.remake_message_table()
+
+        for body in ('second', 'third'):
+            self.assertEqual(
+                [message.message_body for message in search_messages(Message.objects.all(), body)],
+                [body]
+            )
+
+
+class SeedChatDataTests(TestCase):
+    def test_seeds_consistent_searchable_data(self):
+        call_command(
+            'seed_chat_data', users=5, conversations=4, messages=200, batch_size=60,
+            stdout=StringIO()
+        )
+
+        self.assertEqual(User.objects.filter(email__startswith='seed-').count(), 5)
+        self.assertEqual(Message.objects.count(), 200)
+        self.assertTrue(User.objects.get(email='seed-0@example.com').check_password('seed-password'))
+        for conversation in Conversation.objects.all():
+            self.assertEqual(conversation.message_count, conversation.messages.count())
+            senders = set(conversation.messages.values_list('sender_id', flat=True))
+            members = set(conversation.participants.values_list('user_id', flat=True))
+            self.assertLessEqual(senders, members)
+        # The busiest conversation gets far more than an even share
+        busiest = Conversation.objects.order_by('-message_count').first()
+        self.assertGreater(busiest.message_count, 200 / 4)
+        word = Message.objects.first().message_body.split()[0]
+        self.assertTrue(search_messages(Message.objects.all(), word).exists())
+
+    def test_refuses_to_seed_twice(self):
+        call_command('seed_chat_data', users=2, conversations=1, messages=0, stdout=StringIO())
+
+        with self.assertRaises(CommandError):
+            call_command('seed_chat_data', users=2, conversations=1, messages=0, stdout=StringIO())
+
+
+class LoadRunnerTests(LiveServerTestCase):
+    def test_percentile_is_nearest_rank(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile([7], 0.95), 7)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_runs_every_scenario_against_a_live_server(self):
+        call_command('seed_chat_data', users=3, conversations=3, messages=30, stdout=StringIO())
+
+        results = run_load(
+            f'{self.live_server_url}/api/', [('seed-0@example.com', 'seed-password')],
+            duration=1.5, concurrency=1,
+            weights={'list_conversations': 1, 'list_messages': 1,
+                     'paginate_messages': 1, 'create_message': 1},
+        )
+
+        summary = results.summary()
+        self.assertEqual(summary['total']['errors'], 0)
+        self.assertNotIn('login', summary)
+        for name in ('list_conversations', 'list_messages', 'paginate_messages', 'create_message'):
+            self.assertGreater(summary[name]['requests'], 0, name)
+        self.assertLessEqual(summary['total']['p50'], summary['total']['p99'])
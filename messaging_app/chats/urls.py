@@ -1,6 +1,6 @@
 from rest_framework.routers import DefaultRouter
 from django.urls import path, include
-from .views import ConversationViewSet, MessageViewSet
+from .views import ConversationViewSet, MessageViewSet, export_my_messages, message_updates
 from rest_framework import routers
 from rest_framework_nested.routers import NestedDefaultRouter
 
@@ -16,6 +16,13 @@ messages_router = NestedDefaultRouter(
 messages_router.register(r'messages', MessageViewSet, basename='message')
 
 urlpatterns = [
+    # Before the nested router, whose message detail route would match "updates"
+    path(
+        'conversations/<str:conversation_pk>/messages/updates/',
+        message_updates,
+        name='message-updates'
+    ),
+    path('messages/export/', export_my_messages, name='message-export-mine'),
     path('', include(router.urls)),
     path('', include(messages_router.urls)),
 ]
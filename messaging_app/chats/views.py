@@ -1,22 +1,43 @@
+import uuid
 from rest_framework import viewsets, status, filters
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import AuthenticationFailed, NotFound
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.http import Http404, JsonResponse
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition, require_GET
 from .models import User, Conversation, Message, ConversationParticipant
-from .serializers import ConversationSerializer, MessageSerializer
+from .serializers import ConversationSerializer, MessageSerializer, MessageIngestSerializer, MessageListSerializer
+from .signals import messages_created
 from .permissions import IsOwnerOrParticipant
 from .permissions import IsParticipantOfConversation
-from .pagination import MessagePagination
+from .pagination import MessagePagination, MessageCursorPagination, MessageDeltaPagination
+from .export import FORMATS as EXPORT_FORMATS, export_response
 from .filters import MessageFilter
+from .membership import get_conversation_ids, invalidate_membership, load_conversation_ids
+from .notifier import message_notifier
+from .conditional import conversation_list_etag, message_list_etag
 import django_filters.rest_framework
 
+# Longest a message_updates request may be held open, in seconds
+LONG_POLL_MAX_WAIT = getattr(settings, 'CHATS_LONG_POLL_MAX_WAIT', 30)
 
+
+@method_decorator(condition(etag_func=conversation_list_etag), name='list')
 class ConversationViewSet(viewsets.ModelViewSet):
     serializer_class = ConversationSerializer
     permission_classes = [IsAuthenticated, IsParticipantOfConversation]
     http_method_names = ['get', 'post']  # Only allow list and create
     filter_backends = [filters.OrderingFilter]
-    ordering_fields = ['created_at']
+    ordering_fields = ['created_at', 'last_message_at']
     ordering = ['-created_at']
 
     def permission_denied(self, request, message=None):
@@ -24,26 +45,71 @@ class ConversationViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         # Get conversations where the current user is a participant
-        return self.request.user.conversations.all()
+        return ConversationSerializer.setup_eager_loading(
+            self.request.user.conversations.all()
+        )
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        conversation = serializer.save()
 
         # Add participants from request and current user
         participant_ids = set(request.data.get('participants', []))
         participant_ids.add(str(request.user.user_id))
 
-        # Create conversation participants
-        for user_id in participant_ids:
-            user = get_object_or_404(User, user_id=user_id)
-            ConversationParticipant.objects.get_or_create(
-                conversation=conversation,
-                user=user
+        user_ids, unknown_ids = self.resolve_participants(participant_ids)
+        if unknown_ids:
+            return Response(
+                {"participants": [f"Unknown user ID: {user_id}" for user_id in sorted(unknown_ids)]},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        with transaction.atomic():
+            conversation = serializer.save()
+            self.add_participants(conversation, user_ids)
+            # Cached membership sets of every participant are now stale
+            transaction.on_commit(lambda: invalidate_membership(user_ids))
+
+        # Reload with prefetching so the response does not query per participant
+        conversation = self.get_queryset().get(pk=conversation.pk)
+        return Response(self.get_serializer(conversation).data, status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    def resolve_participants(participant_ids):
+        """
+        Resolve participant IDs with a single IN query.
+
+        Returns the set of matching user IDs and the set of IDs that are
+        not valid UUIDs or do not belong to any user.
+        """
+        parsed, unknown_ids = {}, set()
+        for raw_id in participant_ids:
+            try:
+                parsed[uuid.UUID(str(raw_id))] = raw_id
+            except ValueError:
+                unknown_ids.add(str(raw_id))
+
+        user_ids = set(
+            User.objects.filter(user_id__in=parsed).values_list('user_id', flat=True)
+        )
+        unknown_ids.update(str(parsed[user_id]) for user_id in parsed.keys() - user_ids)
+        return user_ids, unknown_ids
+
+    @staticmethod
+    def add_participants(conversation, user_ids):
+        """
+        Insert all participants in one statement, skipping existing members.
+        """
+        ConversationParticipant.objects.bulk_create(
+            [
+                ConversationParticipant(conversation=conversation, user_id=user_id)
+                for user_id in user_ids
+            ],
+            ignore_conflicts=True
+        )
+        Conversation.objects.filter(pk=conversation.pk).update(
+            membership_version=F('membership_version') + 1
+        )
 
 class MessageViewSet(viewsets.ModelViewSet):
     serializer_class = MessageSerializer
@@ -52,24 +118,214 @@ class MessageViewSet(viewsets.ModelViewSet):
     ordering = ['sent_at']
     ordering_fields = ['sent_at']
     filter_backends = [filters.OrderingFilter, django_filters.rest_framework.DjangoFilterBackend]
-    pagination_class = MessagePagination
+    pagination_class = MessageCursorPagination
     filterset_class = MessageFilter
+    batch_max_size = 5000  # Messages accepted by one batch_create request
+    batch_chunk_size = 500  # Rows per INSERT statement in batch_create
 
     def permission_denied(self, request, message=None):
         return Response({"detail": message or "You do not have permission to perform this action."}, status=status.HTTP_403_FORBIDDEN)
 
+    @property
+    def paginator(self):
+        # Clients that still send ?page=N keep the page-number pagination,
+        # ?since= polls for new messages, everyone else walks the history
+        # with keyset cursors
+        if not hasattr(self, '_paginator'):
+            if 'page' in self.request.query_params:
+                self._paginator = MessagePagination()
+            elif 'since' in self.request.query_params:
+                self._paginator = MessageDeltaPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
     def get_queryset(self):
         return Message.objects.filter(
-            conversation__conversation_id=self.kwargs['conversation_id']
-        )
+            conversation__conversation_id=self.kwargs['conversation_pk']
+        ).select_related('sender')
+
+    @method_decorator(condition(etag_func=message_list_etag))
+    def list(self, request, *args, **kwargs):
+        # Read path: format .values() rows instead of running MessageSerializer per row
+        queryset = MessageListSerializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(MessageListSerializer(page).data)
+        return Response(MessageListSerializer(list(queryset)).data)
 
     def perform_create(self, serializer):
         # Automatically set sender and conversation
         conversation = get_object_or_404(
             Conversation,
-            conversation_id=self.kwargs['conversation_id']
+            conversation_id=self.kwargs['conversation_pk']
+        )
+        with transaction.atomic():
+            message = serializer.save(
+                sender=self.request.user,
+                conversation=conversation
+            )
+            conversation.record_messages([message])
+            transaction.on_commit(lambda: message_notifier.notify(conversation.pk))
+
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch_create(self, request, *args, **kwargs):
+        """
+        Ingest a list of messages into one conversation.
+
+        Invalid items are reported by index and do not abort the batch.
+        """
+        conversation = get_object_or_404(
+            Conversation,
+            conversation_id=self.kwargs['conversation_pk']
+        )
+        if conversation.pk not in get_conversation_ids(request):
+            return Response(
+                {"detail": "You are not a participant of this conversation."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        serializer = MessageIngestSerializer(
+            data=request.data, many=True, max_length=self.batch_max_size
+        )
+        serializer.is_valid(raise_exception=True)
+        errors = serializer.item_errors
+        if not serializer.validated_data:
+            return Response({"created": 0, "message_ids": [], "errors": errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        messages = [
+            Message(sender=request.user, conversation=conversation, **item)
+            for item in serializer.validated_data
+        ]
+        with transaction.atomic():
+            Message.objects.bulk_create(messages, batch_size=self.batch_chunk_size)
+            messages_created.send(sender=Message, messages=messages, using=messages[0]._state.db)
+            conversation.record_messages(messages)
+            transaction.on_commit(lambda: message_notifier.notify(conversation.pk))
+
+        return Response({
+            "created": len(messages),
+            "message_ids": [str(message.message_id) for message in messages],
+            "errors": errors,
+        }, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request, *args, **kwargs):
+        """
+        Stream the whole conversation: GET ?as=ndjson|csv.
+
+        Not paginated: rows are written out as they are read, so the size of
+        the conversation does not change the memory used.
+        """
+        conversation = get_object_or_404(
+            Conversation,
+            conversation_id=self.kwargs['conversation_pk']
+        )
+        if conversation.pk not in get_conversation_ids(request):
+            return Response(
+                {"detail": "You are not a participant of this conversation."},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        export_format = _export_format(request)
+        if export_format is None:
+            return _unknown_export_format()
+        return export_response(
+            Message.objects.filter(conversation=conversation), export_format,
+            filename=f'conversation-{conversation.pk}'
+        )
+
+
+def _export_format(request):
+    export_format = request.query_params.get('as', 'ndjson')
+    if export_format not in EXPORT_FORMATS:
+        return None
+    return export_format
+
+
+def _unknown_export_format():
+    return Response(
+        {"as": [f"Choose one of: {', '.join(EXPORT_FORMATS)}."]},
+        status=status.HTTP_400_BAD_REQUEST
+    )
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_my_messages(request):
+    """
+    Stream every message sent by the requesting user: GET ?as=ndjson|csv.
+    """
+    export_format = _export_format(request)
+    if export_format is None:
+        return _unknown_export_format()
+    return export_response(
+        Message.objects.filter(sender=request.user), export_format,
+        filename=f'messages-{request.user.pk}'
+    )
+
+
+def _authenticate(request):
+    """
+    Run the configured DRF authenticators on a plain Django request.
+    """
+    drf_request = Request(
+        request,
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    )
+    try:
+        user = drf_request.user
+    except AuthenticationFailed:
+        return None, drf_request
+    if not user or not user.is_authenticated:
+        return None, drf_request
+    return user, drf_request
+
+
+def _message_delta(drf_request, conversation_id):
+    paginator = MessageDeltaPagination()
+    queryset = MessageListSerializer.values(Message.objects.filter(conversation_id=conversation_id))
+    rows = paginator.paginate_queryset(queryset, drf_request)
+    return rows, paginator.get_paginated_response(MessageListSerializer(rows).data).data
+
+
+@require_GET
+async def message_updates(request, conversation_pk):
+    """
+    Long-poll for new messages: GET ?since=<token>&wait=<seconds>.
+
+    Answers at once when there are messages newer than `since`, otherwise
+    holds the request until one is committed or `wait` seconds pass. The
+    wait is an awaited future, so it costs no worker thread.
+    """
+    user, drf_request = await sync_to_async(_authenticate)(request)
+    if user is None:
+        return JsonResponse(
+            {"detail": "Authentication credentials were not provided."},
+            status=status.HTTP_401_UNAUTHORIZED
         )
-        serializer.save(
-            sender=self.request.user,
-            conversation=conversation
+    try:
+        conversation_id = uuid.UUID(str(conversation_pk))
+    except ValueError:
+        raise Http404
+    if conversation_id not in await sync_to_async(load_conversation_ids)(user.pk):
+        return JsonResponse(
+            {"detail": "You are not a participant of this conversation."},
+            status=status.HTTP_403_FORBIDDEN
         )
+
+    try:
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        wait = 0
+    wait = min(wait, LONG_POLL_MAX_WAIT) if wait > 0 else 0
+
+    try:
+        with message_notifier.listen(conversation_id) as subscription:
+            rows, data = await sync_to_async(_message_delta)(drf_request, conversation_id)
+            if not rows and wait:
+                await subscription.wait(wait)
+                rows, data = await sync_to_async(_message_delta)(drf_request, conversation_id)
+    except NotFound as exc:
+        return JsonResponse({"detail": str(exc.detail)}, status=status.HTTP_404_NOT_FOUND)
+    return JsonResponse(data)